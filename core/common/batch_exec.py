@@ -0,0 +1,124 @@
+import base64
+import json
+import subprocess
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from core.common.logger import Logger
+
+
+logger = Logger(__name__, log_level="INFO", console_output=True)
+
+RESULT_MARKER = "__QA_RESULT__"
+
+
+@dataclass
+class CommandResult:
+    name: str
+    exit_code: int
+    stdout: str
+    stderr: str
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+
+def build_batch_script(commands: dict[str, str]) -> str:
+    """
+    Generate a POSIX sh script that runs each command in its own subshell and
+    prints one marker-prefixed JSON line per command with its exit code and
+    base64-encoded stdout/stderr.
+    """
+    lines = ["__qa_out=$(mktemp); __qa_err=$(mktemp)"]
+    for index, command in enumerate(commands.values()):
+        lines.extend([
+            # Newlines around the command keep trailing comments from swallowing the ')'.
+            f"(\n{command}\n) >\"$__qa_out\" 2>\"$__qa_err\" </dev/null",
+            "__qa_rc=$?",
+            f"printf '{RESULT_MARKER} {{\"index\": {index}, \"exit_code\": %d, \"stdout\": \"%s\", \"stderr\": \"%s\"}}\\n' "
+            "\"$__qa_rc\" \"$(base64 <\"$__qa_out\" | tr -d '\\n')\" \"$(base64 <\"$__qa_err\" | tr -d '\\n')\"",
+        ])
+    lines.append("rm -f \"$__qa_out\" \"$__qa_err\"")
+    return "\n".join(lines) + "\n"
+
+
+def parse_batch_output(commands: dict[str, str], output: str) -> dict[str, CommandResult]:
+    names = list(commands.keys())
+    results = {}
+    for line in output.splitlines():
+        if not line.startswith(RESULT_MARKER):
+            continue
+        record = json.loads(line[len(RESULT_MARKER):])
+        name = names[record["index"]]
+        results[name] = CommandResult(
+            name=name,
+            exit_code=record["exit_code"],
+            stdout=base64.b64decode(record["stdout"]).decode("utf-8", errors="replace").strip(),
+            stderr=base64.b64decode(record["stderr"]).decode("utf-8", errors="replace").strip(),
+        )
+    # Commands the script never reported on (e.g. the shell died) count as failures.
+    for name in names:
+        if name not in results:
+            results[name] = CommandResult(name=name, exit_code=-1, stdout="", stderr="no result returned")
+    return results
+
+
+def run_batch(conn, commands: dict[str, str], timeout: float | None = None) -> dict[str, CommandResult]:
+    """
+    Run a named set of commands in a single round trip.
+
+    Args:
+        conn: SSH connection (or pooled handle); None runs the batch locally.
+        commands: Mapping of result name -> shell command. Commands run sequentially, in order.
+        timeout: Optional channel timeout in seconds.
+
+    Returns:
+        Mapping of result name -> CommandResult.
+    """
+    if not commands:
+        return {}
+    script = build_batch_script(commands)
+    try:
+        if conn is None:
+            result = subprocess.run(["sh", "-s"], input=script, text=True, capture_output=True, timeout=timeout)
+            output = result.stdout
+        else:
+            stdin, stdout, _ = conn.exec_command("sh -s", timeout=timeout)
+            stdin.write(script)
+            stdin.channel.shutdown_write()
+            output = stdout.read().decode("utf-8", errors="replace")
+    except Exception as e:
+        logger.error(f"Batch execution failed: {e}")
+        output = ""
+    return parse_batch_output(commands, output)
+
+
+def _run_single(conn, name: str, command: str, timeout: float | None) -> CommandResult:
+    try:
+        _, stdout, stderr = conn.exec_command(command, timeout=timeout)
+        out = stdout.read().decode("utf-8", errors="replace").strip()
+        err = stderr.read().decode("utf-8", errors="replace").strip()
+        return CommandResult(name=name, exit_code=stdout.channel.recv_exit_status(), stdout=out, stderr=err)
+    except Exception as e:
+        return CommandResult(name=name, exit_code=-1, stdout="", stderr=str(e))
+
+
+def run_concurrent(
+    conn,
+    commands: dict[str, str],
+    max_workers: int = 8,
+    timeout: float | None = None,
+) -> dict[str, CommandResult]:
+    """
+    Run independent commands concurrently, each on its own channel of the same
+    SSH transport. Useful for long-running commands that shouldn't serialize
+    behind each other in a batch script.
+    """
+    if not commands:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(commands)))) as pool:
+        futures = {
+            name: pool.submit(_run_single, conn, name, command, timeout)
+            for name, command in commands.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
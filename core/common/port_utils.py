@@ -1,44 +1,106 @@
+import time
 import socket
 import logging
-from typing import Optional, Tuple
+import threading
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# Listening TCP sockets in one round trip; netstat for hosts without iproute2
+LISTENING_PORTS_CMD = "ss -Hltn 2>/dev/null || netstat -ltn 2>/dev/null"
+
+def is_local_port_free(port: int, host: str = "127.0.0.1") -> bool:
+    """
+    Check whether a local port can be bound, the same way the SSH tunnel binds it.
+
+    Args:
+        port: Port to check.
+        host: Local address to bind.
+
+    Returns:
+        True if the port can be bound, False otherwise.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+        return True
 
 def find_available_port(start_port: int = 8000, end_port: int = 9000) -> Optional[int]:
     """
     Find an available local port within the specified range.
-    
+
     Args:
         start_port: The lower bound of the port range to search.
         end_port: The upper bound of the port range to search.
-        
+
     Returns:
         An available local port number or None if no ports are available.
     """
     for port in range(start_port, end_port + 1):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(0.1)
-            result = sock.connect_ex(('127.0.0.1', port))
-            if result != 0:  # Port is available locally
-                return port
+        # A bind attempt fails immediately, unlike a connect probe that waits for a timeout
+        if is_local_port_free(port):
+            return port
+    return None
+
+def parse_listening_ports(output: str) -> Set[int]:
+    """
+    Parse the local ports out of `ss -Hltn` or `netstat -ltn` output.
+
+    Both put the local address in the fourth column, e.g. `0.0.0.0:22`,
+    `[::]:8000` or `*:8080`. Header lines have no numeric port there and are skipped.
+    """
+    ports = set()
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        _, sep, port = fields[3].rpartition(":")
+        if sep and port.isdigit():
+            ports.add(int(port))
+    return ports
+
+def list_remote_listening_ports(ssh_conn) -> Set[int]:
+    """
+    Fetch every listening TCP port on a remote machine with a single SSH command.
+
+    Args:
+        ssh_conn: SSH connection object.
+
+    Returns:
+        The set of ports in use.
+
+    Raises:
+        RuntimeError: If neither ss nor netstat produced output.
+    """
+    _, stdout, _ = ssh_conn.exec_command(LISTENING_PORTS_CMD)
+    output = stdout.read().decode()
+    if not output.strip():
+        # A host always listens on something (sshd at least), so no output means no tool
+        raise RuntimeError("Could not list listening ports on remote host (ss and netstat unavailable)")
+    return parse_listening_ports(output)
+
+def first_free_port(used: Iterable[int], start_port: int = 8000, end_port: int = 9000) -> Optional[int]:
+    """Return the lowest port in [start_port, end_port] not in `used`, or None"""
+    used = set(used)
+    for port in range(start_port, end_port + 1):
+        if port not in used:
+            return port
     return None
 
 def check_remote_port_availability(ssh_conn, port: int) -> bool:
     """
     Check if a port is available on a remote machine via SSH.
-    
+
     Args:
         ssh_conn: SSH connection object.
         port: Port to check.
-        
+
     Returns:
         True if the port is available, False otherwise.
     """
     try:
-        # Use netstat to check if the port is in use on the remote host
-        cmd = f"netstat -tuln | grep ':{port} '"
-        _, stdout, _ = ssh_conn.exec_command(cmd)
-        output = stdout.read().decode()
-        # If output is empty, the port is available
-        return not output.strip()
+        return port not in list_remote_listening_ports(ssh_conn)
     except Exception as e:
         logging.error(f"Error checking remote port availability: {e}")
         # If there's an error, assume the port is not available to be safe
@@ -46,39 +108,114 @@ def check_remote_port_availability(ssh_conn, port: int) -> bool:
 
 def find_available_remote_port(ssh_conn, start_port: int = 8000, end_port: int = 9000) -> Optional[int]:
     """
-    Find an available remote port within the specified range by checking via SSH.
-    
+    Find an available remote port within the specified range.
+    The remote socket table is fetched once and the range is scanned locally.
+
     Args:
         ssh_conn: SSH connection object.
         start_port: The lower bound of the port range to search.
         end_port: The upper bound of the port range to search.
-        
+
     Returns:
         An available remote port number or None if no ports are available.
     """
-    for port in range(start_port, end_port + 1):
-        if check_remote_port_availability(ssh_conn, port):
+    try:
+        used = list_remote_listening_ports(ssh_conn)
+    except Exception as e:
+        logging.error(f"Error listing remote ports: {e}")
+        return None
+    return first_free_port(used, start_port, end_port)
+
+
+class RemotePortAllocator:
+    """
+    Hands out remote ports without two concurrent deploys picking the same one.
+
+    A port counts as taken if it is listening on the host or reserved here.
+    Reservations are held until released (normally once the container has bound
+    the port) or until reservation_ttl seconds pass, so a deploy that dies
+    without releasing cannot leak ports forever.
+    """
+    def __init__(self, reservation_ttl: float = 600.0):
+        self.reservation_ttl = reservation_ttl
+        self._lock = threading.Lock()
+        self._reserved: Dict[str, Dict[int, float]] = {}  # host -> port -> expiry
+
+    def _active(self, host: str) -> Dict[int, float]:
+        now = time.time()
+        reserved = self._reserved.setdefault(host, {})
+        for port in [p for p, expiry in reserved.items() if expiry <= now]:
+            del reserved[port]
+        return reserved
+
+    def allocate(
+        self,
+        ssh_conn,
+        host: str,
+        preferred: Optional[int] = None,
+        start_port: int = 8000,
+        end_port: int = 9000,
+    ) -> Optional[int]:
+        """
+        Reserve a free port on `host`, using `preferred` if it is free.
+
+        Args:
+            ssh_conn: SSH connection to the host.
+            host: Key identifying the host, e.g. its hostname.
+            preferred: Port to use if it is free.
+            start_port: The lower bound of the port range to search.
+            end_port: The upper bound of the port range to search.
+
+        Returns:
+            The reserved port, or None if no ports are available.
+        """
+        try:
+            # One remote round trip, outside the lock so other hosts are not held up
+            listening = list_remote_listening_ports(ssh_conn)
+        except Exception as e:
+            logging.error(f"Error listing remote ports: {e}")
+            return None
+        with self._lock:
+            reserved = self._active(host)
+            used = listening | set(reserved)
+            if preferred is not None and preferred not in used:
+                port = preferred
+            else:
+                port = first_free_port(used, start_port, end_port)
+            if port is not None:
+                reserved[port] = time.time() + self.reservation_ttl
             return port
-    return None
+
+    def release(self, host: str, port: int):
+        """Drop a reservation once the port is bound or no longer needed"""
+        with self._lock:
+            self._reserved.get(host, {}).pop(port, None)
+
+    def reserved(self, host: str) -> Set[int]:
+        with self._lock:
+            return set(self._active(host))
+
+
+REMOTE_PORTS = RemotePortAllocator()
 
 def find_available_ports(ssh_conn) -> Tuple[int, int]:
     """
     Find available ports for both local and remote use.
-    
+
     Args:
         ssh_conn: SSH connection object for remote port checking.
-        
+
     Returns:
         A tuple of (local_port, remote_port) that are available.
     """
     local_port = find_available_port()
     if local_port is None:
         raise RuntimeError("No available local ports found")
-    
+
     # Start remote search from the next port after the local port (or wrap-around)
     remote_start_port = local_port + 1 if local_port < 9000 else 8000
     remote_port = find_available_remote_port(ssh_conn, start_port=remote_start_port, end_port=9000)
     if remote_port is None:
         raise RuntimeError("No available remote ports found")
-    
-    return local_port, remote_port
\ No newline at end of file
+
+    return local_port, remote_port
@@ -1,6 +1,14 @@
+import select
+import socket
+import threading
+import time
 import paramiko
 from dataclasses import dataclass
 from pathlib import Path
+from core.common.logger import Logger
+
+
+logger = Logger(__name__, log_level="INFO", console_output=True)
 
 
 @dataclass 
@@ -15,6 +23,10 @@ class SSHConfig:
         if not (self.password or self.key_filename) or (self.password and self.key_filename): 
             raise ValueError("You must provide one of [password] OR [(private) key path]")
 
+    @property
+    def pool_key(self) -> tuple:
+        return (self.hostname, self.port, self.username, str(self.key_filename or ""))
+
 
 class SSH: 
 
@@ -39,4 +51,228 @@ class SSH:
         except paramiko.SSHException as ssh_exception:
             raise Exception(f"SSH exception: {ssh_exception}")
         except Exception as e:
-            raise Exception(f"Error: {e}")
\ No newline at end of file
+            raise Exception(f"Error: {e}")
+
+    @staticmethod
+    def acquire(ssh_config: SSHConfig) -> "PooledConnection":
+        """Borrow a shared connection from the default pool."""
+        return SSH_POOL.acquire(ssh_config)
+
+
+class PooledConnection:
+    """
+    Handle to a pooled SSHClient. Behaves like the client it wraps, except that
+    close() returns it to the pool instead of tearing down the transport.
+    Each exec_command opens its own channel, so handles can be used concurrently.
+    """
+
+    def __init__(self, pool: "SSHPool", key: tuple, client: paramiko.SSHClient):
+        self._pool = pool
+        self._key = key
+        self._client = client
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._key)
+
+
+class PortForward:
+    """
+    In-process local port forward over a pooled SSH transport. If given the
+    pooled connection it runs over, the forward holds that reference until
+    close() so the pool can't evict the transport from under it.
+    """
+
+    def __init__(
+        self,
+        transport: paramiko.Transport,
+        local_port: int,
+        remote_host: str,
+        remote_port: int,
+        connection: PooledConnection = None,
+    ):
+        self.transport = transport
+        self.local_port = local_port
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self._connection = connection
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", local_port))
+        self._server.listen(64)
+        # Resolve the real port if an ephemeral one (0) was requested.
+        self.local_port = self._server.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                client_sock, addr = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(client_sock, addr), daemon=True).start()
+
+    def _handle(self, client_sock: socket.socket, addr):
+        try:
+            channel = self.transport.open_channel(
+                "direct-tcpip", (self.remote_host, self.remote_port), addr
+            )
+        except Exception as e:
+            logger.error(f"Port forward to {self.remote_host}:{self.remote_port} failed: {e}")
+            client_sock.close()
+            return
+
+        try:
+            while self._running:
+                readable, _, _ = select.select([client_sock, channel], [], [], 1.0)
+                if client_sock in readable:
+                    data = client_sock.recv(32768)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in readable:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    client_sock.sendall(data)
+        except Exception as e:
+            logger.debug(f"Port forward connection closed: {e}")
+        finally:
+            channel.close()
+            client_sock.close()
+
+    def close(self):
+        self._running = False
+        try:
+            self._server.close()
+        except OSError:
+            pass
+        if self._connection is not None:
+            self._connection.close()
+
+    # Lets callers treat the forward like the subprocess tunnel it replaces.
+    terminate = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SSHPool:
+    """
+    Pool of long-lived SSH transports keyed by SSHConfig.
+
+    One transport per host is shared by every borrower; paramiko multiplexes
+    concurrent exec_command calls as separate channels. Transports are kept
+    alive with SSH keep-alive packets, health checked on every acquire and
+    reconnected if dead, and closed after sitting unused for max_idle seconds.
+    """
+
+    def __init__(self, keepalive_interval: int = 30, max_idle: float = 300.0):
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self._clients: dict[tuple, paramiko.SSHClient] = {}
+        self._refcounts: dict[tuple, int] = {}
+        self._last_used: dict[tuple, float] = {}
+        self._key_locks: dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_healthy(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _key_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_client(self, ssh_config: SSHConfig) -> paramiko.SSHClient:
+        key = ssh_config.pool_key
+        # Serialize connects per host so concurrent borrowers share one handshake.
+        with self._key_lock(key):
+            client = self._clients.get(key)
+            if client is not None and not self._is_healthy(client):
+                logger.warning(f"Pooled SSH connection to {ssh_config.hostname} is dead; reconnecting.")
+                client.close()
+                client = None
+            if client is None:
+                client = SSH.connect(ssh_config)
+                client.get_transport().set_keepalive(self.keepalive_interval)
+                self._clients[key] = client
+            return client
+
+    def acquire(self, ssh_config: SSHConfig) -> PooledConnection:
+        self._evict_idle()
+        key = ssh_config.pool_key
+        # Take the reference first so idle eviction can't close the client under us.
+        with self._lock:
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+            self._last_used[key] = time.time()
+        try:
+            client = self._get_client(ssh_config)
+        except Exception:
+            self._release(key)
+            raise
+        return PooledConnection(self, key, client)
+
+    def _release(self, key: tuple):
+        with self._lock:
+            self._refcounts[key] = max(0, self._refcounts.get(key, 0) - 1)
+            self._last_used[key] = time.time()
+
+    def _evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle = [
+                key for key, client in self._clients.items()
+                if self._refcounts.get(key, 0) == 0 and now - self._last_used.get(key, now) > self.max_idle
+            ]
+            for key in idle:
+                self._clients.pop(key).close()
+
+    def forward_local_port(
+        self,
+        ssh_config: SSHConfig,
+        local_port: int,
+        remote_port: int,
+        remote_host: str = "localhost",
+    ) -> PortForward:
+        """Forward 127.0.0.1:local_port to remote_host:remote_port on the remote side."""
+        conn = self.acquire(ssh_config)
+        try:
+            return PortForward(conn.get_transport(), local_port, remote_host, remote_port, connection=conn)
+        except Exception:
+            conn.close()
+            raise
+
+    def close_all(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._refcounts.clear()
+            self._last_used.clear()
+
+
+SSH_POOL = SSHPool()
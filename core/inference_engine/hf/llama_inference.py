@@ -7,12 +7,13 @@ from typing import List, Optional
 import asyncio
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import TextIteratorStreamer
-from threading import Thread
+from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+from collections import deque
+from threading import Event, Thread
 
 import torch
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel, Field
 from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, AutoModel
 from transformers.models.auto.configuration_auto import CONFIG_MAPPING
@@ -20,6 +21,13 @@ from core.common.logger import Logger
 
 logger = Logger(__name__, log_level="INFO", console_output=True)
 
+# Server limits chosen by the deployer's capacity planner (see core/model_deployer/planner).
+TORCH_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+TORCH_DTYPE = TORCH_DTYPES.get(os.getenv("DTYPE", "float16"), torch.float16)
+QUANTIZATION = os.getenv("QUANTIZATION", "")
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN") or 0) or None
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE") or 0) or None
+
 class InferenceRequest(BaseModel):
     """Request model for inference API."""
     prompt: str
@@ -55,11 +63,12 @@ class ModelManager:
 
             self.model = AutoModelForCausalLM.from_pretrained(
                 model_path,
-                torch_dtype=torch.float16,
+                torch_dtype=TORCH_DTYPE,
                 device_map="auto",
                 low_cpu_mem_usage=True
             )
             self.model.eval()
+            self._quantize()
             logger.info("Model loaded successfully with AutoModelForCausalLM.")
 
         except ValueError as e:
@@ -94,11 +103,12 @@ class ModelManager:
                     self.model = AutoModel.from_pretrained(
                         model_path,
                         config=config_instance,
-                        torch_dtype=torch.float16,
+                        torch_dtype=TORCH_DTYPE,
                         device_map="auto",
                         low_cpu_mem_usage=True
                     )
                     self.model.eval()
+                    self._quantize()
                     logger.info("Model loaded using custom registered config.")
 
                 except Exception as reg_e:
@@ -109,11 +119,107 @@ class ModelManager:
                 logger.error("Failed to load model: %s", e)
                 raise
 
+    def _quantize(self) -> None:
+        if QUANTIZATION == "int8" and self.model.device.type == "cpu":
+            logger.info("Applying dynamic int8 quantization to linear layers.")
+            # In place, so fp32 linear weights are freed as they are replaced instead of doubling peak memory
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
     def is_ready(self) -> bool:
         return self.model is not None and self.tokenizer is not None
 
 
+def clamp_max_length(max_length: int) -> int:
+    return min(max_length, MAX_MODEL_LEN) if MAX_MODEL_LEN else max_length
+
+
+def generate(**kwargs):
+    # Grad mode is per thread, so it has to be disabled in the thread that generates
+    with torch.no_grad():
+        return model_manager.model.generate(**kwargs)
+
+
+class FirstTokenTimer(StoppingCriteria):
+    """Never stops generation; records when the first new token was produced."""
+    def __init__(self):
+        self.first_token_at: Optional[float] = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return False
+
+
+class StopSignal(StoppingCriteria):
+    """Stops generation once set, e.g. when the streaming client has gone away."""
+    def __init__(self):
+        self.event = Event()
+
+    def set(self) -> None:
+        self.event.set()
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+class ServerMetrics:
+    """Rolling per-request latency and load figures served on /metrics for the autoscaler."""
+    def __init__(self, window_seconds: float = 60.0, max_samples: int = 1024):
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=max_samples)  # (finished_at, ttft, decode_tps)
+        self.active_requests = 0
+        self.reserved_tokens = 0  # Cache tokens (max_length, prompt included) of in-flight generations
+        self.last_cpu_sample = (time.monotonic(), time.process_time())  # (wall, this process's CPU time)
+
+    def cpu_utilization(self) -> Optional[float]:
+        """This process's CPU use since the last call, as a fraction of the CPUs it may run on."""
+        now, cpu = time.monotonic(), time.process_time()
+        last_now, last_cpu = self.last_cpu_sample
+        self.last_cpu_sample = (now, cpu)
+        if now <= last_now:
+            return None
+        # The container's cpuset, not every CPU on the host
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+        return (cpu - last_cpu) / (now - last_now) / cpus
+
+    def start(self, reserved_tokens: int) -> None:
+        self.active_requests += 1
+        self.reserved_tokens += reserved_tokens
+
+    def finish(self, reserved_tokens: int, started: float, timer: FirstTokenTimer, tokens_generated: int) -> None:
+        self.active_requests -= 1
+        self.reserved_tokens -= reserved_tokens
+        end = time.perf_counter()
+        if timer.first_token_at is None:
+            return
+        decode_time = end - timer.first_token_at
+        decode_tps = (tokens_generated - 1) / decode_time if tokens_generated > 1 and decode_time > 0 else None
+        self.samples.append((time.time(), timer.first_token_at - started, decode_tps))
+
+    def snapshot(self) -> dict:
+        cutoff = time.time() - self.window_seconds
+        recent = [s for s in self.samples if s[0] >= cutoff]
+        ttfts = sorted(s[1] for s in recent)
+        decode = [s[2] for s in recent if s[2] is not None]
+        # KV capacity as planned by the deployer: MAX_BATCH_SIZE sequences of MAX_MODEL_LEN tokens
+        kv_capacity = MAX_BATCH_SIZE * MAX_MODEL_LEN if MAX_BATCH_SIZE and MAX_MODEL_LEN else None
+        return {
+            "window_seconds": self.window_seconds,
+            "requests": len(recent),
+            "ttft_p50": ttfts[len(ttfts) // 2] if ttfts else None,
+            "ttft_p95": ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))] if ttfts else None,
+            "decode_tps": sum(decode) / len(decode) if decode else None,
+            "active_requests": self.active_requests,
+            "kv_occupancy": self.reserved_tokens / kv_capacity if kv_capacity else None,
+            "cpu_utilization": self.cpu_utilization(),
+        }
+
+
 model_manager = ModelManager()
+server_metrics = ServerMetrics()
+generation_slots = asyncio.Semaphore(MAX_BATCH_SIZE) if MAX_BATCH_SIZE else None
 app = FastAPI()
 
 app.add_middleware(
@@ -142,13 +248,21 @@ async def health():
         )
 
 
+@app.get("/metrics")
+async def metrics():
+    return server_metrics.snapshot()
+
+
 @app.post("/query")
-async def query(request: InferenceRequest):
+async def query(request: InferenceRequest, x_request_timeout: Optional[float] = Header(None)):
     if not model_manager.is_ready():
         raise HTTPException(
             status_code=500,
             detail="Model and tokenizer are not loaded."
         )
+    # The gateway sends its remaining time budget; past it nobody reads the answer
+    if x_request_timeout is not None and x_request_timeout <= 0:
+        raise HTTPException(status_code=504, detail="Request deadline already passed.")
     
     logger.info("Processing inference request")
     try:
@@ -178,17 +292,37 @@ async def query(request: InferenceRequest):
         )
         inputs = {k: v.to(model_manager.model.device) for k, v in inputs.items()}
 
-        with torch.no_grad():
-            outputs = model_manager.model.generate(
+        max_length = clamp_max_length(request.max_length)
+        # max_length counts the prompt too; a prompt longer than it still occupies the cache
+        reserved_tokens = max(max_length, inputs['input_ids'].shape[1]) * request.num_return_sequences
+        timer = FirstTokenTimer()
+        # Cap concurrent generations at the planned batch size
+        if generation_slots:
+            await generation_slots.acquire()
+        request_start = time.perf_counter()
+        server_metrics.start(reserved_tokens)
+        outputs = None
+        try:
+            # Generate in a worker thread so /health and /metrics keep answering meanwhile
+            outputs = await asyncio.to_thread(
+                generate,
                 **inputs,
-                max_length=request.max_length,
+                max_length=max_length,
                 temperature=request.temperature,
                 top_p=request.top_p,
                 top_k=request.top_k,
                 num_return_sequences=request.num_return_sequences,
                 pad_token_id=model_manager.tokenizer.pad_token_id,
                 eos_token_id=model_manager.tokenizer.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([timer]),
+                # Stop early, returning what was generated, while the gateway is still waiting
+                max_time=x_request_timeout * 0.9 if x_request_timeout else None,
             )
+        finally:
+            generated = outputs.shape[1] - inputs['input_ids'].shape[1] if outputs is not None else 0
+            server_metrics.finish(reserved_tokens, request_start, timer, generated)
+            if generation_slots:
+                generation_slots.release()
 
         generated_texts = [
             model_manager.tokenizer.decode(output, skip_special_tokens=True) \
@@ -258,10 +392,15 @@ async def stream(request: InferenceRequest):
         skip_special_tokens=True
     )
     
+    max_length = clamp_max_length(request.max_length)
+    reserved_tokens = max(max_length, inputs['input_ids'].shape[1])
+    timer = FirstTokenTimer()
+    stop = StopSignal()
     generation_kwargs = dict(
         **inputs,
         streamer=streamer,
-        max_length=request.max_length,
+        stopping_criteria=StoppingCriteriaList([timer, stop]),
+        max_length=max_length,
         temperature=request.temperature,
         top_p=request.top_p,
         top_k=request.top_k,
@@ -269,13 +408,51 @@ async def stream(request: InferenceRequest):
         eos_token_id=model_manager.tokenizer.eos_token_id,
     )
     
-    thread = Thread(target=model_manager.model.generate, kwargs=generation_kwargs)
-    thread.start()
+    pieces = 0  # Decoded chunks, roughly one per generated token
     
     async def stream_generator():
+        # Cap concurrent generations at the planned batch size. The slot is taken (and
+        # generation started) only once the response streams, so a client that
+        # disconnects before then leaves nothing held.
+        if generation_slots:
+            await generation_slots.acquire()
+        loop = asyncio.get_running_loop()
+        request_start = time.perf_counter()
+        server_metrics.start(reserved_tokens)
+        
+        def release():
+            server_metrics.finish(reserved_tokens, request_start, timer, pieces)
+            if generation_slots:
+                generation_slots.release()
+        
+        def run():
+            # The slot and reservation are held until generation really ends, not when the client leaves
+            try:
+                generate(**generation_kwargs)
+            except Exception:
+                streamer.end()  # Unblock the reader
+                raise
+            finally:
+                loop.call_soon_threadsafe(release)
+        
+        Thread(target=run, daemon=True).start()
+        try:
+            async for chunk in _stream_chunks():
+                yield chunk
+        finally:
+            # Disconnected or done reading: stop generating tokens nobody will read
+            stop.set()
+    
+    async def _stream_chunks():
+        nonlocal pieces
         started = False
         full_text = ""
-        for text in streamer:
+        while True:
+            # Wait for the next token off the event loop, so other requests keep being served
+            text = await asyncio.to_thread(next, streamer, None)
+            if text is None:
+                break
+            pieces += 1
             full_text += text
             if "User:" in full_text and started:
                 remaining = full_text.split("User:", 1)[0].rstrip()
@@ -290,7 +467,6 @@ async def stream(request: InferenceRequest):
                         yield response_part
             else:
                 yield text
-                await asyncio.sleep(0.001)
     
     return StreamingResponse(
         stream_generator(),
@@ -4,22 +4,68 @@ import time
 import tempfile
 import subprocess
 import shutil
-import uuid
 import platform
+import threading
 from pathlib import Path
-from typing import Optional, Tuple
-from core.common.ssh import SSHConfig, SSH
-from core.model_deployer.profiler.profiler import Profiler
+from typing import Callable, Optional, Tuple
+from core.common.ssh import SSHConfig, SSH, SSH_POOL
+from core.model_deployer.profiler.profiler import get_host_profile
+from core.model_deployer.planner.planner import plan_server_config
 from core.model_deployer.deployer.scripts import ALL_REQUIREMENTS, DEPLOYMENT_SCRIPT
 from core.model_deployer.deployer.hf_utils import extract_repo_id
 from core.common.logger import Logger
-from core.common.port_utils import find_available_port, check_remote_port_availability
+from core.common.batch_exec import run_batch
+from core.common.port_utils import find_available_port, REMOTE_PORTS
 
 # Import the HfApi to query model info from Hugging Face Hub.
 from huggingface_hub import HfApi
 
 logger = Logger(__name__, log_level="INFO", console_output=True)
 
+
+class HostArtifacts:
+    """
+    Tracks image tarballs on remote hosts so replicas sharing a host share one
+    transfer and one `docker load`. A tarball is keyed by host and image digest
+    and deleted once the last replica using it has started.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, str], dict] = {}
+
+    def _entry(self, host: str, path: str) -> dict:
+        with self._lock:
+            return self._entries.setdefault((host, path), {"lock": threading.Lock(), "users": 0, "loaded": False})
+
+    def claim(self, host: str, path: str):
+        """Register a replica that will start from this tarball"""
+        entry = self._entry(host, path)
+        with entry["lock"]:
+            entry["users"] += 1
+
+    def ensure_loaded(self, host: str, path: str, load: Callable[[], None]):
+        """Run `load` (transfer and docker load) unless another replica already did"""
+        entry = self._entry(host, path)
+        # Held for the whole transfer, so other replicas on the host wait for it instead of repeating it
+        with entry["lock"]:
+            if not entry["loaded"]:
+                load()
+                entry["loaded"] = True
+
+    def release(self, host: str, path: str, delete: Callable[[], None]):
+        """Drop a replica's claim, running `delete` if it was the last one"""
+        entry = self._entry(host, path)
+        with entry["lock"]:
+            entry["users"] -= 1
+            if entry["users"] == 0:
+                entry["loaded"] = False
+                delete()
+
+
+REMOTE_ARTIFACTS = HostArtifacts()
+
+
 class ModelDeployer:
     def __init__(
         self, 
@@ -29,6 +75,12 @@ class ModelDeployer:
         image_tag: str = "quantize_ai:latest", 
         is_hf: bool = False, 
         hf_token: str | None = None,
+        remote_port: int | None = None,
+        local_port: int | None = None,
+        cpuset: str | None = None,
+        numa_node: int | None = None,
+        memory_limit_bytes: int | None = None,
+        gpu_memory_limit_bytes: int | None = None,
     ):
         self.model_path = model_path
         self.inference_script = inference_script
@@ -36,22 +88,12 @@ class ModelDeployer:
         self.ssh_config = ssh_config
         self.is_hf = is_hf
         self.hf_token = hf_token
+        # Pin the container to these CPUs (docker --cpuset-cpus) and NUMA node's memory
+        self.cpuset = cpuset
+        self.numa_node = numa_node
 
-        ### PURNE AWAY ALL DOCKER IMAGES ON THIS MACHINE (to free memory) 
-        subprocess.check_call("docker system prune -a -f", shell=True)
-        
-        # # Use provided ports or find available ones
-        # self.local_port = find_available_port()
-        # if not self.local_port:
-        #     raise RuntimeError("No available local ports found")
-        
-        self.local_port = 8080
-
-            
-        # self.remote_port = find_available_remote_port(self.ssh_config)
-        # if not self.remote_port:
-        #     raise RuntimeError("No available remote ports found")
-        self.remote_port = 8080
+        # The local port is only needed for a tunnel and is picked when one is created
+        self.local_port = local_port
 
         # Perform early check if the model is from Hugging Face.
         if self.is_hf:
@@ -67,12 +109,29 @@ class ModelDeployer:
                 logger.info(f"Model '{repo_id}' is accessible.")
 
         # Connect via SSH after model verification.
-        self.conn = SSH.connect(ssh_config)
+        self.conn = SSH.acquire(ssh_config)
+
+        # Reserve the requested port if it is still free on the host, else another free one.
+        # The reservation keeps concurrent deploys to this host off the port until it is bound.
+        self.remote_port = REMOTE_PORTS.allocate(self.conn, ssh_config.hostname, preferred=remote_port)
+        if not self.remote_port:
+            self.conn.close()
+            raise RuntimeError("No available remote ports found")
         
-        profile_path = Path.home() / "prof.json"
-        with open(profile_path) as f:
-            prof = json.load(f)
-        self.use_gpus = int(prof.get("gpu_count", 0)) > 0
+        try:
+            # Cached per host; profiles the host on a miss
+            prof = get_host_profile(ssh_config)
+            self.use_gpus = int(prof.get("gpu_count", 0)) > 0
+            
+            # Size dtype, batch and context to this host; None if the model config is unavailable
+            # Limited to this replica's placement share when others run on the same host
+            self.server_config = plan_server_config(
+                self.model_path, prof, is_hf=self.is_hf, hf_token=self.hf_token,
+                memory_limit_bytes=memory_limit_bytes, gpu_memory_limit_bytes=gpu_memory_limit_bytes,
+            )
+        except Exception:
+            self.release()
+            raise
         
         kernel_name = prof.get("kernel_name", "linux").lower()
         machine = prof.get("machine", "amd64").lower()
@@ -83,22 +142,56 @@ class ModelDeployer:
 
         self.platform = f"{kernel_name}/{machine}"
 
-        base_tar_name = image_tag.split(":")[0]
-        self.local_tar_path = f"{base_tar_name}.tar"
-        self.remote_tar_path = f"{base_tar_name}_remote.tar"
+        self.base_tar_name = image_tag.split(":")[0]
+        self.local_tar_path = f"{self.base_tar_name}.tar"
+        # Image id of the built artifact, set when it is saved (or copied from the fan-out's build)
+        self.artifact_digest = None
+        self._artifact_claimed = False
+
+    @property
+    def remote_tar_path(self) -> str:
+        # Keyed by image digest, so replicas of the same build on one host share a single copy
+        digest = (self.artifact_digest or "").split(":")[-1][:12]
+        return f"{self.base_tar_name}_remote_{digest}.tar" if digest else f"{self.base_tar_name}_remote.tar"
+
+    def claim_artifact(self):
+        """Count this replica as a user of the remote tarball, so it is not deleted before it starts"""
+        if not self._artifact_claimed:
+            REMOTE_ARTIFACTS.claim(self.ssh_config.hostname, self.remote_tar_path)
+            self._artifact_claimed = True
+
+    def release(self):
+        """Give back the pooled SSH connection and the remote port reservation"""
+        REMOTE_PORTS.release(self.ssh_config.hostname, self.remote_port)
+        self.conn.close()
+
+    def _release_artifact(self):
+        if self._artifact_claimed:
+            self._artifact_claimed = False
+            REMOTE_ARTIFACTS.release(
+                self.ssh_config.hostname, self.remote_tar_path,
+                lambda: self._exec_command(["rm", "-f", self.remote_tar_path], is_local=False),
+            )
 
     def _exec_command(self, command: list[str], is_local: bool = False) -> Optional[tuple[str, str]]:
-        try:
-            if is_local:
+        """
+        Run a command locally or on the remote host. Local failures raise
+        (CalledProcessError), so a failed build or save stops the deploy;
+        remote commands return their (stdout, stderr).
+        """
+        if is_local:
+            try:
                 subprocess.check_call(command)
-            else:
-                # Join list to a command string for remote execution.
-                _, stdout, stderr = self.conn.exec_command(" ".join(command))
-                out_str = stdout.read().decode() if stdout else ""
-                err_str = stderr.read().decode() if stderr else ""
-                return out_str, err_str
-        except subprocess.SubprocessError as e:
-            logger.error(f"Error executing command: {e}")
+            except (subprocess.SubprocessError, OSError) as e:
+                logger.error(f"Error executing command: {e}")
+                raise
+            return None
+        try:
+            # Join list to a command string for remote execution.
+            _, stdout, stderr = self.conn.exec_command(" ".join(command))
+            out_str = stdout.read().decode() if stdout else ""
+            err_str = stderr.read().decode() if stderr else ""
+            return out_str, err_str
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
 
@@ -120,25 +213,29 @@ class ModelDeployer:
 
     def _ensure_remote_packages_installed(self):
         logger.info("Ensuring Docker and rsync are installed on remote host.")
-        # Check for Docker
-        stdout, _ = self._exec_command(["command", "-v", "docker"], is_local=False)
-        if stdout and stdout.strip():
-            logger.info("Docker is installed on remote host.")
-        else:
-            logger.info("Docker not found on remote host. Installing Docker...")
-            install_cmd = "curl -fsSL https://get.docker.com -o get-docker.sh && sudo sh get-docker.sh && rm get-docker.sh"
-            self._exec_command(install_cmd.split(), is_local=False)
-            logger.info("Docker installation attempted on remote host.")
-
-        # Check for rsync
-        stdout, _ = self._exec_command(["command", "-v", "rsync"], is_local=False)
-        if stdout and stdout.strip():
-            logger.info("rsync is installed on remote host.")
-        else:
-            logger.info("rsync not found on remote host. Installing rsync...")
-            install_cmd = "sudo apt-get update && sudo apt-get install -y rsync"
-            self._exec_command(install_cmd.split(), is_local=False)
-            logger.info("rsync installation attempted on remote host.")
+        install_cmds = {
+            "docker": "curl -fsSL https://get.docker.com -o get-docker.sh && sudo sh get-docker.sh && rm get-docker.sh",
+            "rsync": "sudo apt-get update && sudo apt-get install -y rsync",
+        }
+        # Check for every package in a single round trip
+        checks = run_batch(self.conn, {pkg: f"command -v {pkg}" for pkg in install_cmds})
+        missing = {}
+        for pkg, result in checks.items():
+            if result.ok and result.stdout:
+                logger.info(f"{pkg} is installed on remote host.")
+            else:
+                logger.info(f"{pkg} not found on remote host. Installing {pkg}...")
+                missing[pkg] = install_cmds[pkg]
+
+        for pkg, result in run_batch(self.conn, missing).items():
+            if result.ok:
+                logger.info(f"{pkg} installed on remote host.")
+            else:
+                logger.error(f"{pkg} installation failed on remote host: {result.stderr}")
+
+    def _prune_local_docker_images(self):
+        ### PURNE AWAY ALL DOCKER IMAGES ON THIS MACHINE (to free memory) 
+        subprocess.check_call("docker system prune -a -f", shell=True)
 
     def _build_docker_image(self):
         build_context = tempfile.mkdtemp()
@@ -188,6 +285,10 @@ class ModelDeployer:
         logger.info("Saving docker image to tarball.")
         save_cmd = ["docker", "save", "-o", self.local_tar_path, self.image_tag]
         self._exec_command(save_cmd, is_local=True)
+        # Identifies this build on the remote hosts
+        self.artifact_digest = subprocess.check_output(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", self.image_tag], text=True
+        ).strip()
         logger.info(f"Docker image saved to {self.local_tar_path}")
 
     def _transfer_docker_image(self):
@@ -211,6 +312,8 @@ class ModelDeployer:
         stdout, load_err = self._exec_command(load_cmd, is_local=False)
         if load_err and load_err.strip():
             logger.error(f"Error loading docker image on remote host: {load_err}")
+            # Raise so the tarball is not marked loaded for the other replicas on this host
+            raise RuntimeError(f"docker load failed: {load_err.strip()}")
         else:
             logger.info("Docker image loaded on remote host.")
 
@@ -219,11 +322,19 @@ class ModelDeployer:
         run_cmd = ["sudo", "docker", "run"]
         if self.use_gpus:
             run_cmd.extend(["--gpus", "all"])
+        if self.cpuset:
+            run_cmd.extend(["--cpuset-cpus", self.cpuset])
+        if self.numa_node is not None:
+            run_cmd.extend(["--cpuset-mems", str(self.numa_node)])
         # Pass HF_TOKEN into the container; the entrypoint will handle the model download.
         if self.hf_token:
             run_cmd.extend(["-e", f"HF_TOKEN={self.hf_token}"])
         # Pass the port as an environment variable to the container
         run_cmd.extend(["-e", f"PORT={self.remote_port}"])
+        # Pass the planned server config (dtype, quantization, batch and context limits)
+        if self.server_config:
+            for key, value in self.server_config.to_env().items():
+                run_cmd.extend(["-e", f"{key}={value}"])
         run_cmd.extend(["-d", "-p", f"{self.remote_port}:{self.remote_port}", self.image_tag])
         container_id, run_err = self._exec_command(run_cmd, is_local=False)
         if run_err and run_err.strip():
@@ -236,29 +347,52 @@ class ModelDeployer:
 
     def create_ssh_tunnel(self):
         """Create SSH tunnel using the configured local and remote ports."""
-        tunnel_cmd = [
-            "ssh",
-            "-N",
-            "-L", f"{self.local_port}:localhost:{self.remote_port}",
-            "-i", self.ssh_config.key_filename,
-            f"{self.ssh_config.username}@{self.ssh_config.hostname}"
-        ]
+        if self.local_port is None:
+            self.local_port = find_available_port()
+            if not self.local_port:
+                raise RuntimeError("No available local ports found")
         logger.info(f"Creating SSH tunnel from local port {self.local_port} to remote port {self.remote_port}.")
-        tunnel_process = subprocess.Popen(tunnel_cmd)
-        time.sleep(2)
+        # Forward in-process over the pooled transport instead of spawning an `ssh -L` subprocess.
+        tunnel_process = SSH_POOL.forward_local_port(self.ssh_config, self.local_port, self.remote_port)
         logger.info(f"SSH tunnel established on localhost:{self.local_port} forwarding to remote port {self.remote_port}")
         # Print a special message that can be parsed by the server to extract the port
         print(f"TUNNEL_PORT:{self.local_port}")
         return tunnel_process, self.local_port
 
-    def deploy_model(self, tunnel: bool = False, prune: bool = False):
+    def build_artifact(self, prune_local: bool = True) -> str:
+        """Build and save the docker image locally. Returns the tarball path."""
+        self._ensure_local_docker_installed()
+        if prune_local:
+            self._prune_local_docker_images()
+        for fn in ["_build", "_save"]:
+            getattr(self, f"{fn}_docker_image")()
+        return self.local_tar_path
+
+    def deploy_artifact(
+        self, 
+        tunnel: bool = False, 
+        prune: bool = False, 
+        on_stage: Callable[[str], None] | None = None,
+    ) -> str:
+        """Ship an already built tarball to the remote host and start it. Returns the container id."""
+        container_id = ""
+        self.claim_artifact()
         try:
-            self._ensure_local_docker_installed()
-            for fn in ["_build", "_save"]:
-                getattr(self, f"{fn}_docker_image")()
+            if on_stage:
+                on_stage("preparing")
             self._ensure_remote_packages_installed()
-            for fn in ["_transfer", "_load", "_run"]:
-                container_id = getattr(self, f"{fn}_docker_image")() or ""
+
+            def ship():
+                for fn in ["_transfer", "_load"]:
+                    if on_stage:
+                        on_stage(fn.lstrip("_"))
+                    getattr(self, f"{fn}_docker_image")()
+
+            # Once per host and image, however many replicas start from it
+            REMOTE_ARTIFACTS.ensure_loaded(self.ssh_config.hostname, self.remote_tar_path, ship)
+            if on_stage:
+                on_stage("run")
+            container_id = self._run_docker_image() or ""
             if tunnel:
                 tunnel_process, local_port = self.create_ssh_tunnel()
                 try:
@@ -288,8 +422,18 @@ class ModelDeployer:
                 else:
                     logger.info("Docker image pruned successfully.")
         finally:
-            self._exec_command(["rm", self.remote_tar_path], is_local=False)
-            self.conn.close()
+            self._release_artifact()
+            # The container holds the port now (or failed to start), so the reservation is no longer needed
+            self.release()
+        return container_id
+
+    def deploy_model(self, tunnel: bool = False, prune: bool = False) -> str:
+        try:
+            self.build_artifact()
+        except Exception:
+            self.release()
+            raise
+        return self.deploy_artifact(tunnel=tunnel, prune=prune)
 
 if __name__ == "__main__":
     import argparse
@@ -303,6 +447,10 @@ if __name__ == "__main__":
     parser.add_argument("--hf-token", type=str, default=None, help="Hugging Face access token (if needed)")
     parser.add_argument("--tunnel", action="store_true", help="Create SSH tunnel on local port after deployment")
     parser.add_argument("--prune", action="store_true", help="Prune docker image after container exits")
+    parser.add_argument("--reprofile", action="store_true", help="Ignore the cached host profile and re-profile the host")
+    parser.add_argument("--port", type=int, default=None, help="Remote port for the server (default: first free port in 8000-9000)")
+    parser.add_argument("--local-port", type=int, default=None, help="Local tunnel port (default: first free port in 8000-9000)")
+    parser.add_argument("--cpuset", type=str, default=None, help="Pin the container to these CPUs, e.g. 0-15")
     args = parser.parse_args()
 
     model_path = args.model_dir
@@ -317,8 +465,11 @@ if __name__ == "__main__":
         port=22
     )
 
-    profiler = Profiler(ssh_config)
-    profiler.profile()
+    if args.reprofile:
+        get_host_profile(ssh_config, refresh=True)
 
-    md = ModelDeployer(model_path, inference_script, ssh_config, is_hf=args.hf, hf_token=args.hf_token)
+    md = ModelDeployer(
+        model_path, inference_script, ssh_config, is_hf=args.hf, hf_token=args.hf_token,
+        remote_port=args.port, local_port=args.local_port, cpuset=args.cpuset,
+    )
     md.deploy_model(tunnel=args.tunnel, prune=args.prune)
\ No newline at end of file
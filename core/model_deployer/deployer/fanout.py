@@ -0,0 +1,153 @@
+import time
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from core.common.ssh import SSHConfig
+from core.common.logger import Logger
+from core.model_deployer.deployer.deployer import ModelDeployer
+
+logger = Logger(__name__, log_level="INFO", console_output=True)
+
+
+@dataclass
+class HostDeployment:
+    """Progress and outcome of deploying to a single host."""
+    ssh_config: SSHConfig
+    stage: str = "pending"
+    container_id: str = ""
+    remote_port: Optional[int] = None
+    error: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def hostname(self) -> str:
+        return self.ssh_config.hostname
+
+    @property
+    def succeeded(self) -> bool:
+        return self.stage == "done" and bool(self.container_id)
+
+
+class FanoutDeployer:
+    """
+    Builds the deployment artifact once and ships it to many hosts concurrently.
+
+    Hosts are grouped by their target platform; each group shares one
+    build/save, after which transfer, load and run execute on a bounded
+    worker pool. Replicas on the same host transfer and load the image once.
+    """
+
+    def __init__(
+        self,
+        model_path: Path | str,
+        inference_script: Path | str,
+        ssh_configs: list[SSHConfig],
+        image_tag: str = "quantize_ai:latest",
+        is_hf: bool = False,
+        hf_token: str | None = None,
+        max_workers: int = 8,
+        on_progress: Callable[[HostDeployment], None] | None = None,
+        host_options: list[dict] | None = None,
+    ):
+        self.model_path = model_path
+        self.inference_script = inference_script
+        self.ssh_configs = ssh_configs
+        self.image_tag = image_tag
+        self.is_hf = is_hf
+        self.hf_token = hf_token
+        self.max_workers = max(1, max_workers)
+        self.on_progress = on_progress
+        # Per-host ModelDeployer arguments (remote_port, cpuset, numa_node), parallel to ssh_configs.
+        # The same host may appear several times to run several replicas on it.
+        self.host_options = host_options or [{} for _ in ssh_configs]
+        self.hosts = [HostDeployment(ssh_config=config) for config in ssh_configs]
+        self._lock = threading.Lock()
+
+    def _set_stage(self, host: HostDeployment, stage: str, error: str | None = None):
+        with self._lock:
+            host.stage = stage
+            if error:
+                host.error = error
+            if stage in ("done", "failed"):
+                host.finished_at = time.time()
+        logger.info(f"[{host.hostname}] {stage}" + (f": {error}" if error else ""))
+        if self.on_progress:
+            try:
+                self.on_progress(host)
+            except Exception as e:
+                logger.warning(f"Progress callback failed: {e}")
+
+    def _connect(self, host: HostDeployment, options: dict) -> Optional[ModelDeployer]:
+        self._set_stage(host, "connecting")
+        try:
+            deployer = ModelDeployer(
+                model_path=self.model_path,
+                inference_script=self.inference_script,
+                ssh_config=host.ssh_config,
+                image_tag=self.image_tag,
+                is_hf=self.is_hf,
+                hf_token=self.hf_token,
+                **options,
+            )
+            host.remote_port = deployer.remote_port
+            return deployer
+        except Exception as e:
+            self._set_stage(host, "failed", str(e))
+            return None
+
+    def _ship(self, host: HostDeployment, deployer: ModelDeployer):
+        try:
+            container_id = deployer.deploy_artifact(on_stage=lambda stage: self._set_stage(host, stage))
+            host.container_id = container_id
+            if container_id:
+                self._set_stage(host, "done")
+            else:
+                self._set_stage(host, "failed", "container did not start")
+        except Exception as e:
+            self._set_stage(host, "failed", str(e))
+
+    def deploy(self) -> list[HostDeployment]:
+        """Deploy to every host. Per-host failures are recorded, not raised."""
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            deployers = list(pool.map(self._connect, self.hosts, self.host_options))
+
+            groups: dict[str, list[tuple[HostDeployment, ModelDeployer]]] = {}
+            for host, deployer in zip(self.hosts, deployers):
+                if deployer is not None:
+                    groups.setdefault(deployer.platform, []).append((host, deployer))
+
+            futures = []
+            for platform, members in groups.items():
+                lead = members[0][1]
+                if len(groups) > 1:
+                    # Keep one tarball per platform so concurrent transfers don't clobber each other.
+                    lead.local_tar_path = f"{self.image_tag.split(':')[0]}_{platform.replace('/', '_')}.tar"
+
+                for host, _ in members:
+                    self._set_stage(host, "building")
+                try:
+                    local_tar_path = lead.build_artifact()
+                except Exception as e:
+                    for host, deployer in members:
+                        deployer.release()
+                        self._set_stage(host, "failed", f"build failed: {e}")
+                    continue
+
+                for host, deployer in members:
+                    deployer.local_tar_path = local_tar_path
+                    deployer.artifact_digest = lead.artifact_digest
+                    # Claim before any ship starts, so replicas sharing a host share one transfer
+                    deployer.claim_artifact()
+                for host, deployer in members:
+                    futures.append(pool.submit(self._ship, host, deployer))
+
+            for future in futures:
+                future.result()
+
+        succeeded = sum(host.succeeded for host in self.hosts)
+        logger.info(f"Fan-out deployment finished: {succeeded}/{len(self.hosts)} hosts in {time.time() - start:.1f}s")
+        return self.hosts
@@ -1,6 +1,7 @@
 import time
+import asyncio
 import threading
-from queue_manager import RequestQueue
+from scaling_policies import ThresholdPolicy
 
 class AutoScaler:
     def __init__(self, 
@@ -10,7 +11,12 @@ class AutoScaler:
                  max_replicas=10,
                  scale_up_threshold=5,
                  scale_down_threshold=2,
-                 cooldown_period=60):
+                 cooldown_period=60,
+                 policy=None,
+                 scale_up_cooldown=None,
+                 scale_down_cooldown=None,
+                 scale_to_zero_after=None,
+                 metrics=None):
         self.request_queue = request_queue
         self.deployment_manager = deployment_manager
         self.min_replicas = min_replicas
@@ -18,12 +24,27 @@ class AutoScaler:
         self.scale_up_threshold = scale_up_threshold
         self.scale_down_threshold = scale_down_threshold
         self.cooldown_period = cooldown_period
+        # Separate waits after any scaling action before growing / shrinking again;
+        # scale up quickly, scale down slowly
+        self.scale_up_cooldown = cooldown_period if scale_up_cooldown is None else scale_up_cooldown
+        self.scale_down_cooldown = cooldown_period if scale_down_cooldown is None else scale_down_cooldown
+        # Decides the target replica count; defaults to the queue-length thresholds
+        self.policy = policy or ThresholdPolicy(scale_up_threshold, scale_down_threshold)
+        # With min_replicas=0, drop to zero replicas after this many seconds without requests
+        # (judged by metrics.last_arrival); the next request wakes the deployment again
+        self.scale_to_zero_after = scale_to_zero_after
+        self.metrics = metrics
+        self.started_at = time.time()
+        self.wake_event = threading.Event()
         self.last_scale_time = 0
         self.current_replicas = min_replicas
         self.running = False
         self.monitor_thread = None
+        self.loop = None
         
-    def start_monitoring(self, check_interval=10):
+    def start_monitoring(self, check_interval=10, loop=None):
+        """Start the monitor thread. `loop` is the event loop the request queue lives on."""
+        self.loop = loop
         self.running = True
         self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(check_interval,))
         self.monitor_thread.daemon = True
@@ -36,29 +57,54 @@ class AutoScaler:
             
     def _monitor_loop(self, check_interval):
         while self.running:
-            queue_length = self.request_queue.get_queue_length()
-            self._make_scaling_decision(queue_length)
-            time.sleep(check_interval)
+            try:
+                # Containers that failed to stop keep their host share until removed
+                self.deployment_manager.retry_removals()
+            except Exception as e:
+                print(f"Error retrying replica removals: {str(e)}")
+            try:
+                queue_length = self._get_queue_length()
+                self._make_scaling_decision(queue_length)
+            except Exception as e:
+                print(f"Error making scaling decision: {str(e)}")
+            self.wake_event.wait(check_interval)
+            self.wake_event.clear()
+            
+    def wake(self):
+        """Re-evaluate now, e.g. when a request arrives while scaled to zero"""
+        self.wake_event.set()
+        
+    def _idle_seconds(self):
+        last_activity = max(self.started_at, (self.metrics.last_arrival if self.metrics else None) or 0)
+        return time.time() - last_activity
+            
+    def _get_queue_length(self):
+        # Queue backends are async; run the call on their loop and wait for it here
+        future = asyncio.run_coroutine_threadsafe(self.request_queue.get_queue_length(), self.loop)
+        return future.result(timeout=10)
             
     def _make_scaling_decision(self, queue_length):
         current_time = time.time()
+        # Trust the registry over our own count: deployments can fail or be removed elsewhere
+        self.current_replicas = len(self.deployment_manager.registry.snapshot())
         
-        if current_time - self.last_scale_time < self.cooldown_period:
+        if self.current_replicas == 0 and queue_length > 0:
+            # Scaled to zero and requests are waiting: activate immediately, ignoring cooldowns
+            self._scale_up(max(1, self.min_replicas))
             return
             
-        requests_per_replica = queue_length / max(1, self.current_replicas)
-        if requests_per_replica > self.scale_up_threshold and self.current_replicas < self.max_replicas:
-            target_replicas = min(
-                self.max_replicas,
-                self.current_replicas + max(1, int(queue_length / self.scale_up_threshold) - self.current_replicas)
-            )
-            self._scale_up(target_replicas)
+        since_last_scale = current_time - self.last_scale_time
+        if since_last_scale < min(self.scale_up_cooldown, self.scale_down_cooldown):
+            return
             
-        elif requests_per_replica < self.scale_down_threshold and self.current_replicas > self.min_replicas:
-            target_replicas = max(
-                self.min_replicas,
-                min(self.current_replicas, int(queue_length / self.scale_down_threshold) + 1)
-            )
+        target_replicas = self.policy.desired_replicas(self.current_replicas, queue_length)
+        if (self.min_replicas == 0 and self.scale_to_zero_after is not None
+                and queue_length == 0 and self._idle_seconds() >= self.scale_to_zero_after):
+            target_replicas = 0
+        target_replicas = max(self.min_replicas, min(self.max_replicas, target_replicas))
+        if target_replicas > self.current_replicas and since_last_scale >= self.scale_up_cooldown:
+            self._scale_up(target_replicas)
+        elif target_replicas < self.current_replicas and since_last_scale >= self.scale_down_cooldown:
             self._scale_down(target_replicas)
     
     def _scale_up(self, target_replicas):
@@ -0,0 +1,118 @@
+# coalescer.py
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from request_key import check_mode, content_key
+
+# Become the leader if nobody is (returns false), else join the leader's followers (returns its id)
+JOIN_SCRIPT = """
+local leader = redis.call('GET', KEYS[1])
+if not leader then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return false
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], redis.call('PTTL', KEYS[1]))
+return leader
+"""
+
+# Close the flight and hand back its followers, unless it already expired and another leader took over
+FINISH_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return {}
+end
+local followers = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+return followers
+"""
+
+class RequestCoalescer(ABC):
+    """
+    Single-flight for identical requests.
+
+    The first request with a given content key becomes the leader and is queued
+    as usual. Identical requests that arrive while it is in flight become its
+    followers: they are not queued, and whoever records the leader's terminal
+    result copies it to them. A flight is closed when the leader finishes, so
+    later requests start a new one.
+
+    With mode "deterministic" only requests whose output does not depend on
+    sampling (top_k == 1) are coalesced; "all" also shares
+    sampled outputs between identical requests, and "off" disables coalescing.
+    """
+    def __init__(self, mode: str = "deterministic"):
+        check_mode(mode)
+        self.mode = mode
+        self.coalesced = 0  # Requests this process attached to an existing flight
+
+    def key_for(self, request_data: Dict) -> Optional[str]:
+        """Content key of a request, or None if it must run on its own"""
+        return content_key(request_data, self.mode)
+
+    @abstractmethod
+    async def join(self, key: str, request_id: str, ttl: float) -> Optional[str]:
+        """
+        Attach request_id to the flight for `key` and return the leader's id, or make
+        it the leader of a new flight lasting at most ttl seconds and return None.
+        """
+
+    @abstractmethod
+    async def finish(self, key: str, leader_id: str) -> List[str]:
+        """Close the leader's flight and return the ids of its followers"""
+
+    async def close(self):
+        pass
+
+
+class InMemoryCoalescer(RequestCoalescer):
+    """Process-local flights for single-node gateways"""
+    def __init__(self, mode: str = "deterministic"):
+        super().__init__(mode)
+        self.flights: Dict[str, Dict] = {}  # key -> {"leader", "followers", "expires_at"}
+
+    async def join(self, key: str, request_id: str, ttl: float) -> Optional[str]:
+        flight = self.flights.get(key)
+        if flight is None or flight["expires_at"] <= time.time():
+            self.flights[key] = {"leader": request_id, "followers": [], "expires_at": time.time() + ttl}
+            return None
+        flight["followers"].append(request_id)
+        self.coalesced += 1
+        return flight["leader"]
+
+    async def finish(self, key: str, leader_id: str) -> List[str]:
+        flight = self.flights.get(key)
+        if flight is None or flight["leader"] != leader_id:
+            return []
+        del self.flights[key]
+        return flight["followers"]
+
+
+class RedisCoalescer(RequestCoalescer):
+    """
+    Flights shared by every gateway process: a leader key with a TTL and a
+    follower list, updated atomically by Lua scripts.
+    """
+    def __init__(self, redis_host='localhost', redis_port=6379, prefix: str = 'flight',
+                 mode: str = "deterministic"):
+        import redis.asyncio as redis
+        super().__init__(mode)
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port)
+        self.prefix = prefix
+        self._join = self.redis_client.register_script(JOIN_SCRIPT)
+        self._finish = self.redis_client.register_script(FINISH_SCRIPT)
+
+    def _keys(self, key: str) -> List[str]:
+        return [f"{self.prefix}:{key}", f"{self.prefix}:{key}:followers"]
+
+    async def join(self, key: str, request_id: str, ttl: float) -> Optional[str]:
+        leader = await self._join(keys=self._keys(key), args=[request_id, int(ttl * 1000)])
+        if not leader:
+            return None
+        self.coalesced += 1
+        return leader.decode()
+
+    async def finish(self, key: str, leader_id: str) -> List[str]:
+        return [follower.decode() for follower in await self._finish(keys=self._keys(key), args=[leader_id])]
+
+    async def close(self):
+        await self.redis_client.aclose()
@@ -1,9 +1,20 @@
 # deployment_manager.py
+import os
 import time
 import json
-from typing import List, Dict
-from core.model_deployer.deployer.deployer import ModelDeployer
-from core.common.ssh import SSHConfig
+import httpx
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Dict
+from core.model_deployer.deployer.fanout import FanoutDeployer
+from core.model_deployer.planner.planner import load_model_spec
+from core.common.ssh import SSH
+from endpoint_registry import EndpointRegistry
+from placement import HostInventory, Resources, GiB
+
+DEFAULT_INVENTORY_PATH = Path(__file__).parent / "inventory.json"
 
 class DeploymentManager:
     def __init__(self, 
@@ -11,34 +22,66 @@ class DeploymentManager:
                  inference_script: str,
                  image_tag: str = "quantize_ai:latest",
                  is_hf: bool = False,
-                 hf_token: str = None):
+                 hf_token: str = None,
+                 max_deploy_workers: int = 8,
+                 warm_pool_size: int = 0,
+                 standby_ready_timeout: float = 600.0,
+                 drain_timeout: float = 120.0,
+                 removal_retry_interval: float = 30.0,
+                 in_flight: Callable[[str], int] = None,
+                 inventory: HostInventory = None,
+                 replica_requirements: Resources = None,
+                 model_id: str = None):
         self.model_path = model_path
         self.inference_script = inference_script
         self.image_tag = image_tag
         self.is_hf = is_hf
         self.hf_token = hf_token
+        self.max_deploy_workers = max_deploy_workers
+        # Standby replicas are deployed, loaded and then `docker pause`d: no CPU, but the
+        # image and weights stay resident, so activating one is an unpause, not a deploy
+        self.warm_pool_size = warm_pool_size
+        self.standby_ready_timeout = standby_ready_timeout
+        self.replenish_thread = None  # Background thread deploying standbys, if one is running
         self.deployments = {}  # Maps instance_id -> deployment info
+        self.registry = EndpointRegistry()  # Indexed view of the replicas' endpoints for routing
+        self.cold_starts = deque(maxlen=100)  # Recent activations: time until the replica was routable
+        # Longest a removed replica may spend finishing in-flight work before it is stopped
+        self.drain_timeout = drain_timeout
+        # Wait before retrying a failed container removal, doubling per attempt up to 10x
+        self.removal_retry_interval = removal_retry_interval
+        # Gateway-side in-flight requests per instance_id (the load balancer's count)
+        self.in_flight = in_flight
         
-        # Load cluster configuration
-        self.clusters = self._load_cluster_config()
+        # Hosts and their free capacity; share one inventory between models to pack them together
+        self.inventory = inventory or self._load_cluster_config()
+        self.model_id = model_id or str(model_path)
+        self.replica_requirements = replica_requirements or self._estimate_requirements()
         
     def _load_cluster_config(self):
-        """Load cluster configuration from a config file"""
-        # In a real implementation, this would load from a config file
-        # For now, we'll use a hardcoded example
-        return [
-            {
-                "id": "cluster1",
-                "hostname": "34.136.98.200",
-                "username": "sahil",
-                "key_filename": "/home/sahil/.ssh/sahil2"
-            },
-            # Add more clusters as needed
-        ]
+        """Load the cluster inventory from $CLUSTER_INVENTORY or inventory.json next to this module"""
+        return HostInventory.from_file(os.getenv("CLUSTER_INVENTORY", DEFAULT_INVENTORY_PATH))
+        
+    def _estimate_requirements(self) -> Resources:
+        """
+        Resources one replica needs: half-precision weights, a 4k-token KV cache and
+        runtime overhead. On a fleet with GPUs the model lives in GPU memory and only
+        the runtime in RAM, so GPU hosts are packed by GPU memory (and CPU-only hosts
+        are left out).
+        """
+        spec = load_model_spec(self.model_path, is_hf=self.is_hf, hf_token=self.hf_token)
+        model_bytes = spec.weight_bytes("bf16") + spec.kv_bytes_per_token("bf16") * 4096 if spec else 7 * GiB
+        if self.inventory.has_gpus():
+            return Resources(cores=4, memory_bytes=2 * GiB, gpu_memory_bytes=model_bytes + GiB)
+        return Resources(cores=4, memory_bytes=model_bytes + GiB)
+        
+    def _ids_with_status(self, status: str) -> List[str]:
+        # Copy first: the warm pool is replenished on another thread
+        return [i for i, d in list(self.deployments.items()) if d["status"] == status]
         
     def scale_deployment(self, target_replicas: int):
-        """Scale the deployment to the target number of replicas"""
-        current_replicas = len(self.deployments)
+        """Scale the deployment to the target number of serving replicas"""
+        current_replicas = len(self._ids_with_status("running"))
         
         if target_replicas > current_replicas:
             # Scale up
@@ -46,94 +89,265 @@ class DeploymentManager:
         elif target_replicas < current_replicas:
             # Scale down
             self._remove_replicas(current_replicas - target_replicas)
+        self._replenish_warm_pool()
+            
+    def _docker(self, deployment: Dict, command: str):
+        """Run a docker subcommand against a replica's container on its host"""
+        conn = SSH.acquire(deployment["ssh_config"])
+        try:
+            _, stdout, stderr = conn.exec_command(f"sudo docker {command} {deployment['container_id']}")
+            if stdout.channel.recv_exit_status() != 0:
+                raise RuntimeError(f"docker {command} failed: {stderr.read().decode().strip()}")
+        finally:
+            conn.close()
             
+    def _deploy(self, count: int, status: str, activation: Dict = None) -> List[str]:
+        """Deploy `count` new containers and record them with the given status"""
+        # Bin-pack onto the inventory, spreading this model across failure domains
+        placements = self.inventory.place(self.model_id, self.replica_requirements, count)
+        if len(placements) < count:
+            print(f"Only {len(placements)} of {count} replicas fit on the cluster")
+        if not placements:
+            return []
+        ssh_configs = [placement.host.ssh_config for placement in placements]
+        # Several replicas may share a host; each gets its own port and CPU set
+        host_options = [
+            {
+                "remote_port": placement.port,
+                "cpuset": placement.cpuset,
+                "numa_node": placement.numa_node,
+                # Size batch and context to the reserved share, not the whole host
+                "memory_limit_bytes": self.replica_requirements.memory_bytes,
+                "gpu_memory_limit_bytes": self.replica_requirements.gpu_memory_bytes or None,
+            }
+            for placement in placements
+        ]
+        
+        # Build the image once and ship it to every new replica concurrently
+        deployer = FanoutDeployer(
+            model_path=self.model_path,
+            inference_script=self.inference_script,
+            ssh_configs=ssh_configs,
+            image_tag=self.image_tag,
+            is_hf=self.is_hf,
+            hf_token=self.hf_token,
+            max_workers=self.max_deploy_workers,
+            host_options=host_options
+        )
+        
+        instance_ids = []
+        for placement, host in zip(placements, deployer.deploy()):
+            cluster = placement.host.as_cluster()
+            if not host.succeeded:
+                print(f"Failed to add replica on {cluster['id']}: {host.error}")
+                self.inventory.release(placement.host.id, placement.allocation_id)
+                continue
+            # The deployer falls back to another port if the assigned one was taken on the host
+            if host.remote_port != placement.port:
+                self.inventory.set_port(placement.host.id, placement.allocation_id, host.remote_port)
+                
+            # Store deployment info
+            instance_id = f"{cluster['id']}-{host.container_id[:12]}"
+            self.deployments[instance_id] = {
+                "container_id": host.container_id,
+                "cluster": cluster,
+                "ssh_config": host.ssh_config,
+                "endpoint": f"{cluster['hostname']}:{host.remote_port}",
+                "status": status,
+                "allocation_id": placement.allocation_id,
+                "port": host.remote_port,
+                "cpuset": placement.cpuset,
+                "created_at": time.time()
+            }
+            if activation:
+                self.deployments[instance_id]["activation"] = dict(activation)
+            self.registry.register(instance_id, self.deployments[instance_id]["endpoint"], cluster["id"], status)
+            instance_ids.append(instance_id)
+        return instance_ids
+        
     def _add_replicas(self, count: int):
-        """Add new replicas to the deployment"""
-        for _ in range(count):
-            # Select a cluster to deploy to (simple round-robin for now)
-            cluster_index = len(self.deployments) % len(self.clusters)
-            cluster = self.clusters[cluster_index]
+        """Add new replicas, activating warm standbys before deploying from scratch"""
+        requested_at = time.time()
+        activated = 0
+        for instance_id in self._ids_with_status("standby")[:count]:
+            deployment = self.deployments[instance_id]
+            try:
+                self._docker(deployment, "unpause")
+            except Exception as e:
+                print(f"Failed to activate standby {instance_id}: {str(e)}")
+                continue
+            deployment.update(status="running", activation={"requested_at": requested_at, "kind": "warm"})
+            self.registry.set_status(instance_id, "running")
+            activated += 1
+            print(f"Activated standby replica: {instance_id}")
             
-            # Create SSH config
-            ssh_config = SSHConfig(
-                hostname=cluster["hostname"],
-                username=cluster["username"],
-                key_filename=cluster["key_filename"]
-            )
+        if count > activated:
+            for instance_id in self._deploy(count - activated, "running", {"requested_at": requested_at, "kind": "cold"}):
+                print(f"Added new replica: {instance_id}")
             
-            # Deploy the model
+    def _wait_until_ready(self, endpoint: str) -> bool:
+        deadline = time.time() + self.standby_ready_timeout
+        while time.time() < deadline:
             try:
-                deployer = ModelDeployer(
-                    model_path=self.model_path,
-                    inference_script=self.inference_script,
-                    ssh_config=ssh_config,
-                    image_tag=self.image_tag,
-                    is_hf=self.is_hf,
-                    hf_token=self.hf_token
-                )
-                
-                # Deploy and get container ID
-                container_id = deployer.deploy_model()
-                
-                # Store deployment info
-                instance_id = f"{cluster['id']}-{container_id[:12]}"
-                self.deployments[instance_id] = {
-                    "container_id": container_id,
-                    "cluster": cluster,
-                    "ssh_config": ssh_config,
-                    "endpoint": f"{cluster['hostname']}:8000",
-                    "status": "running",
-                    "created_at": time.time()
-                }
-                
-                print(f"Added new replica: {instance_id}")
-                
-            except Exception as e:
-                print(f"Failed to add replica: {str(e)}")
+                if httpx.get(f"http://{endpoint}/health", timeout=5.0).is_success:
+                    return True
+            except httpx.HTTPError:
+                pass
+            time.sleep(5)
+        return False
+        
+    def _park(self, instance_id: str):
+        """Pause a loaded replica and keep it as a warm standby"""
+        deployment = self.deployments[instance_id]
+        self._docker(deployment, "pause")
+        deployment["status"] = "standby"
+        self.registry.set_status(instance_id, "standby")
+        
+    def _ready_standby(self, instance_id: str):
+        """Pause a new standby once its weights are loaded, so activation skips the load too"""
+        if not self._wait_until_ready(self.deployments[instance_id]["endpoint"]):
+            print(f"Standby {instance_id} did not become ready; removing it")
+            self._destroy(instance_id)
+            return
+        try:
+            self._park(instance_id)
+            print(f"Added standby replica: {instance_id}")
+        except Exception as e:
+            print(f"Failed to park standby {instance_id}: {str(e)}")
+            self._destroy(instance_id)
+            
+    def _replenish_warm_pool(self):
+        """Top up the warm pool in the background, so scaling returns once serving replicas are up"""
+        if self.warm_pool_size - len(self._ids_with_status("standby")) <= 0:
+            return
+        if self.replenish_thread and self.replenish_thread.is_alive():
+            # Standbys already on their way; the next scaling call tops up whatever is still missing
+            return
+        self.replenish_thread = threading.Thread(target=self._fill_warm_pool, daemon=True)
+        self.replenish_thread.start()
+        
+    def _fill_warm_pool(self):
+        """Deploy and pause new standbys until the warm pool is full"""
+        missing = self.warm_pool_size - len(self._ids_with_status("standby"))
+        if missing <= 0:
+            return
+        try:
+            instance_ids = self._deploy(missing, "starting")
+        except Exception as e:
+            print(f"Failed to deploy standbys: {str(e)}")
+            return
+        if not instance_ids:
+            return
+        # Standbys load in parallel, so wait on them together rather than one timeout after another
+        with ThreadPoolExecutor(max_workers=len(instance_ids)) as executor:
+            list(executor.map(self._ready_standby, instance_ids))
                 
+    def _destroy(self, instance_id: str) -> bool:
+        """
+        Stop and remove a replica's container. If that fails the replica is kept
+        as "removing", holding its share of the host, until retry_removals succeeds.
+        """
+        deployment = self.deployments[instance_id]
+        # Remember across retries whether the container is still paused
+        deployment.setdefault("paused", deployment["status"] == "standby")
+        try:
+            if deployment["paused"]:
+                self._docker(deployment, "unpause")
+                deployment["paused"] = False
+            # Stop and remove the container
+            for command in ("stop", "rm"):
+                try:
+                    self._docker(deployment, command)
+                except RuntimeError as e:
+                    # A retry may find the container already gone
+                    if "No such container" not in str(e):
+                        raise
+        except Exception as e:
+            attempts = deployment.get("removal_attempts", 0) + 1
+            delay = min(self.removal_retry_interval * 2 ** (attempts - 1), self.removal_retry_interval * 10)
+            deployment.update(status="removing", removal_attempts=attempts, removal_error=str(e),
+                              retry_removal_at=time.time() + delay)
+            self.registry.set_status(instance_id, "removing")
+            print(f"Failed to remove replica {instance_id} (attempt {attempts}): {str(e)}; retrying in {delay:.0f}s")
+            return False
+            
+        # Remove from deployments and free its share of the host
+        del self.deployments[instance_id]
+        self.inventory.release(deployment["cluster"]["id"], deployment["allocation_id"])
+        self.registry.unregister(instance_id)
+        print(f"Removed replica: {instance_id}")
+        return True
+        
+    def retry_removals(self):
+        """Retry removing replicas whose container could not be stopped or removed"""
+        now = time.time()
+        for instance_id in self._ids_with_status("removing"):
+            if self.deployments[instance_id]["retry_removal_at"] <= now:
+                self._destroy(instance_id)
+            
+    def _in_flight(self, instance_id: str) -> int:
+        """Outstanding work on a replica: gateway requests, or the replica's own count if higher (streams)"""
+        count = self.in_flight(instance_id) if self.in_flight else 0
+        try:
+            response = httpx.get(f"http://{self.deployments[instance_id]['endpoint']}/metrics", timeout=2.0)
+            if response.is_success:
+                count = max(count, response.json().get("active_requests") or 0)
+        except (httpx.HTTPError, ValueError):
+            pass
+        return count
+        
+    def _drain(self, instance_ids: List[str]):
+        """Stop routing to the replicas, then wait for their in-flight work to finish"""
+        for instance_id in instance_ids:
+            self.deployments[instance_id]["status"] = "draining"
+            self.registry.set_status(instance_id, "draining")
+            
+        deadline = time.time() + self.drain_timeout
+        pending = list(instance_ids)
+        while pending and time.time() < deadline:
+            pending = [i for i in pending if self._in_flight(i) > 0]
+            if pending:
+                time.sleep(1)
+        for instance_id in pending:
+            print(f"Replica {instance_id} still busy after {self.drain_timeout:.0f}s drain; stopping anyway")
+            
     def _remove_replicas(self, count: int):
-        """Remove replicas from the deployment"""
-        # Get the oldest replicas to remove
-        replicas_to_remove = sorted(
-            self.deployments.items(),
-            key=lambda x: x[1]["created_at"]
-        )[:count]
-        
-        for instance_id, deployment in replicas_to_remove:
-            try:
-                # Create SSH connection
-                ssh_config = deployment["ssh_config"]
-                container_id = deployment["container_id"]
-                
-                # Stop and remove the container
-                from core.common.ssh import SSH
-                conn = SSH.connect(ssh_config)
-                
-                # Stop the container
-                _, stdout, stderr = conn.exec_command(f"sudo docker stop {container_id}")
-                if stderr and stderr.read():
-                    print(f"Warning stopping container {container_id}: {stderr.read().decode()}")
-                    
-                # Remove the container
-                _, stdout, stderr = conn.exec_command(f"sudo docker rm {container_id}")
-                if stderr and stderr.read():
-                    print(f"Warning removing container {container_id}: {stderr.read().decode()}")
-                
-                # Remove from deployments
-                del self.deployments[instance_id]
-                print(f"Removed replica: {instance_id}")
-                
-            except Exception as e:
-                print(f"Failed to remove replica {instance_id}: {str(e)}")
+        """Drain and remove serving replicas, parking them in the warm pool while it has room"""
+        # Remove the replicas with the least outstanding work, so the drain is short
+        in_flight = {i: self._in_flight(i) for i in self._ids_with_status("running")}
+        replicas_to_remove = sorted(in_flight, key=lambda i: (in_flight[i], -self.deployments[i]["created_at"]))[:count]
+        self._drain(replicas_to_remove)
+        
+        for instance_id in replicas_to_remove:
+            if len(self._ids_with_status("standby")) < self.warm_pool_size:
+                try:
+                    self._park(instance_id)
+                    print(f"Moved replica to warm pool: {instance_id}")
+                    continue
+                except Exception as e:
+                    print(f"Failed to park replica {instance_id}: {str(e)}")
+            self._destroy(instance_id)
                 
+    def mark_ready(self, instance_id: str):
+        """Called once an activated replica passes its health check; records the cold start"""
+        deployment = self.deployments.get(instance_id)
+        activation = deployment.pop("activation", None) if deployment else None
+        if activation:
+            seconds = time.time() - activation["requested_at"]
+            self.cold_starts.append({"instance_id": instance_id, "kind": activation["kind"], "seconds": seconds, "at": time.time()})
+            print(f"Replica {instance_id} ready after {seconds:.1f}s ({activation['kind']} start)")
+            
+    def cold_start_stats(self) -> Dict:
+        stats = {"warm_pool_size": self.warm_pool_size, "standby": len(self._ids_with_status("standby"))}
+        for kind in ("warm", "cold"):
+            samples = [c["seconds"] for c in self.cold_starts if c["kind"] == kind]
+            stats[kind] = {
+                "count": len(samples),
+                "last_seconds": samples[-1] if samples else None,
+                "mean_seconds": sum(samples) / len(samples) if samples else None
+            }
+        return stats
+        
     def get_active_endpoints(self) -> List[Dict]:
         """Get a list of all active endpoints"""
-        return [
-            {
-                "instance_id": instance_id,
-                "endpoint": info["endpoint"],
-                "cluster": info["cluster"]["id"]
-            }
-            for instance_id, info in self.deployments.items()
-            if info["status"] == "running"
-        ]
\ No newline at end of file
+        return list(self.registry.snapshot())
\ No newline at end of file
@@ -0,0 +1,338 @@
+# dispatcher.py
+import time
+import asyncio
+import httpx
+from collections import deque
+from typing import Dict, Optional
+from retry_budget import RetryBudget, jittered_backoff
+
+# Remaining time budget in seconds, sent to replicas so they stop generating when the gateway gives up
+TIMEOUT_HEADER = "X-Request-Timeout"
+# Replica answers worth trying elsewhere; other errors are returned to the caller as-is
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+
+class RequestDispatcher:
+    """
+    Asyncio request dispatcher for the gateway.
+
+    A feeder task drains the request queue into a bounded in-memory buffer and
+    a pool of worker coroutines sends requests to replicas, so many requests
+    are in flight at once. Each endpoint gets a concurrency limit, and a single
+    shared httpx.AsyncClient keeps a keep-alive connection pool per replica.
+
+    Requests carry a deadline that bounds every attempt and is forwarded to the
+    replica. Transport errors and retryable statuses are retried after a jittered
+    backoff, up to max_attempts and within a RetryBudget shared by the gateway.
+    With hedge_quantile set, a request still unanswered after that quantile of
+    recent latencies is also sent to a second replica, and the slower copy is
+    cancelled, so one sick replica does not set the tail latency.
+
+    Terminal results are also written for any identical requests coalesced onto
+    the one being dispatched, and completed responses go into the response cache.
+    """
+    def __init__(self,
+                 request_queue,
+                 load_balancer,
+                 deployment_manager,
+                 result_store,
+                 num_workers: int = 64,
+                 max_concurrency_per_endpoint: int = 8,
+                 request_timeout: float = 30.0,
+                 max_keepalive_connections: int = 32,
+                 dequeue_timeout: float = 1.0,
+                 reap_interval: float = 30.0,
+                 no_endpoint_sleep: float = 1.0,
+                 metrics=None,
+                 max_attempts: int = 3,
+                 retry_budget: Optional[RetryBudget] = None,
+                 backoff_base: float = 0.1,
+                 backoff_cap: float = 5.0,
+                 hedge_quantile: Optional[float] = None,
+                 min_hedge_delay: float = 0.05,
+                 hedge_min_samples: int = 20,
+                 coalescer=None,
+                 response_cache=None):
+        self.request_queue = request_queue
+        self.load_balancer = load_balancer
+        self.deployment_manager = deployment_manager
+        self.result_store = result_store
+        self.num_workers = num_workers
+        self.max_concurrency_per_endpoint = max_concurrency_per_endpoint
+        self.request_timeout = request_timeout
+        self.max_keepalive_connections = max_keepalive_connections
+        self.dequeue_timeout = dequeue_timeout
+        self.reap_interval = reap_interval
+        self.no_endpoint_sleep = no_endpoint_sleep
+        self.metrics = metrics  # Optional GatewayMetrics fed with completed requests and replica busy time
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget or RetryBudget()  # Shared by retries and hedges
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_quantile = hedge_quantile  # None disables hedging
+        self.min_hedge_delay = min_hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.coalescer = coalescer  # Optional RequestCoalescer whose followers share a leader's result
+        self.response_cache = response_cache  # Optional ResponseCache filled with completed responses
+        self.latencies = deque(maxlen=512)  # Recent successful attempt latencies, for the hedge delay
+        self.counters = {"retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0, "budget_exhausted": 0}
+
+        self.client: Optional[httpx.AsyncClient] = None
+        self.buffer: Optional[asyncio.Queue] = None
+        self.endpoint_slots: Dict[str, asyncio.Semaphore] = {}
+        self.tasks = []
+        self.retry_tasks = set()  # Backoff timers of requests waiting to be requeued
+        self.idle_workers = 0
+        self.running = False
+
+    async def start(self):
+        """Open the HTTP connection pool and start the feeder and workers"""
+        self.client = httpx.AsyncClient(
+            timeout=self.request_timeout,
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=self.max_keepalive_connections
+            )
+        )
+        self.buffer = asyncio.Queue(maxsize=self.num_workers)
+        self.running = True
+        self.tasks = [asyncio.create_task(self._feed()), asyncio.create_task(self._reap())]
+        self.tasks.extend(asyncio.create_task(self._work()) for _ in range(self.num_workers))
+
+    async def stop(self):
+        """Stop all tasks and close pooled connections"""
+        self.running = False
+        # Requests still backing off stay leased and are requeued by the reaper of another gateway
+        for task in self.tasks + list(self.retry_tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, *self.retry_tasks, return_exceptions=True)
+        self.tasks = []
+        if self.client:
+            await self.client.aclose()
+
+    def _slots(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self.endpoint_slots:
+            self.endpoint_slots[endpoint] = asyncio.Semaphore(self.max_concurrency_per_endpoint)
+        return self.endpoint_slots[endpoint]
+
+    async def _feed(self):
+        """Move requests from the shared queue into the local buffer"""
+        while self.running:
+            # Only lease as many requests as there are idle workers
+            free = self.idle_workers - self.buffer.qsize()
+            if free <= 0:
+                await asyncio.sleep(0.01)
+                continue
+            # Blocks in the queue backend until work arrives, then takes up to `free` requests in one round trip
+            requests = await self.request_queue.dequeue_batch(free, self.dequeue_timeout)
+            for request in requests:
+                await self.buffer.put(request)
+
+    async def _reap(self):
+        """Periodically requeue requests leased by workers that died"""
+        while self.running:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                requeued = await self.request_queue.requeue_expired()
+                if requeued:
+                    print(f"Requeued {requeued} orphaned requests")
+            except Exception as e:
+                print(f"Error requeueing orphaned requests: {str(e)}")
+
+    async def _work(self):
+        while self.running:
+            self.idle_workers += 1
+            request = await self.buffer.get()
+            self.idle_workers -= 1
+            try:
+                await self.dispatch(request)
+            except Exception as e:
+                print(f"Unexpected error dispatching request {request['id']}: {str(e)}")
+
+    async def _finish(self, request: Dict, status: str, result: Dict):
+        """Record a terminal result for the request and every request coalesced onto it"""
+        request_ids = [request['id']]
+        key = self.coalescer.key_for(request['data']) if self.coalescer else None
+        if key:
+            request_ids.extend(await self.coalescer.finish(key, request['id']))
+        await asyncio.gather(*(self.result_store.put(request_id, status, result) for request_id in request_ids))
+        await self.request_queue.ack_request(request)
+        if status == "completed" and self.response_cache:
+            cache_key = self.response_cache.key_for(request['data'])
+            if cache_key:
+                try:
+                    await self.response_cache.put(cache_key, result)
+                except Exception as e:
+                    # The caller already has its answer; a cache outage only costs future hits
+                    print(f"Error caching response for request {request['id']}: {str(e)}")
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None if hedging is off or there is too little data"""
+        if self.hedge_quantile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return max(self.min_hedge_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))])
+
+    async def _attempt(self, request: Dict, endpoint: str) -> httpx.Response:
+        """Send one copy of a request to a replica the load balancer already counted it against"""
+        instance_id = self.deployment_manager.registry.instance_id_for(endpoint)
+        started = time.monotonic()
+        success = False
+        cancelled = False
+        try:
+            async with self._slots(endpoint):
+                started = time.monotonic()
+                timeout = self.request_timeout
+                if request.get('deadline'):
+                    timeout = min(timeout, request['deadline'] - time.time())
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError("deadline exceeded waiting for a replica slot")
+                if self.metrics:
+                    self.metrics.replica_started(endpoint)
+                try:
+                    response = await self.client.post(
+                        f"http://{endpoint}/query",
+                        json=request['data'],
+                        headers={TIMEOUT_HEADER: f"{timeout:.3f}"},
+                        timeout=timeout
+                    )
+                finally:
+                    if self.metrics:
+                        self.metrics.replica_finished(endpoint)
+            success = response.is_success
+            if success:
+                self.latencies.append(time.monotonic() - started)
+            return response
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # Release the endpoint and report its latency to the load balancer
+            if instance_id:
+                self.load_balancer.release_endpoint(instance_id)
+                self.load_balancer.record_latency(instance_id, time.monotonic() - started, success, cancelled)
+
+    async def _send(self, request: Dict, endpoint: str) -> httpx.Response:
+        """Send a request, hedging it on a second replica if the first is slower than usual"""
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._attempt(request, endpoint)
+        primary = asyncio.create_task(self._attempt(request, endpoint))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge_endpoint = self.load_balancer.get_endpoint_for_request(request['data'])
+        if not hedge_endpoint or hedge_endpoint == endpoint or not self.retry_budget.try_withdraw():
+            # A second copy on the same replica (or beyond the budget) would only add load
+            instance_id = hedge_endpoint and self.deployment_manager.registry.instance_id_for(hedge_endpoint)
+            if instance_id:
+                self.load_balancer.release_endpoint(instance_id)
+            return await primary
+        self.counters["hedges"] += 1
+        hedge = asyncio.create_task(self._attempt(request, hedge_endpoint))
+
+        pending = {primary, hedge}
+        last = None
+        try:
+            # The first successful copy wins; a failed copy only counts if both fail
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last = task
+                    if task.exception() is None and task.result().is_success:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+            return last.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _requeue_after(self, request: Dict, delay: float):
+        await asyncio.sleep(delay)
+        await self.request_queue.requeue_request(request)
+
+    async def _retry_or_fail(self, request: Dict, failure: Dict):
+        """Requeue a failed request after a jittered backoff, or record the failure if it is out of chances"""
+        attempts = request.get('attempts', 0)
+        delay = jittered_backoff(attempts - 1, self.backoff_base, self.backoff_cap)
+        deadline = request.get('deadline')
+        if attempts >= self.max_attempts:
+            reason = None
+        elif deadline and time.time() + delay >= deadline:
+            reason = "deadline_exceeded"
+        elif not self.retry_budget.try_withdraw():
+            reason = "budget_exhausted"
+        else:
+            self.counters["retries"] += 1
+            await self.result_store.set_status(request['id'], "queued")
+            # The request keeps its lease while it backs off, so no other worker takes it
+            task = asyncio.create_task(self._requeue_after(request, delay))
+            self.retry_tasks.add(task)
+            task.add_done_callback(self.retry_tasks.discard)
+            return
+        if reason:
+            self.counters[reason] += 1
+        await self._finish(request, "failed", dict(failure, attempts=attempts))
+
+    async def dispatch(self, request: Dict):
+        """Send a single request to a replica"""
+        if request.get('deadline') and time.time() >= request['deadline']:
+            # Nobody is waiting for the answer any more
+            self.counters["deadline_exceeded"] += 1
+            await self._finish(request, "failed", {
+                "status_code": 504,
+                "error": "Deadline exceeded before the request reached a replica",
+                "attempts": request.get('attempts', 0)
+            })
+            return
+
+        # Get an endpoint from the load balancer
+        endpoint = self.load_balancer.get_endpoint_for_request(request['data'])
+        if not endpoint:
+            # No endpoints available, put the request back in the queue
+            await self.request_queue.requeue_request(request)
+            await asyncio.sleep(self.no_endpoint_sleep)  # Wait before trying again
+            return
+
+        if not request.get('attempts'):
+            self.retry_budget.deposit()
+        request['attempts'] = request.get('attempts', 0) + 1
+        try:
+            await self.result_store.set_status(request['id'], "processing")
+            response = await self._send(request, endpoint)
+        except Exception as e:
+            print(f"Error processing request {request['id']}: {type(e).__name__}: {str(e)}")
+            timed_out = isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError))
+            await self._retry_or_fail(request, {
+                "status_code": 504 if timed_out else 502,
+                "error": f"{type(e).__name__}: {str(e)}"
+            })
+            return
+
+        print(f"Request {request['id']} processed with response status: {response.status_code}")
+        if response.is_success:
+            try:
+                result = response.json()
+            except ValueError as e:
+                # A 200 with a body we cannot parse: fail it rather than leave it leased forever
+                await self._finish(request, "failed", {
+                    "status_code": 502,
+                    "error": f"Invalid JSON response from replica: {e}",
+                    "attempts": request['attempts']
+                })
+                return
+            if self.metrics:
+                self.metrics.record_completion(result.get("tokens_generated", 0))
+            await self._finish(request, "completed", result)
+        elif response.status_code in RETRYABLE_STATUS_CODES:
+            await self._retry_or_fail(request, {"status_code": response.status_code, "error": response.text})
+        else:
+            await self._finish(request, "failed", {
+                "status_code": response.status_code,
+                "error": response.text
+            })
+
+    def stats(self) -> Dict:
+        return dict(self.counters, hedge_delay=self._hedge_delay())
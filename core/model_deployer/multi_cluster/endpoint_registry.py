@@ -0,0 +1,91 @@
+# endpoint_registry.py
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Membership events passed to subscribers
+ADDED = "added"
+REMOVED = "removed"
+UPDATED = "updated"
+
+class EndpointRegistry:
+    """
+    Index of replica endpoints with O(1) lookups by instance id and address.
+
+    Entries look like {"instance_id", "endpoint", "cluster", "status"}. Readers
+    take snapshot(), an immutable tuple of the routable entries that is only
+    rebuilt when membership or status changes, tagged with a version number so
+    caches built on top of it (hash rings, health state) know when to refresh.
+    Subscribers are called as callback(event, entry) after every change, on the
+    thread that made it.
+    """
+    def __init__(self, routable_statuses=("running",)):
+        self.routable_statuses = set(routable_statuses)
+        self.lock = threading.RLock()
+        self.version = 0
+        self._by_id: Dict[str, Dict] = {}
+        self._by_address: Dict[str, str] = {}
+        self._snapshot: Tuple[Dict, ...] = ()
+        self._subscribers: List[Callable[[str, Dict], None]] = []
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, instance_id):
+        return instance_id in self._by_id
+
+    def _changed(self, event: str, entry: Dict):
+        # Called with the lock held
+        self.version += 1
+        self._snapshot = tuple(e for e in self._by_id.values() if e["status"] in self.routable_statuses)
+        for callback in list(self._subscribers):
+            try:
+                callback(event, entry)
+            except Exception as e:
+                print(f"Endpoint registry subscriber failed on {event} {entry['instance_id']}: {str(e)}")
+
+    def register(self, instance_id: str, endpoint: str, cluster: str, status: str = "running"):
+        with self.lock:
+            previous = self._by_id.get(instance_id)
+            if previous:
+                self._by_address.pop(previous["endpoint"], None)
+            entry = {"instance_id": instance_id, "endpoint": endpoint, "cluster": cluster, "status": status}
+            self._by_id[instance_id] = entry
+            self._by_address[endpoint] = instance_id
+            self._changed(UPDATED if previous else ADDED, entry)
+
+    def set_status(self, instance_id: str, status: str):
+        with self.lock:
+            entry = self._by_id.get(instance_id)
+            if entry is None or entry["status"] == status:
+                return
+            # Entries are shared with old snapshots, so replace rather than mutate
+            entry = dict(entry, status=status)
+            self._by_id[instance_id] = entry
+            self._changed(UPDATED, entry)
+
+    def unregister(self, instance_id: str):
+        with self.lock:
+            entry = self._by_id.pop(instance_id, None)
+            if entry is None:
+                return
+            self._by_address.pop(entry["endpoint"], None)
+            self._changed(REMOVED, entry)
+
+    def get(self, instance_id: str) -> Optional[Dict]:
+        return self._by_id.get(instance_id)
+
+    def instance_id_for(self, endpoint: str) -> Optional[str]:
+        return self._by_address.get(endpoint)
+
+    def snapshot(self) -> Tuple[Dict, ...]:
+        """Routable entries; treat as read-only"""
+        return self._snapshot
+
+    def subscribe(self, callback: Callable[[str, Dict], None]):
+        with self.lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[str, Dict], None]):
+        with self.lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
@@ -0,0 +1,54 @@
+# forecaster.py
+from typing import List, Optional
+
+class HoltWinters:
+    """
+    Additive Holt-Winters exponential smoothing.
+
+    With season_length=0, or fewer than two seasons of data, it falls back to
+    Holt's linear trend method (level + trend), which is what catches
+    traffic ramps. The model is refit on every call; the series are short
+    sliding windows, so this is cheap.
+    """
+    def __init__(self, alpha: float = 0.5, beta: float = 0.3, gamma: float = 0.1, season_length: int = 0):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.season_length = season_length
+
+    def forecast(self, series: List[float], steps: int = 1) -> List[float]:
+        """Forecast the next `steps` values of `series` (oldest first)"""
+        if not series:
+            return [0.0] * steps
+        if len(series) == 1:
+            return [series[0]] * steps
+
+        m = self.season_length
+        seasonal: Optional[List[float]] = None
+        if m and len(series) >= 2 * m:
+            first, second = series[:m], series[m:2 * m]
+            level = sum(first) / m
+            trend = (sum(second) - sum(first)) / (m * m)
+            seasonal = [x - level for x in first]
+            start = m
+        else:
+            level = series[0]
+            trend = series[1] - series[0]
+            start = 1
+
+        for t in range(start, len(series)):
+            value = series[t]
+            previous_level = level
+            if seasonal is not None:
+                season = seasonal[t % m]
+                level = self.alpha * (value - season) + (1 - self.alpha) * (level + trend)
+                seasonal[t % m] = self.gamma * (value - level) + (1 - self.gamma) * season
+            else:
+                level = self.alpha * value + (1 - self.alpha) * (level + trend)
+            trend = self.beta * (level - previous_level) + (1 - self.beta) * trend
+
+        n = len(series)
+        return [
+            max(0.0, level + h * trend + (seasonal[(n + h - 1) % m] if seasonal is not None else 0.0))
+            for h in range(1, steps + 1)
+        ]
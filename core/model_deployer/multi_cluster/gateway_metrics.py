@@ -0,0 +1,108 @@
+# gateway_metrics.py
+import time
+import threading
+from collections import deque
+from typing import Dict, List
+
+class _Bucket:
+    __slots__ = ("start", "arrivals", "requested_tokens", "completions", "generated_tokens", "busy_seconds")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.arrivals = 0
+        self.requested_tokens = 0
+        self.completions = 0
+        self.generated_tokens = 0
+        self.busy_seconds = 0.0  # Replica-seconds spent with at least one request in flight
+
+class GatewayMetrics:
+    """
+    Sliding-window traffic counters kept by the gateway for the autoscaler.
+
+    Arrivals and completions are counted in fixed time buckets of
+    bucket_seconds over the last window_seconds. Busy time is tracked per
+    replica, counting only time with at least one request in flight, so
+    completions per busy second is what one replica actually delivers whether
+    it serves requests one at a time or batches them. Recording happens on the
+    event loop; the autoscaler thread reads, hence the lock.
+    """
+    def __init__(self, bucket_seconds: float = 10.0, window_seconds: float = 3600.0):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = deque(maxlen=max(2, int(window_seconds / bucket_seconds)))
+        self.lock = threading.Lock()
+        self.last_arrival = None  # Wall-clock time of the most recent request
+        self.in_flight: Dict[str, int] = {}  # replica -> requests sent and not yet answered
+        self.busy_since: Dict[str, float] = {}  # replica -> time its busy time was last accrued
+
+    def _current(self, now: float) -> _Bucket:
+        start = now - now % self.bucket_seconds
+        if not self.buckets:
+            self.buckets.append(_Bucket(start))
+        # Fill idle gaps with empty buckets so rates stay aligned to wall time
+        while self.buckets[-1].start < start:
+            self.buckets.append(_Bucket(self.buckets[-1].start + self.bucket_seconds))
+        return self.buckets[-1]
+
+    def record_arrival(self, requested_tokens: int = 0):
+        with self.lock:
+            bucket = self._current(time.time())
+            bucket.arrivals += 1
+            bucket.requested_tokens += requested_tokens
+            self.last_arrival = time.time()
+
+    def record_completion(self, generated_tokens: int = 0):
+        with self.lock:
+            bucket = self._current(time.time())
+            bucket.completions += 1
+            bucket.generated_tokens += generated_tokens
+
+    def _accrue_busy(self, now: float):
+        # Credit busy replicas up to now, so long busy stretches land in the buckets they span
+        bucket = self._current(now)
+        for replica, since in self.busy_since.items():
+            bucket.busy_seconds += now - since
+            self.busy_since[replica] = now
+
+    def replica_started(self, replica: str):
+        """A request was sent to `replica`"""
+        with self.lock:
+            now = time.time()
+            self._accrue_busy(now)
+            self.in_flight[replica] = self.in_flight.get(replica, 0) + 1
+            self.busy_since.setdefault(replica, now)
+
+    def replica_finished(self, replica: str):
+        """`replica` answered (or was abandoned on) a request"""
+        with self.lock:
+            self._accrue_busy(time.time())
+            self.in_flight[replica] -= 1
+            if not self.in_flight[replica]:
+                del self.in_flight[replica]
+                del self.busy_since[replica]
+
+    def _closed_buckets(self) -> List[_Bucket]:
+        # The newest bucket is still filling up, so leave it out of rates
+        self._accrue_busy(time.time())
+        return list(self.buckets)[:-1]
+
+    def arrival_rates(self) -> List[float]:
+        """Requests per second for each completed bucket, oldest first"""
+        with self.lock:
+            return [b.arrivals / self.bucket_seconds for b in self._closed_buckets()]
+
+    def token_demand_rates(self) -> List[float]:
+        """Requested tokens (max_length) per second for each completed bucket, oldest first"""
+        with self.lock:
+            return [b.requested_tokens / self.bucket_seconds for b in self._closed_buckets()]
+
+    def totals(self, last_seconds: float = 600.0) -> Dict[str, float]:
+        """Summed counters over the most recent buckets"""
+        with self.lock:
+            buckets = self._closed_buckets()[-max(1, int(last_seconds / self.bucket_seconds)):]
+            return {
+                "arrivals": sum(b.arrivals for b in buckets),
+                "requested_tokens": sum(b.requested_tokens for b in buckets),
+                "completions": sum(b.completions for b in buckets),
+                "generated_tokens": sum(b.generated_tokens for b in buckets),
+                "busy_seconds": sum(b.busy_seconds for b in buckets),
+            }
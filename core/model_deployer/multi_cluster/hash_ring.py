@@ -0,0 +1,76 @@
+# hash_ring.py
+import bisect
+import hashlib
+import math
+from typing import Callable, Dict, Iterable, Optional, Set
+
+def stable_hash(key: str) -> int:
+    """64-bit hash that is identical across processes (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class ConsistentHashRing:
+    """
+    Consistent-hash ring with virtual nodes and bounded loads.
+
+    Each node is placed on the ring `replicas` times. A key maps to the first
+    node clockwise from its hash, so adding or removing a node only moves the
+    keys adjacent to it. With a load function, lookups skip nodes whose load
+    exceeds (1 + load_factor) times the average, spilling a hot key over to the
+    next node on the ring instead of overloading its home node.
+    """
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100, load_factor: float = 0.25):
+        self.replicas = replicas
+        self.load_factor = load_factor
+        self.nodes = set()
+        self._hashes = []
+        self._owners: Dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = stable_hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._hashes, point)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._hashes = [point for point in self._hashes if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def get(self,
+            key: str,
+            load: Optional[Callable[[str], int]] = None,
+            eligible: Optional[Set[str]] = None,
+            total_load: Optional[int] = None) -> Optional[str]:
+        """
+        Node owning `key`. Only nodes in `eligible` (a subset of the ring's nodes,
+        default: all) are considered, and when `load` is given, nodes at or above
+        the load bound are skipped.
+        Pass total_load if the caller already tracks the candidates' summed load.
+        """
+        candidates = self.nodes if eligible is None else eligible
+        if not candidates:
+            return None
+        start = bisect.bisect(self._hashes, stable_hash(key))
+        capacity = None
+        if load is not None:
+            # Bound from "Consistent Hashing with Bounded Loads": ceil((1 + eps) * (m + 1) / n)
+            total = total_load if total_load is not None else sum(load(node) for node in candidates)
+            capacity = math.ceil((1 + self.load_factor) * (total + 1) / len(candidates))
+        seen = set()
+        for offset in range(len(self._hashes)):
+            node = self._owners[self._hashes[(start + offset) % len(self._hashes)]]
+            if node in seen or node not in candidates:
+                continue
+            if capacity is None or load(node) < capacity:
+                return node
+            seen.add(node)
+            if len(seen) == len(candidates):
+                break
+        return None
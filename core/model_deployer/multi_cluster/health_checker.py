@@ -0,0 +1,241 @@
+# health_checker.py
+import time
+import asyncio
+import statistics
+import httpx
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# Replica health states. Only healthy replicas receive traffic.
+UNKNOWN = "unknown"      # Not probed successfully yet, e.g. still loading weights
+HEALTHY = "healthy"
+EJECTED = "ejected"      # Circuit open: no traffic until ejected_until
+HALF_OPEN = "half_open"  # Ejection expired: the next probe decides
+
+@dataclass
+class EndpointHealth:
+    endpoint: str
+    state: str = UNKNOWN
+    consecutive_failures: int = 0
+    latency_ewma: Optional[float] = None  # Probe latency in seconds
+    ejected_until: float = 0.0
+    ejection_count: int = 0
+    last_error: Optional[str] = None
+
+class HealthChecker:
+    """
+    Active and passive health checking for replicas.
+
+    A background task probes every replica's /health endpoint concurrently,
+    and the load balancer reports the outcome of real requests. A replica is
+    ejected (circuit opened) after failure_threshold consecutive failures, or
+    when its probe latency exceeds outlier_factor times the median of its
+    peers. Ejections last base_ejection_time, doubling on every repeat up to
+    max_ejection_time; afterwards the replica is half-open and a single
+    successful probe closes the circuit again.
+
+    A replica with gateway requests in flight (per in_flight) may answer
+    probes slowly simply because it is busy generating, so while it is busy a
+    probe timeout is not counted as a failure and it is not ejected as a
+    latency outlier. Errors and bad statuses still count.
+    """
+    def __init__(self,
+                 deployment_manager,
+                 interval: float = 5.0,
+                 timeout: float = 2.0,
+                 failure_threshold: int = 3,
+                 base_ejection_time: float = 10.0,
+                 max_ejection_time: float = 300.0,
+                 outlier_factor: float = 3.0,
+                 min_peers_for_outliers: int = 3,
+                 max_ejected_fraction: float = 0.5,
+                 ewma_alpha: float = 0.3,
+                 on_healthy: Optional[Callable[[str], None]] = None,
+                 in_flight: Optional[Callable[[str], int]] = None):
+        self.deployment_manager = deployment_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.outlier_factor = outlier_factor
+        self.min_peers_for_outliers = min_peers_for_outliers
+        self.max_ejected_fraction = max_ejected_fraction
+        self.ewma_alpha = ewma_alpha
+        self.on_healthy = on_healthy  # Called with the instance_id when a new replica first passes
+        self.in_flight = in_flight  # Gateway requests outstanding per instance_id
+
+        self.health: Dict[str, EndpointHealth] = {}  # instance_id -> health
+        self.version = 0  # Bumped whenever the set of routable replicas changes
+        self.registry_version = -1
+        self.client: Optional[httpx.AsyncClient] = None
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wake: Optional[asyncio.Event] = None
+        self.running = False
+
+    async def start(self):
+        self.client = httpx.AsyncClient(timeout=self.timeout)
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.running = True
+        # Probe new or reactivated replicas right away instead of at the next interval
+        self.deployment_manager.registry.subscribe(self._on_registry_change)
+        self.task = asyncio.create_task(self._probe_loop())
+
+    def _on_registry_change(self, event: str, entry: Dict):
+        # Registry changes happen on the autoscaler thread
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    async def stop(self):
+        self.running = False
+        self.deployment_manager.registry.unsubscribe(self._on_registry_change)
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.client:
+            await self.client.aclose()
+
+    def is_routable(self, instance_id: str) -> bool:
+        health = self.health.get(instance_id)
+        return health is not None and health.state == HEALTHY
+
+    def routable(self, endpoints: List[Dict]) -> List[Dict]:
+        """Filter an endpoint list down to replicas that may receive traffic"""
+        return [e for e in endpoints if self.is_routable(e["instance_id"])]
+
+    def record_result(self, instance_id: str, success: bool):
+        """Passive check: outcome of a real request sent to the replica"""
+        health = self.health.get(instance_id)
+        if health is None or health.state != HEALTHY:
+            return
+        if success:
+            health.consecutive_failures = 0
+        else:
+            self._record_failure(instance_id, health, "request failed")
+
+    def _eject(self, instance_id: str, health: EndpointHealth, reason: str):
+        duration = min(self.max_ejection_time, self.base_ejection_time * 2 ** health.ejection_count)
+        health.state = EJECTED
+        self.version += 1
+        health.ejected_until = time.time() + duration
+        health.ejection_count += 1
+        health.last_error = reason
+        print(f"Ejected replica {instance_id} for {duration:.0f}s: {reason}")
+
+    def _record_failure(self, instance_id: str, health: EndpointHealth, reason: str):
+        health.consecutive_failures += 1
+        health.last_error = reason
+        if health.state == UNKNOWN:
+            # Still starting up: stay unroutable without the ejection backoff
+            return
+        # A half-open replica gets exactly one chance
+        if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+            self._eject(instance_id, health, reason)
+
+    def _record_success(self, instance_id: str, health: EndpointHealth, latency: float):
+        health.consecutive_failures = 0
+        if health.latency_ewma is None:
+            health.latency_ewma = latency
+        else:
+            health.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * health.latency_ewma
+        if health.state != HEALTHY:
+            first_pass = health.state == UNKNOWN
+            print(f"Replica {instance_id} is healthy" if first_pass else f"Replica {instance_id} recovered")
+            health.state = HEALTHY
+            self.version += 1
+            if first_pass and self.on_healthy:
+                self.on_healthy(instance_id)
+
+    def _busy(self, instance_id: str) -> bool:
+        return bool(self.in_flight and self.in_flight(instance_id) > 0)
+
+    async def _probe(self, instance_id: str, health: EndpointHealth):
+        started = time.monotonic()
+        try:
+            response = await self.client.get(f"http://{health.endpoint}/health")
+            if response.is_success:
+                self._record_success(instance_id, health, time.monotonic() - started)
+            else:
+                self._record_failure(instance_id, health, f"/health returned {response.status_code}")
+        except httpx.TimeoutException as e:
+            if health.state == HEALTHY and self._busy(instance_id):
+                # Slow because it is serving traffic; real requests report real failures
+                health.last_error = f"probe timed out while busy: {str(e)}"
+                return
+            self._record_failure(instance_id, health, f"{type(e).__name__}: {str(e)}")
+        except Exception as e:
+            self._record_failure(instance_id, health, f"{type(e).__name__}: {str(e)}")
+
+    def _sync_endpoints(self):
+        registry = self.deployment_manager.registry
+        if self.registry_version == registry.version:
+            return
+        self.registry_version = registry.version
+        endpoints = {e["instance_id"]: e["endpoint"] for e in registry.snapshot()}
+        for instance_id in self.health.keys() - endpoints.keys():
+            del self.health[instance_id]
+        for instance_id, endpoint in endpoints.items():
+            if instance_id not in self.health or self.health[instance_id].endpoint != endpoint:
+                self.health[instance_id] = EndpointHealth(endpoint=endpoint)
+        self.version += 1
+
+    def _eject_latency_outliers(self):
+        healthy = {i: h for i, h in self.health.items() if h.state == HEALTHY and h.latency_ewma is not None}
+        if len(healthy) < self.min_peers_for_outliers:
+            return
+        median = statistics.median(h.latency_ewma for h in healthy.values())
+        # Never eject so many replicas that the rest get overwhelmed
+        budget = int(len(self.health) * self.max_ejected_fraction) - sum(
+            1 for h in self.health.values() if h.state in (EJECTED, HALF_OPEN)
+        )
+        outliers = sorted(
+            (i for i, h in healthy.items()
+             if h.latency_ewma > self.outlier_factor * median and not self._busy(i)),
+            key=lambda i: healthy[i].latency_ewma,
+            reverse=True
+        )
+        for instance_id in outliers[:max(0, budget)]:
+            health = healthy[instance_id]
+            self._eject(instance_id, health, f"latency outlier ({health.latency_ewma * 1000:.0f}ms vs median {median * 1000:.0f}ms)")
+            # Start from a clean estimate when it comes back
+            health.latency_ewma = None
+
+    async def check_all(self):
+        """Run one probe round over every replica"""
+        self._sync_endpoints()
+        now = time.time()
+        probes = []
+        for instance_id, health in self.health.items():
+            if health.state == EJECTED:
+                if now < health.ejected_until:
+                    continue
+                health.state = HALF_OPEN
+            probes.append(self._probe(instance_id, health))
+        await asyncio.gather(*probes)
+        self._eject_latency_outliers()
+
+    async def _probe_loop(self):
+        while self.running:
+            try:
+                await self.check_all()
+            except Exception as e:
+                print(f"Error checking replica health: {str(e)}")
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def get_status(self) -> Dict[str, Dict]:
+        return {
+            instance_id: {
+                "endpoint": h.endpoint,
+                "state": h.state,
+                "consecutive_failures": h.consecutive_failures,
+                "latency_ms": round(h.latency_ewma * 1000, 1) if h.latency_ewma is not None else None,
+                "last_error": h.last_error
+            }
+            for instance_id, h in self.health.items()
+        }
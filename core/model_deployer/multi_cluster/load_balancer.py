@@ -1,29 +1,100 @@
 # load_balancer.py
 import random
 import time
+import threading
 from typing import Dict, Any, List, Optional
+from hash_ring import ConsistentHashRing
+from endpoint_registry import REMOVED
 
 class LoadBalancer:
-    def __init__(self, deployment_manager):
+    """
+    Picks a replica for each request.
+
+    Strategies:
+        round_robin: cycle through replicas
+        random: uniform random replica
+        least_connections: fewest in-flight requests
+        p2c_ewma: sample two replicas and take the one with the lower expected
+            wait, (outstanding + 1) * EWMA latency, so slow hardware gets less work
+        prefix_affinity: consistent-hash the request's session_id (or the start of
+            its prompt) so a conversation keeps hitting the replica that holds its
+            prefix cache; spills to the next replica on the ring when that one
+            carries more than (1 + load_factor) times the average load
+
+    Picks and releases happen on the event loop, while registry changes arrive
+    on the deployment and health-check threads; a lock guards the shared
+    per-replica state.
+    """
+    STRATEGIES = ("round_robin", "random", "least_connections", "p2c_ewma", "prefix_affinity")
+
+    def __init__(self,
+                 deployment_manager,
+                 strategy: str = "round_robin",
+                 ewma_alpha: float = 0.3,
+                 failure_penalty: float = 5.0,
+                 prefix_chars: int = 256,
+                 load_factor: float = 0.25,
+                 health_checker=None):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy '{strategy}'. Choose from {list(self.STRATEGIES)}")
         self.deployment_manager = deployment_manager
-        self.strategy = "round_robin"  # Could be 'round_robin', 'random', 'least_connections'
+        self.registry = deployment_manager.registry
+        self.strategy = strategy
         self.current_index = 0
-        self.connection_counts = {}  # For least_connections strategy
+        self.connection_counts = {}  # In-flight requests per instance_id
+        self.total_connections = 0
+        self.ewma_alpha = ewma_alpha
+        self.failure_penalty = failure_penalty  # Seconds charged for a failed request, so fast failures don't attract traffic
+        self.latency_ewma = {}  # Smoothed request latency in seconds per instance_id
+        self.prefix_chars = prefix_chars  # Prompt characters hashed when a request has no session_id
+        self.hash_ring = ConsistentHashRing(load_factor=load_factor)
+        self.ring_version = -1  # Registry version the hash ring was built from
+        self.health_checker = health_checker  # When set, only replicas it reports healthy get traffic
+        # Guards connection counts, latencies and the hash ring; never held across an await
+        self.lock = threading.Lock()
+        self.registry.subscribe(self._on_registry_change)
+        self._routable_key = None  # (registry version, health version) the cached list was built from
+        self._routable = ()
+        self._routable_ids = set()
         
     def get_endpoint_for_request(self, request_data=None) -> Optional[str]:
         """Get the next endpoint to send a request to"""
-        endpoints = self.deployment_manager.get_active_endpoints()
-        
-        if not endpoints:
-            return None
+        with self.lock:
+            endpoints = self._routable_endpoints()
             
-        # default to using round_robin 
-        endpoint = self._round_robin_select(endpoints)
-        if self.strategy == "random":
-            endpoint = self._random_select(endpoints)
-        elif self.strategy == "least_connections":
-            endpoint = self._least_connections_select(endpoints)
-        return endpoint["endpoint"]
+            if not endpoints:
+                return None
+                
+            if self.strategy == "random":
+                endpoint = self._random_select(endpoints)
+            elif self.strategy == "least_connections":
+                endpoint = self._least_connections_select(endpoints)
+            elif self.strategy == "p2c_ewma":
+                endpoint = self._p2c_ewma_select(endpoints)
+            elif self.strategy == "prefix_affinity":
+                endpoint = self._prefix_affinity_select(endpoints, request_data)
+            else:
+                endpoint = self._round_robin_select(endpoints)
+            # Every strategy tracks in-flight requests; the dispatcher releases them
+            instance_id = endpoint["instance_id"]
+            self.connection_counts[instance_id] = self.connection_counts.get(instance_id, 0) + 1
+            self.total_connections += 1
+            return endpoint["endpoint"]
+        
+    def _routable_endpoints(self) -> List[Dict]:
+        """Registered replicas that may receive traffic, recomputed only when either source changes"""
+        if not self.health_checker:
+            return self.registry.snapshot()
+        key = (self.registry.version, self.health_checker.version)
+        if key != self._routable_key:
+            self._routable = self.health_checker.routable(self.registry.snapshot())
+            self._routable_ids = {e["instance_id"] for e in self._routable}
+            self._routable_key = key
+        return self._routable
+        
+    def _on_registry_change(self, event: str, entry: Dict):
+        if event == REMOVED:
+            self.forget_endpoint(entry["instance_id"])
         
     def _round_robin_select(self, endpoints: List[Dict]) -> Dict:
         """Select an endpoint using round-robin strategy"""
@@ -37,33 +108,85 @@ class LoadBalancer:
         
     def _least_connections_select(self, endpoints: List[Dict]) -> Dict:
         """Select the endpoint with the least active connections"""
-        # Initialize connection counts for new endpoints
-        for endpoint in endpoints:
-            instance_id = endpoint["instance_id"]
-            if instance_id not in self.connection_counts:
-                self.connection_counts[instance_id] = 0
-                
-        # Clean up old endpoints
-        for instance_id in list(self.connection_counts.keys()):
-            if instance_id not in [e["instance_id"] for e in endpoints]:
-                del self.connection_counts[instance_id]
-                
-        # Find endpoint with least connections
-        min_connections = float('inf')
-        selected_endpoint = None
+        return min(endpoints, key=lambda e: self.connection_counts.get(e["instance_id"], 0))
         
-        for endpoint in endpoints:
-            instance_id = endpoint["instance_id"]
-            if self.connection_counts[instance_id] < min_connections:
-                min_connections = self.connection_counts[instance_id]
-                selected_endpoint = endpoint
-                
-        # Increment connection count
-        self.connection_counts[selected_endpoint["instance_id"]] += 1
+    def _expected_wait(self, instance_id: str, default_latency: float) -> float:
+        latency = self.latency_ewma.get(instance_id, default_latency)
+        return (self.connection_counts.get(instance_id, 0) + 1) * latency
+        
+    def _p2c_ewma_select(self, endpoints: List[Dict]) -> Dict:
+        """Power of two choices on expected wait (outstanding requests x EWMA latency)"""
+        if len(endpoints) == 1:
+            return endpoints[0]
+        first, second = random.sample(endpoints, 2)
+        # Replicas without samples yet are assumed to be as fast as the best known one,
+        # so new replicas get traffic and build up an estimate
+        default_latency = min(self.latency_ewma.values(), default=1.0)
+        if self._expected_wait(second["instance_id"], default_latency) < self._expected_wait(first["instance_id"], default_latency):
+            return second
+        return first
+        
+    def _affinity_key(self, request_data) -> Optional[str]:
+        if not request_data:
+            return None
+        if request_data.get("session_id"):
+            return f"session:{request_data['session_id']}"
+        prompt = request_data.get("prompt")
+        # Characters stand in for tokens: the gateway has no tokenizer, and a shared
+        # character prefix implies a shared token prefix
+        return f"prefix:{prompt[:self.prefix_chars]}" if prompt else None
+        
+    def _prefix_affinity_select(self, endpoints: List[Dict], request_data) -> Dict:
+        """Consistent hashing with bounded load on the session or prompt prefix"""
+        # The ring holds every registered replica, not just healthy ones, so a brief
+        # ejection doesn't reshuffle sessions; only rebuild when membership changes
+        if self.ring_version != self.registry.version:
+            members = {e["instance_id"] for e in self.registry.snapshot()}
+            for instance_id in self.hash_ring.nodes - members:
+                self.hash_ring.remove(instance_id)
+            for instance_id in members - self.hash_ring.nodes:
+                self.hash_ring.add(instance_id)
+            self.ring_version = self.registry.version
+            
+        key = self._affinity_key(request_data)
+        if key is None:
+            return self._least_connections_select(endpoints)
+        instance_id = self.hash_ring.get(
+            key,
+            load=lambda i: self.connection_counts.get(i, 0),
+            eligible=self._routable_ids if self.health_checker else None,
+            # Close enough when some replicas are unroutable, and avoids an O(n) sum per request
+            total_load=self.total_connections
+        )
+        return self.registry.get(instance_id) if instance_id else self._least_connections_select(endpoints)
+        
+    def record_latency(self, instance_id: str, latency: float, success: bool = True, cancelled: bool = False):
+        """
+        Fold a finished request's latency (seconds) into the endpoint's EWMA. A cancelled
+        request (a hedge that lost) contributes the time it had taken so far, a lower
+        bound on its latency, but says nothing about the replica's health.
+        """
+        if self.health_checker and not cancelled:
+            self.health_checker.record_result(instance_id, success)
+        if not success and not cancelled:
+            latency = max(latency, self.failure_penalty)
+        with self.lock:
+            previous = self.latency_ewma.get(instance_id)
+            if previous is None:
+                self.latency_ewma[instance_id] = latency
+            else:
+                self.latency_ewma[instance_id] = self.ewma_alpha * latency + (1 - self.ewma_alpha) * previous
         
-        return selected_endpoint
+    def forget_endpoint(self, instance_id: str):
+        """Drop all state kept for a removed replica. Called from any thread."""
+        with self.lock:
+            self.total_connections -= self.connection_counts.pop(instance_id, 0)
+            self.latency_ewma.pop(instance_id, None)
+            self.hash_ring.remove(instance_id)
         
     def release_endpoint(self, instance_id: str):
-        """Mark an endpoint as no longer in use (for least_connections strategy)"""
-        if instance_id in self.connection_counts:
-            self.connection_counts[instance_id] = max(0, self.connection_counts[instance_id] - 1)
\ No newline at end of file
+        """Mark a request to an endpoint as finished"""
+        with self.lock:
+            if self.connection_counts.get(instance_id, 0) > 0:
+                self.connection_counts[instance_id] -= 1
+                self.total_connections -= 1
\ No newline at end of file
@@ -0,0 +1,335 @@
+# placement.py
+import json
+import math
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from core.common.ssh import SSHConfig
+from core.model_deployer.profiler.profiler import get_host_profile
+from core.model_deployer.profiler.benchmarks import measured_gflops
+
+GiB = 1024 ** 3
+
+DEFAULT_PORT_RANGE = (8000, 9000)
+
+def parse_cpulist(cpulist: str) -> List[int]:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpulist(cpus: List[int]) -> str:
+    """[0, 1, 2, 3, 8] -> '0-3,8' (docker --cpuset-cpus syntax)"""
+    parts, cpus = [], sorted(cpus)
+    i = 0
+    while i < len(cpus):
+        j = i
+        while j + 1 < len(cpus) and cpus[j + 1] == cpus[j] + 1:
+            j += 1
+        parts.append(str(cpus[i]) if i == j else f"{cpus[i]}-{cpus[j]}")
+        i = j + 1
+    return ",".join(parts)
+
+@dataclass
+class Resources:
+    cores: float = 0.0
+    memory_bytes: int = 0
+    gpu_memory_bytes: int = 0
+
+    def __add__(self, other: "Resources") -> "Resources":
+        return Resources(
+            self.cores + other.cores,
+            self.memory_bytes + other.memory_bytes,
+            self.gpu_memory_bytes + other.gpu_memory_bytes
+        )
+
+    def fits_within(self, capacity: "Resources") -> bool:
+        return (self.cores <= capacity.cores
+                and self.memory_bytes <= capacity.memory_bytes
+                and self.gpu_memory_bytes <= capacity.gpu_memory_bytes)
+
+    def scaled(self, factor: float) -> "Resources":
+        return Resources(self.cores * factor, int(self.memory_bytes * factor), int(self.gpu_memory_bytes * factor))
+
+@dataclass
+class Placement:
+    """Where one new replica goes: host, reserved port and CPU pinning"""
+    host: "Host"
+    allocation_id: str
+    port: int
+    cpuset: Optional[str] = None  # docker --cpuset-cpus
+    numa_node: Optional[int] = None  # docker --cpuset-mems, when the CPUs sit on one node
+
+@dataclass
+class Host:
+    """One machine from the inventory file"""
+    id: str
+    hostname: str
+    username: str
+    key_filename: str
+    port: int = 22
+    failure_domain: str = ""  # Rack, zone or power domain; defaults to the host itself
+    headroom: Optional[float] = None  # Fraction kept free; None uses the inventory default
+    max_replicas: Optional[int] = None
+    capacity: Optional[Resources] = None  # From the inventory, else from the host profile
+    gflops: Optional[float] = None  # Measured throughput, used to break ties
+    port_range: Tuple[int, int] = DEFAULT_PORT_RANGE
+    numa_cpus: Optional[List[List[int]]] = None  # CPU ids per NUMA node, from the host profile
+    online_cpus: Optional[List[int]] = None  # Online CPU ids, from the host profile
+    allocations: Dict[str, tuple] = field(default_factory=dict)  # allocation id -> (model_id, Resources)
+    ports: Dict[str, int] = field(default_factory=dict)  # allocation id -> port
+    pinned_cpus: Dict[str, List[int]] = field(default_factory=dict)  # allocation id -> CPU ids
+
+    @property
+    def ssh_config(self) -> SSHConfig:
+        return SSHConfig(hostname=self.hostname, username=self.username, key_filename=self.key_filename, port=self.port)
+
+    def as_cluster(self) -> Dict:
+        """The cluster dict DeploymentManager records for each replica"""
+        return {
+            "id": self.id,
+            "hostname": self.hostname,
+            "username": self.username,
+            "key_filename": self.key_filename,
+            "port": self.port,
+            "failure_domain": self.failure_domain
+        }
+
+    def used(self) -> Resources:
+        total = Resources()
+        for _, resources in self.allocations.values():
+            total = total + resources
+        return total
+
+def _profile_capacity(profile: dict) -> Resources:
+    memory_total = float(profile.get("memory_total") or 0)
+    # `free -g` reports GiB on linux; macOS sysctl reports bytes
+    memory_bytes = int(memory_total if profile.get("os") == "mac_os" else memory_total * GiB)
+    gpu_mib = [int(line) for line in str(profile.get("gpu_memory_total") or "").split() if line.strip().isdigit()]
+    return Resources(
+        cores=float(profile.get("cpu_count") or 0),
+        memory_bytes=memory_bytes,
+        gpu_memory_bytes=sum(gpu_mib) * 1024 ** 2
+    )
+
+class HostInventory:
+    """
+    Cluster inventory and resource ledger used to place replicas.
+
+    Loaded from a JSON file of the form
+        {"default_headroom": 0.1, "max_replicas_per_host": null,
+         "hosts": [{"id", "hostname", "username", "key_filename",
+                    "failure_domain"?, "headroom"?, "max_replicas"?,
+                    "cores"?, "memory_gb"?, "gpu_memory_gb"?, "port_range"?}]}
+    Capacities missing from the file come from the host's cached hardware
+    profile. One inventory can be shared by the deployment managers of
+    several models so they pack onto the same fleet without overcommitting.
+    """
+    def __init__(self, hosts: List[Host], default_headroom: float = 0.1, profile_hosts: bool = True):
+        self.hosts = {host.id: host for host in hosts}
+        self.default_headroom = default_headroom
+        self.profile_hosts = profile_hosts
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs) -> "HostInventory":
+        with open(path) as f:
+            config = json.load(f)
+        hosts = []
+        for entry in config["hosts"]:
+            capacity = None
+            if any(k in entry for k in ("cores", "memory_gb", "gpu_memory_gb")):
+                capacity = Resources(
+                    cores=float(entry.get("cores", 0)),
+                    memory_bytes=int(entry.get("memory_gb", 0) * GiB),
+                    gpu_memory_bytes=int(entry.get("gpu_memory_gb", 0) * GiB)
+                )
+            hosts.append(Host(
+                id=entry["id"],
+                hostname=entry["hostname"],
+                username=entry["username"],
+                key_filename=entry["key_filename"],
+                port=entry.get("port", 22),
+                failure_domain=entry.get("failure_domain") or entry["id"],
+                headroom=entry.get("headroom"),
+                max_replicas=entry.get("max_replicas", config.get("max_replicas_per_host")),
+                capacity=capacity,
+                port_range=tuple(entry.get("port_range", DEFAULT_PORT_RANGE))
+            ))
+        return cls(hosts, default_headroom=config.get("default_headroom", 0.1), **kwargs)
+
+    def _resolved(self, host: Host) -> bool:
+        return host.capacity is not None and (host.gflops is not None or not self.profile_hosts)
+
+    def _fetch_profile(self, host: Host) -> Optional[dict]:
+        try:
+            return get_host_profile(host.ssh_config)
+        except Exception as e:
+            print(f"Could not profile host {host.id}: {str(e)}")
+            return None
+
+    def _resolve_hosts(self):
+        """
+        Fill in capacity and throughput from the host profiles (cached per host).
+        Hosts are profiled in parallel and outside the lock. A host whose profile
+        could not be fetched stays unresolved and is retried on the next call; until
+        then it is only placeable if the inventory file gives its capacity.
+        """
+        with self.lock:
+            pending = [host for host in self.hosts.values() if not self._resolved(host)]
+            if not self.profile_hosts:
+                for host in pending:
+                    host.capacity = Resources()
+                return
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            profiles = list(pool.map(self._fetch_profile, pending))
+        with self.lock:
+            for host, profile in zip(pending, profiles):
+                if profile is None or self._resolved(host):
+                    continue
+                if host.capacity is None:
+                    host.capacity = _profile_capacity(profile)
+                online = str(profile.get("online_cpus") or "").strip()
+                host.online_cpus = parse_cpulist(online) if online else None
+                numa = [parse_cpulist(line) for line in str(profile.get("numa_cpulists") or "").splitlines() if line.strip()]
+                if numa and host.online_cpus:
+                    online_set = set(host.online_cpus)
+                    numa = [[cpu for cpu in cpus if cpu in online_set] for cpus in numa]
+                host.numa_cpus = numa or None
+                host.gflops = measured_gflops(profile, "bf16") or measured_gflops(profile, "fp32") or 0.0
+
+    def has_gpus(self) -> bool:
+        """Whether any host in the inventory has GPU memory"""
+        self._resolve_hosts()
+        with self.lock:
+            return any(host.capacity and host.capacity.gpu_memory_bytes > 0 for host in self.hosts.values())
+
+    def _usable(self, host: Host) -> Resources:
+        headroom = self.default_headroom if host.headroom is None else host.headroom
+        return host.capacity.scaled(1 - headroom)
+
+    def _assign_port(self, host: Host, allocation_id: str) -> int:
+        taken = set(host.ports.values())
+        start, end = host.port_range
+        port = next((p for p in range(start, end + 1) if p not in taken), None)
+        if port is None:
+            raise RuntimeError(f"No free ports left on {host.id} in {start}-{end}")
+        host.ports[allocation_id] = port
+        return port
+
+    def _pin(self, host: Host, allocation_id: str, cores: float) -> Tuple[Optional[str], Optional[int]]:
+        """Reserve whole CPUs, on a single NUMA node when one has room, else across nodes"""
+        nodes = host.numa_cpus or ([host.online_cpus] if host.online_cpus else None)
+        if not nodes:
+            # Core counts are scheduling figures, not CPU ids; a made-up cpuset could name
+            # CPUs the host doesn't have and docker would refuse to start the container
+            return None, None
+        needed = max(1, math.ceil(cores))
+        taken = {cpu for cpus in host.pinned_cpus.values() for cpu in cpus}
+        free = [[cpu for cpu in cpus if cpu not in taken] for cpus in nodes]
+        # Fullest node that still fits, so other nodes stay whole for bigger replicas
+        fitting = [i for i, cpus in enumerate(free) if len(cpus) >= needed]
+        if fitting:
+            node = min(fitting, key=lambda i: len(free[i]))
+            host.pinned_cpus[allocation_id] = free[node][:needed]
+            return format_cpulist(host.pinned_cpus[allocation_id]), node if len(nodes) > 1 else None
+        spread = [cpu for cpus in free for cpu in cpus][:needed]
+        if len(spread) < needed:
+            # Oversubscribed (capacity from the inventory exceeds real CPUs): don't pin
+            return None, None
+        host.pinned_cpus[allocation_id] = spread
+        return format_cpulist(spread), None
+
+    def place(self, model_id: str, requirements: Resources, count: int) -> List[Placement]:
+        """
+        Choose hosts for `count` new replicas of a model and reserve their resources.
+
+        Feasible hosts keep their headroom free after placement. Among them the
+        replica goes to the failure domain, then the host, with the fewest
+        replicas of this model (anti-affinity), and then to the host it fills
+        most tightly (best fit), so small replicas pack into partly used hosts
+        and large hosts stay free for large models. Returns fewer hosts than
+        requested when the fleet is full. Each placement reserves a port and
+        pinned CPUs on its host, and carries an allocation id to release() when
+        the replica goes away or fails to deploy.
+        """
+        self._resolve_hosts()
+        with self.lock:
+            chosen = []
+            for _ in range(count):
+                domain_counts: Dict[str, int] = {}
+                for host in self.hosts.values():
+                    replicas = sum(1 for m, _ in host.allocations.values() if m == model_id)
+                    domain_counts[host.failure_domain] = domain_counts.get(host.failure_domain, 0) + replicas
+
+                best, best_score = None, None
+                for host in self.hosts.values():
+                    if host.capacity is None:
+                        continue  # Not profiled yet
+                    if host.max_replicas is not None and len(host.allocations) >= host.max_replicas:
+                        continue
+                    after = host.used() + requirements
+                    usable = self._usable(host)
+                    if not after.fits_within(usable):
+                        continue
+                    # Fraction of the tightest resource left free after placement (lower = tighter fit)
+                    slack = min(
+                        (capacity - used) / capacity
+                        for used, capacity in (
+                            (after.cores, usable.cores),
+                            (after.memory_bytes, usable.memory_bytes),
+                            (after.gpu_memory_bytes, usable.gpu_memory_bytes)
+                        )
+                        if capacity > 0
+                    ) if usable.cores or usable.memory_bytes or usable.gpu_memory_bytes else 0.0
+                    same_model_on_host = sum(1 for m, _ in host.allocations.values() if m == model_id)
+                    score = (domain_counts[host.failure_domain], same_model_on_host, slack, -(host.gflops or 0.0))
+                    if best_score is None or score < best_score:
+                        best, best_score = host, score
+                if best is None:
+                    break
+                allocation_id = str(uuid.uuid4())
+                best.allocations[allocation_id] = (model_id, requirements)
+                port = self._assign_port(best, allocation_id)
+                cpuset, numa_node = self._pin(best, allocation_id, requirements.cores)
+                chosen.append(Placement(best, allocation_id, port, cpuset, numa_node))
+            return chosen
+
+    def set_port(self, host_id: str, allocation_id: str, port: int):
+        """Record the port a replica actually bound, if the deployer had to pick another"""
+        with self.lock:
+            host = self.hosts.get(host_id)
+            if host and allocation_id in host.allocations:
+                host.ports[allocation_id] = port
+
+    def release(self, host_id: str, allocation_id: str):
+        with self.lock:
+            host = self.hosts.get(host_id)
+            if host:
+                host.allocations.pop(allocation_id, None)
+                host.ports.pop(allocation_id, None)
+                host.pinned_cpus.pop(allocation_id, None)
+
+    def usage(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                host.id: {
+                    "failure_domain": host.failure_domain,
+                    "replicas": len(host.allocations),
+                    "used": vars(host.used()),
+                    "capacity": vars(host.capacity) if host.capacity else None
+                }
+                for host in self.hosts.values()
+            }
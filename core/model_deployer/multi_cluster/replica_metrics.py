@@ -0,0 +1,39 @@
+# replica_metrics.py
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+class ReplicaMetricsCollector:
+    """
+    Scrapes every routable replica's /metrics (TTFT percentiles, decode
+    tokens/sec, KV-cache occupancy, CPU utilization) concurrently. Runs on
+    the autoscaler's thread, so it uses a blocking client.
+    """
+    def __init__(self, registry, timeout: float = 2.0, max_workers: int = 16):
+        self.registry = registry
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.client = httpx.Client(timeout=timeout)
+        self.last = {}
+
+    def _scrape(self, endpoint: str):
+        try:
+            response = self.client.get(f"http://{endpoint}/metrics")
+            return response.json() if response.is_success else None
+        except Exception as e:
+            print(f"Error scraping metrics from {endpoint}: {str(e)}")
+            return None
+
+    def collect(self) -> Dict[str, Dict]:
+        """Latest metrics per instance_id; replicas that didn't answer are left out"""
+        endpoints = self.registry.snapshot()
+        if not endpoints:
+            self.last = {}
+            return self.last
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(endpoints))) as pool:
+            results = pool.map(self._scrape, [e["endpoint"] for e in endpoints])
+        self.last = {e["instance_id"]: m for e, m in zip(endpoints, results) if m is not None}
+        return self.last
+
+    def close(self):
+        self.client.close()
@@ -1,88 +1,173 @@
 # api_service.py
+import os
+import json
+import uuid
 import time
-import threading
-import requests
-from fastapi import FastAPI, BackgroundTasks
+import hashlib
+import asyncio
+from fastapi import FastAPI, BackgroundTasks, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 
-from request_queue import RequestQueue
+from request_queue import create_request_queue
 from load_balancer import LoadBalancer
 from deployment_manager import DeploymentManager
 from auto_scaler import AutoScaler
+from dispatcher import RequestDispatcher
+from health_checker import HealthChecker
+from gateway_metrics import GatewayMetrics
+from scaling_policies import ThresholdPolicy, PredictivePolicy, SLOPolicy
+from replica_metrics import ReplicaMetricsCollector
+from retry_budget import RetryBudget
+from result_store import RedisResultStore, InMemoryResultStore
+from coalescer import RedisCoalescer, InMemoryCoalescer
+from response_cache import RedisResponseCache, InMemoryResponseCache
+from scheduler import FairScheduler, PRIORITY_CLASSES, DEFAULT_PRIORITY, DEFAULT_TENANT
 
 app = FastAPI()
 
 # Initialize components
-request_queue = RequestQueue(redis_host='localhost', redis_port=6379)
+# QUEUE_BACKEND=memory runs the gateway without Redis (single node, load tests, CI)
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "redis")
+# Interactive > default > batch, with deficit round-robin across tenants inside a class.
+# TENANT_WEIGHTS is a JSON object, e.g. '{"team-a": 2, "offline-evals": 0.5}'
+scheduler = FairScheduler(
+    priorities=PRIORITY_CLASSES,
+    tenant_weights=json.loads(os.getenv("TENANT_WEIGHTS", "{}")),
+    promote_after=30.0
+)
+# Identical requests in flight at the same time run once (COALESCE_MODE=deterministic|all|off)
+COALESCE_MODE = os.getenv("COALESCE_MODE", "deterministic")
+if QUEUE_BACKEND == "memory":
+    request_queue = create_request_queue("memory", scheduler=scheduler)
+    result_store = InMemoryResultStore(ttl=3600)
+    coalescer = InMemoryCoalescer(mode=COALESCE_MODE)
+else:
+    request_queue = create_request_queue("redis", redis_host='localhost', redis_port=6379, scheduler=scheduler)
+    result_store = RedisResultStore(redis_host='localhost', redis_port=6379, ttl=3600)
+    coalescer = RedisCoalescer(redis_host='localhost', redis_port=6379, mode=COALESCE_MODE)
 
 deployment_manager = DeploymentManager(
     model_path="/home/sahil/test_models/llama_1b",
     inference_script="/home/sahil/win25-Team21/core/inference_engine/experimental/llama_inference.py",
-    image_tag="quantize_ai:latest"
+    image_tag="quantize_ai:latest",
+    # Paused, pre-loaded standby containers that make scaling up (and waking from zero) an unpause
+    warm_pool_size=int(os.getenv("WARM_POOL_SIZE", "0"))
+)
+
+# Completed responses shared by every gateway, answered without touching the queue
+# (RESPONSE_CACHE_MODE=deterministic|all|off)
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "deterministic")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+if QUEUE_BACKEND == "memory":
+    response_cache = InMemoryResponseCache(
+        deployment_manager.model_id, ttl=RESPONSE_CACHE_TTL, mode=RESPONSE_CACHE_MODE,
+        max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    )
+else:
+    response_cache = RedisResponseCache(
+        deployment_manager.model_id, redis_host='localhost', redis_port=6379,
+        ttl=RESPONSE_CACHE_TTL, mode=RESPONSE_CACHE_MODE,
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "100000"))
+    )
+
+# Replicas only receive traffic once their /health passes, and are ejected when it fails
+health_checker = HealthChecker(
+    deployment_manager,
+    interval=5.0,
+    timeout=2.0,
+    on_healthy=deployment_manager.mark_ready,  # Records cold-start time for activated replicas
+    # Busy replicas answer probes slowly; don't eject them for it
+    in_flight=lambda instance_id: load_balancer.connection_counts.get(instance_id, 0)
+)
+
+# p2c_ewma favours fast, idle replicas when the hardware is heterogeneous
+load_balancer = LoadBalancer(
+    deployment_manager,
+    strategy=os.getenv("LB_STRATEGY", "p2c_ewma"),
+    health_checker=health_checker
 )
+# Scale-down drains replicas until the load balancer reports no requests in flight
+deployment_manager.in_flight = lambda instance_id: load_balancer.connection_counts.get(instance_id, 0)
+
+# Arrival and completion counters for predictive scaling
+metrics = GatewayMetrics(bucket_seconds=10.0, window_seconds=3600.0)
 
-load_balancer = LoadBalancer(deployment_manager)
+# SCALING_POLICY=predictive sizes replicas from forecast demand instead of queue length;
+# SCALING_POLICY=slo scales on the replicas' own latency and load metrics
+SCALING_POLICY = os.getenv("SCALING_POLICY", "threshold")
+replica_metrics = None
+if SCALING_POLICY == "slo":
+    replica_metrics = ReplicaMetricsCollector(deployment_manager.registry, timeout=2.0)
+    scaling_policy = SLOPolicy(
+        replica_metrics,
+        ttft_p95_slo=float(os.getenv("TTFT_P95_SLO", "1.0")),
+        max_kv_occupancy=0.85,
+        max_cpu_utilization=0.85,
+        fallback=ThresholdPolicy(scale_up_threshold=5, scale_down_threshold=2)
+    )
+elif SCALING_POLICY == "predictive":
+    scaling_policy = PredictivePolicy(
+        metrics,
+        provisioning_seconds=300.0,
+        fallback=ThresholdPolicy(scale_up_threshold=5, scale_down_threshold=2)
+    )
+else:
+    scaling_policy = ThresholdPolicy(scale_up_threshold=5, scale_down_threshold=2)
 
 autoscaler = AutoScaler(
     request_queue=request_queue,
     deployment_manager=deployment_manager,
-    min_replicas=1,
+    # MIN_REPLICAS=0 with SCALE_TO_ZERO_AFTER lets idle models release all compute
+    min_replicas=int(os.getenv("MIN_REPLICAS", "1")),
     max_replicas=10,
     scale_up_threshold=5,  
-    scale_down_threshold=2 
+    scale_down_threshold=2,
+    policy=scaling_policy,
+    scale_up_cooldown=60,
+    scale_down_cooldown=300,
+    scale_to_zero_after=float(os.getenv("SCALE_TO_ZERO_AFTER")) if os.getenv("SCALE_TO_ZERO_AFTER") else None,
+    metrics=metrics
 )
-autoscaler.start_monitoring(check_interval=10)
-
-def process_requests():
-    """Background task to process requests from the queue"""
-    while True:
-        # Get a request from the queue
-        request = request_queue.dequeue_request()
-        if not request:
-            time.sleep(1)  # No requests, wait a bit
-            continue
-            
-        # Get an endpoint from the load balancer
-        endpoint = load_balancer.get_endpoint_for_request()
-        if not endpoint:
-            # No endpoints available, put the request back in the queue
-            request_queue.enqueue_request(request['data'])
-            time.sleep(5)  # Wait before trying again
-            continue
-            
-        try:
-            # Send the request to the endpoint
-            response = requests.post(
-                f"http://{endpoint}/query",
-                json=request['data'],
-                timeout=30
-            )
-            
-            # Process the response (in a real system, you'd send this back to the client)
-            print(f"Request {request['id']} processed with response status: {response.status_code}")
-            
-        except Exception as e:
-            print(f"Error processing request {request['id']}: {str(e)}")
-            # Optionally, put the request back in the queue for retry
-            request_queue.enqueue_request(request['data'])
-            
-        finally:
-            # Release the endpoint in the load balancer
-            # This is important for the least_connections strategy
-            if endpoint:
-                instance_id = next(
-                    (e["instance_id"] for e in deployment_manager.get_active_endpoints() 
-                     if e["endpoint"] == endpoint),
-                    None
-                )
-                if instance_id:
-                    load_balancer.release_endpoint(instance_id)
-
-# Start the request processor in a background thread
-processor_thread = threading.Thread(target=process_requests)
-processor_thread.daemon = True
-processor_thread.start()
+
+# Dispatch queued requests to replicas concurrently over pooled HTTP connections
+dispatcher = RequestDispatcher(
+    request_queue=request_queue,
+    load_balancer=load_balancer,
+    deployment_manager=deployment_manager,
+    result_store=result_store,
+    num_workers=64,
+    max_concurrency_per_endpoint=8,
+    request_timeout=30.0,
+    metrics=metrics,
+    max_attempts=3,
+    # Retries and hedges together may add at most 20% to recent traffic
+    retry_budget=RetryBudget(ratio=0.2, min_per_second=1.0),
+    # HEDGE_QUANTILE=0.95 sends a second copy of requests slower than the recent p95
+    hedge_quantile=float(os.getenv("HEDGE_QUANTILE")) if os.getenv("HEDGE_QUANTILE") else None,
+    coalescer=coalescer,
+    response_cache=response_cache
+)
+
+@app.on_event("startup")
+async def start_dispatcher():
+    await health_checker.start()
+    await dispatcher.start()
+    # The autoscaler thread reads the async queue through the app's event loop
+    autoscaler.start_monitoring(check_interval=10, loop=asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def stop_dispatcher():
+    autoscaler.stop_monitoring()
+    await dispatcher.stop()
+    await health_checker.stop()
+    if replica_metrics:
+        replica_metrics.close()
+    await request_queue.close()
+    await result_store.close()
+    await coalescer.close()
+    await response_cache.close()
 
 class QueryRequest(BaseModel):
     prompt: str
@@ -91,12 +176,60 @@ class QueryRequest(BaseModel):
     top_p: float = 0.95
     top_k: int = 50
     num_return_sequences: int = 1
+    session_id: Optional[str] = None  # Routes a conversation's turns to the same replica under prefix_affinity
+    priority: str = DEFAULT_PRIORITY  # One of PRIORITY_CLASSES
+    tenant: Optional[str] = None
+    timeout: Optional[float] = None  # Seconds from submission until the request is abandoned
+
+# Deadline for requests that don't set a timeout, covering queueing, retries and generation
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", "300"))
 
 @app.post("/query")
-async def query(request: QueryRequest, background_tasks: BackgroundTasks):
+async def query(request: QueryRequest,
+                background_tasks: BackgroundTasks,
+                x_tenant_id: Optional[str] = Header(None),
+                x_api_key: Optional[str] = Header(None)):
     """Endpoint to handle model queries"""
-    # Enqueue the request
-    request_id = request_queue.enqueue_request(request.dict())
+    # Requests are shared fairly per tenant; fall back to a digest of the caller's API key
+    tenant = request.tenant or x_tenant_id
+    if not tenant and x_api_key:
+        tenant = "key-" + hashlib.sha256(x_api_key.encode()).hexdigest()[:16]
+    tenant = tenant or DEFAULT_TENANT
+    # Record the request before enqueueing so a fast worker can't overwrite a later status
+    request_id = str(uuid.uuid4())
+    request_data = request.dict(exclude={"priority", "tenant", "timeout"})
+    timeout = request.timeout or DEFAULT_REQUEST_TIMEOUT
+    cache_key = response_cache.key_for(request_data)
+    cached = await response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        # Stored too, so /status works the same for cached answers
+        await result_store.put(request_id, "completed", cached)
+        return {
+            "status": "completed",
+            "request_id": request_id,
+            "result": cached,
+            "cached": True
+        }
+    await result_store.set_status(request_id, "queued")
+    # An identical request already in flight will deliver its result to this one too
+    key = coalescer.key_for(request_data)
+    if key and await coalescer.join(key, request_id, ttl=timeout + 60):
+        return {
+            "status": "queued",
+            "request_id": request_id,
+            "message": "An identical request is already being processed; its result will be shared."
+        }
+    metrics.record_arrival(request.max_length * request.num_return_sequences)
+    await request_queue.enqueue_request(
+        request_data,
+        request_id=request_id,
+        priority=request.priority,
+        tenant=tenant,
+        deadline=time.time() + timeout
+    )
+    if not deployment_manager.registry.snapshot():
+        # Scaled to zero: the request waits in the queue while a replica is activated
+        autoscaler.wake()
     
     # Return immediately with a request ID
     return {
@@ -105,26 +238,50 @@ async def query(request: QueryRequest, background_tasks: BackgroundTasks):
         "message": "Your request has been queued and will be processed shortly."
     }
 
+MAX_STATUS_WAIT = 60.0
+
 @app.get("/status/{request_id}")
-async def get_status(request_id: str):
-    """Endpoint to check the status of a request"""
-    # In a real implementation, you'd store request status in Redis or another database
-    # For now, we'll just return a placeholder
-    return {
-        "status": "processing",
-        "request_id": request_id
-    }
+async def get_status(request_id: str, wait: float = 0.0):
+    """
+    Endpoint to check the status of a request. With wait > 0 this long-polls,
+    returning as soon as the result lands or after `wait` seconds.
+    """
+    wait = min(max(wait, 0.0), MAX_STATUS_WAIT)
+    if wait > 0:
+        entry = await result_store.wait(request_id, timeout=wait)
+    else:
+        entry = await result_store.get(request_id)
+    if entry is None:
+        return {
+            "status": "unknown",
+            "request_id": request_id
+        }
+    return entry
+
+@app.get("/status/{request_id}/stream")
+async def stream_status(request_id: str, timeout: float = MAX_STATUS_WAIT):
+    """Server-sent events stream of status changes, ending once the request completes or fails"""
+    async def events():
+        async for entry in result_store.watch(request_id, timeout=min(timeout, MAX_STATUS_WAIT)):
+            yield f"data: {json.dumps(entry)}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @app.get("/queue/stats")
 async def get_queue_stats():
     """Endpoint to get queue statistics"""
-    queue_length = request_queue.get_queue_length()
+    queue_length = await request_queue.get_queue_length()
     active_endpoints = deployment_manager.get_active_endpoints()
     
     return {
         "queue_length": queue_length,
         "active_replicas": len(active_endpoints),
-        "endpoints": active_endpoints
+        "endpoints": active_endpoints,
+        "health": health_checker.get_status(),
+        "cold_starts": deployment_manager.cold_start_stats(),
+        "placement": deployment_manager.inventory.usage(),
+        "dispatch": dict(dispatcher.stats(), coalesced=coalescer.coalesced),
+        "response_cache": await response_cache.stats()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,33 @@
+# request_key.py
+import json
+import hashlib
+from typing import Dict, Optional
+
+# Request fields that determine the generated output; routing hints like session_id are left out
+CONTENT_FIELDS = ("prompt", "max_length", "temperature", "top_p", "top_k", "num_return_sequences")
+
+# deterministic: only requests whose output does not depend on sampling; all: every request; off: none
+KEY_MODES = ("deterministic", "all", "off")
+
+def check_mode(mode: str):
+    if mode not in KEY_MODES:
+        raise ValueError(f"Unknown mode '{mode}'. Choose from {list(KEY_MODES)}")
+
+def is_deterministic(request_data: Dict) -> bool:
+    """
+    Whether the same request always produces the same output. Replicas always
+    sample (temperature must be > 0), so only top_k == 1 reduces to greedy decoding.
+    """
+    return request_data.get("top_k") == 1
+
+def content_key(request_data: Dict, mode: str = "deterministic", namespace: str = "") -> Optional[str]:
+    """
+    Digest of the fields that determine a request's output, or None if `mode`
+    says requests like this one must not share results.
+    """
+    if mode == "off" or (mode == "deterministic" and not is_deterministic(request_data)):
+        return None
+    # Fields are taken verbatim: even whitespace in the prompt changes the tokens the model sees
+    content = {field: request_data.get(field) for field in CONTENT_FIELDS}
+    content["namespace"] = namespace
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
@@ -1,31 +1,362 @@
-import redis
 import json
 import time
 import uuid
+import asyncio
+from abc import ABC, abstractmethod
+from collections import deque
+from scheduler import FairScheduler, DEFAULT_TENANT
 
-class RequestQueue:
-    def __init__(self, redis_host='localhost', redis_port=6379, queue_name='model_requests'):
-        self.redis_client = redis.Redis(host=redis_host, port=redis_port)
-        self.queue_name = queue_name
-        
-    def enqueue_request(self, request_data):
-        """Add a request to the queue"""
-        request_id = str(uuid.uuid4())
-        request_item = {
-            'id': request_id,
+# Lease one request from each listed sub-queue (KEYS[4..], repeats allowed) in order under
+# the lease ids ARGV[2..]: the item goes into the in-flight hash (lease id -> item) and its
+# deadline ARGV[1] into the lease set. Sub-queues that became empty are dropped from the index.
+DEQUEUE_SCRIPT = """
+local leased = {}
+for i = 4, #KEYS do
+    local item = redis.call('RPOP', KEYS[i])
+    if item then
+        local lease = ARGV[i - 2]
+        redis.call('HSET', KEYS[1], lease, item)
+        redis.call('ZADD', KEYS[2], ARGV[1], lease)
+        leased[#leased + 1] = lease
+        leased[#leased + 1] = item
+    end
+    if redis.call('LLEN', KEYS[i]) == 0 then
+        redis.call('SREM', KEYS[3], KEYS[i])
+    end
+end
+return leased
+"""
+
+# End lease ARGV[1] if it is still held. A worker whose lease expired and was handed to
+# someone else holds a stale id, so it cannot drop the new holder's entry.
+ACK_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+# End lease ARGV[1] if it is still held and push the updated item ARGV[2] back to the
+# head of its sub-queue KEYS[3]; an expired lease was already requeued by the reaper
+REQUEUE_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('RPUSH', KEYS[3], ARGV[2])
+redis.call('SADD', KEYS[4], KEYS[3])
+redis.call('LPUSH', KEYS[5], 1)
+redis.call('LTRIM', KEYS[5], 0, 63)
+return 1
+"""
+
+# End every lease past its deadline and return its item to the head of its sub-queue
+REQUEUE_EXPIRED_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local requeued = 0
+for _, lease in ipairs(expired) do
+    local item = redis.call('HGET', KEYS[1], lease)
+    redis.call('HDEL', KEYS[1], lease)
+    redis.call('ZREM', KEYS[2], lease)
+    if item then
+        local request = cjson.decode(item)
+        local subqueue = ARGV[2] .. request['priority'] .. ':' .. request['tenant']
+        redis.call('RPUSH', subqueue, item)
+        redis.call('SADD', KEYS[3], subqueue)
+        requeued = requeued + 1
+    end
+end
+return requeued
+"""
+
+class RequestQueue(ABC):
+    """
+    Reliable, fair work queue interface shared by the gateway's queue backends.
+
+    Requests are kept in one sub-queue per (priority class, tenant) and a
+    FairScheduler decides which sub-queue each dequeue serves. Dequeued
+    requests are leased rather than removed: they must be acked when done, or
+    they become visible again after visibility_timeout seconds via
+    requeue_expired(). Every lease has its own id, carried in the item as
+    'lease'; ack and requeue only act while that lease is still held, so a
+    worker whose lease expired cannot touch the request's next lease. All
+    methods are coroutines on the gateway's event loop.
+    """
+    def __init__(self, visibility_timeout: float = 120.0, scheduler: FairScheduler = None):
+        self.visibility_timeout = visibility_timeout
+        self.scheduler = scheduler or FairScheduler()
+
+    def _new_item(self, request_data, request_id=None, priority=None, tenant=None, deadline=None):
+        return {
+            'id': request_id or str(uuid.uuid4()),
             'data': request_data,
-            'timestamp': time.time()
+            'timestamp': time.time(),
+            'priority': self.scheduler.normalize_priority(priority),
+            'tenant': tenant or DEFAULT_TENANT,
+            'deadline': deadline,  # Epoch seconds after which the request is abandoned, or None
+            'attempts': 0  # Sends to a replica so far; kept across requeues
         }
-        self.redis_client.lpush(self.queue_name, json.dumps(request_item))
-        return request_id
-        
-    def dequeue_request(self):
-        """Remove and return a request from the queue"""
-        request = self.redis_client.rpop(self.queue_name)
-        if request:
-            return json.loads(request)
-        return None
-        
-    def get_queue_length(self):
+
+    @abstractmethod
+    async def enqueue_request(self, request_data, request_id=None, priority=None, tenant=None, deadline=None):
+        """Add a request to its (priority, tenant) sub-queue and return its id"""
+
+    @abstractmethod
+    async def dequeue_batch(self, max_items=1, timeout=0):
+        """
+        Lease up to max_items requests in scheduling order. If the queue is empty,
+        block for up to `timeout` seconds waiting for the first one.
+        """
+
+    async def dequeue_request(self, timeout=0):
+        """Lease and return a request from the queue, blocking up to `timeout` seconds"""
+        requests = await self.dequeue_batch(max_items=1, timeout=timeout)
+        return requests[0] if requests else None
+
+    @staticmethod
+    def _unleased(request_item):
+        """The item as stored in a sub-queue, without the lease it was dequeued under"""
+        return {key: value for key, value in request_item.items() if key != 'lease'}
+
+    @abstractmethod
+    async def ack_request(self, request_item):
+        """Mark a leased request as done so it is never redelivered. False if its lease had expired."""
+
+    @abstractmethod
+    async def requeue_request(self, request_item):
+        """
+        Put a dequeued request back at the head of its sub-queue, keeping its id and
+        attempt count. False (and nothing is queued) if its lease had expired.
+        """
+
+    @abstractmethod
+    async def requeue_expired(self):
+        """Return requests whose lease expired (e.g. their worker crashed) to the queue"""
+
+    @abstractmethod
+    async def get_queue_length(self):
         """Get the current length of the queue"""
-        return self.redis_client.llen(self.queue_name)
\ No newline at end of file
+
+    @abstractmethod
+    async def get_in_flight_count(self):
+        """Get the number of leased, unacknowledged requests"""
+
+    async def close(self):
+        pass
+
+
+class RedisRequestQueue(RequestQueue):
+    """
+    Redis backend, shared by every gateway process.
+
+    Each (priority, tenant) sub-queue is a list, indexed by a set. A dequeue
+    reads a window of every sub-queue's head, lets the scheduler plan the
+    batch locally, and leases the planned requests atomically in one Lua call.
+    Leased requests sit in an in-flight hash keyed by lease id, with the lease
+    deadlines in a sorted set.
+    An empty queue blocks on a wake-up list that every enqueue pushes to.
+    """
+    def __init__(self, redis_host='localhost', redis_port=6379, queue_name='model_requests',
+                 visibility_timeout: float = 120.0, scheduler: FairScheduler = None):
+        import redis.asyncio as redis
+        super().__init__(visibility_timeout, scheduler)
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port)
+        self.queue_name = queue_name
+        self.subqueue_prefix = f"{queue_name}:q:"
+        self.subqueues_name = f"{queue_name}:subqueues"
+        self.signal_name = f"{queue_name}:signal"
+        self.processing_name = f"{queue_name}:in_flight"  # lease id -> item
+        self.leases_name = f"{queue_name}:lease_deadlines"  # lease id -> deadline
+        self._dequeue = self.redis_client.register_script(DEQUEUE_SCRIPT)
+        self._ack = self.redis_client.register_script(ACK_SCRIPT)
+        self._requeue = self.redis_client.register_script(REQUEUE_SCRIPT)
+        self._requeue_expired = self.redis_client.register_script(REQUEUE_EXPIRED_SCRIPT)
+
+    def _subqueue(self, request_item):
+        return f"{self.subqueue_prefix}{request_item['priority']}:{request_item['tenant']}"
+
+    async def enqueue_request(self, request_data, request_id=None, priority=None, tenant=None, deadline=None):
+        request_item = self._new_item(request_data, request_id, priority, tenant, deadline)
+        subqueue = self._subqueue(request_item)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.lpush(subqueue, json.dumps(request_item))
+            pipe.sadd(self.subqueues_name, subqueue)
+            # Wake a blocked dequeue; the list is only a doorbell, so keep it short
+            pipe.lpush(self.signal_name, 1)
+            pipe.ltrim(self.signal_name, 0, 63)
+            await pipe.execute()
+        return request_item['id']
+
+    def _track(self, leased):
+        # The script returns lease id, item pairs flattened
+        requests = []
+        for lease, raw in zip(leased[::2], leased[1::2]):
+            request = json.loads(raw)
+            request['lease'] = lease.decode()
+            requests.append(request)
+        return requests
+
+    async def _peek_windows(self, size):
+        subqueues = [key.decode() for key in await self.redis_client.smembers(self.subqueues_name)]
+        if not subqueues:
+            return {}
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for subqueue in subqueues:
+                pipe.lrange(subqueue, -size, -1)
+            tails = await pipe.execute()
+        windows = {}
+        for subqueue, tail in zip(subqueues, tails):
+            if tail:
+                priority, tenant = subqueue[len(self.subqueue_prefix):].split(":", 1)
+                # LRANGE returns the tail end first; the head of the queue is the right end
+                windows[(priority, tenant)] = [json.loads(raw) for raw in reversed(tail)]
+        return windows
+
+    async def _lease(self, max_items):
+        picks = self.scheduler.plan(await self._peek_windows(max_items), max_items)
+        if not picks:
+            return []
+        return await self._dequeue(
+            keys=[self.processing_name, self.leases_name, self.subqueues_name]
+                 + [f"{self.subqueue_prefix}{priority}:{tenant}" for priority, tenant in picks],
+            args=[time.time() + self.visibility_timeout] + [uuid.uuid4().hex for _ in picks]
+        )
+
+    async def dequeue_batch(self, max_items=1, timeout=0):
+        raw_items = await self._lease(max_items)
+        if not raw_items and timeout:
+            if await self.redis_client.brpop(self.signal_name, timeout) is None:
+                return []
+            raw_items = await self._lease(max_items)
+        return self._track(raw_items)
+
+    async def ack_request(self, request_item):
+        if not request_item.get('lease'):
+            return False
+        return bool(await self._ack(keys=[self.processing_name, self.leases_name], args=[request_item['lease']]))
+
+    async def requeue_request(self, request_item):
+        if not request_item.get('lease'):
+            return False
+        return bool(await self._requeue(
+            keys=[self.processing_name, self.leases_name, self._subqueue(request_item),
+                  self.subqueues_name, self.signal_name],
+            # Re-serialize: the worker may have updated the item (e.g. its attempt count)
+            args=[request_item['lease'], json.dumps(self._unleased(request_item))]
+        ))
+
+    async def requeue_expired(self):
+        return await self._requeue_expired(
+            keys=[self.processing_name, self.leases_name, self.subqueues_name],
+            args=[time.time(), self.subqueue_prefix]
+        )
+
+    async def get_queue_length(self):
+        subqueues = await self.redis_client.smembers(self.subqueues_name)
+        if not subqueues:
+            return 0
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for subqueue in subqueues:
+                pipe.llen(subqueue)
+            return sum(await pipe.execute())
+
+    async def get_in_flight_count(self):
+        return await self.redis_client.hlen(self.processing_name)
+
+    async def close(self):
+        await self.redis_client.aclose()
+
+
+class InProcessRequestQueue(RequestQueue):
+    """
+    In-process asyncio backend for single-node gateways, load tests and CI.
+    No network hop: enqueue and dequeue are plain deque operations.
+    """
+    def __init__(self, visibility_timeout: float = 120.0, scheduler: FairScheduler = None):
+        super().__init__(visibility_timeout, scheduler)
+        self.subqueues = {}  # (priority, tenant) -> deque; the head is the right end
+        self.pending_count = 0
+        self.in_flight = {}  # request id -> (request item, lease deadline, lease id)
+        self.not_empty = asyncio.Condition()
+
+    def _push(self, request_item, at_head=False):
+        key = (request_item['priority'], request_item['tenant'])
+        subqueue = self.subqueues.setdefault(key, deque())
+        if at_head:
+            subqueue.append(request_item)
+        else:
+            subqueue.appendleft(request_item)
+        self.pending_count += 1
+
+    async def enqueue_request(self, request_data, request_id=None, priority=None, tenant=None, deadline=None):
+        request_item = self._new_item(request_data, request_id, priority, tenant, deadline)
+        async with self.not_empty:
+            self._push(request_item)
+            self.not_empty.notify()
+        return request_item['id']
+
+    async def dequeue_batch(self, max_items=1, timeout=0):
+        async with self.not_empty:
+            if not self.pending_count and timeout:
+                try:
+                    await asyncio.wait_for(self.not_empty.wait_for(lambda: self.pending_count), timeout)
+                except asyncio.TimeoutError:
+                    return []
+            deadline = time.time() + self.visibility_timeout
+            requests = []
+            while self.pending_count and len(requests) < max_items:
+                key = self.scheduler.pick({key: subqueue[-1] for key, subqueue in self.subqueues.items()})
+                request_item = self.subqueues[key].pop()
+                if not self.subqueues[key]:
+                    del self.subqueues[key]
+                self.pending_count -= 1
+                request_item['lease'] = uuid.uuid4().hex
+                self.in_flight[request_item['id']] = (request_item, deadline, request_item['lease'])
+                requests.append(request_item)
+            return requests
+
+    def _end_lease(self, request_item) -> bool:
+        entry = self.in_flight.get(request_item['id'])
+        if entry is None or entry[2] != request_item.get('lease'):
+            # Expired and requeued (maybe leased again since): not ours any more
+            return False
+        del self.in_flight[request_item['id']]
+        return True
+
+    async def ack_request(self, request_item):
+        return self._end_lease(request_item)
+
+    async def requeue_request(self, request_item):
+        if not self._end_lease(request_item):
+            return False
+        async with self.not_empty:
+            # A copy, so the worker's dict keeps its old lease id and stays stale
+            self._push(self._unleased(request_item), at_head=True)
+            self.not_empty.notify()
+        return True
+
+    async def requeue_expired(self):
+        now = time.time()
+        expired = [item for item, deadline, _ in self.in_flight.values() if deadline <= now]
+        for request_item in expired:
+            await self.requeue_request(request_item)
+        return len(expired)
+
+    async def get_queue_length(self):
+        return self.pending_count
+
+    async def get_in_flight_count(self):
+        return len(self.in_flight)
+
+
+QUEUE_BACKENDS = {
+    "redis": RedisRequestQueue,
+    "memory": InProcessRequestQueue,
+}
+
+def create_request_queue(backend: str = "redis", **kwargs) -> RequestQueue:
+    """Build a request queue for the named backend ('redis' or 'memory')"""
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown queue backend '{backend}'. Choose from {list(QUEUE_BACKENDS)}")
+    return QUEUE_BACKENDS[backend](**kwargs)
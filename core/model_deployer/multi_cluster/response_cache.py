@@ -0,0 +1,171 @@
+# response_cache.py
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+from request_key import check_mode, content_key
+
+# Store a response and evict the least recently used entries beyond ARGV[4].
+# KEYS[1] is the entry, KEYS[2] the recency index (entry key -> last use).
+PUT_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+-- Entries unused for a full TTL have expired on their own
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3] - ARGV[2])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    for _, victim in ipairs(redis.call('ZRANGE', KEYS[2], 0, excess - 1)) do
+        redis.call('DEL', victim)
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return excess
+"""
+
+class ResponseCache(ABC):
+    """
+    Gateway-wide cache of completed responses, checked before a request is
+    queued so repeats are answered without a replica.
+
+    Keys cover the model and every field that determines the output. With
+    mode "deterministic" only greedy requests are cached; "all" also replays
+    one sampled answer to identical sampled requests; "off" disables caching.
+    Entries expire after ttl seconds, which also bounds how long answers from
+    a replaced model can be served.
+    """
+    def __init__(self, model_id: str, ttl: float = 3600, mode: str = "deterministic"):
+        check_mode(mode)
+        self.model_id = model_id
+        self.ttl = ttl
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0  # Lookups that failed in the backend
+
+    def key_for(self, request_data: Dict) -> Optional[str]:
+        """Cache key of a request, or None if its response must not be cached"""
+        return content_key(request_data, self.mode, namespace=self.model_id)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return the cached response for `key`, counting the hit or miss. Backend errors count as misses."""
+        try:
+            result = await self._get(key)
+        except Exception as e:
+            # A cache outage must not fail requests that can still be served by a replica
+            print(f"Error reading response cache: {type(e).__name__}: {str(e)}")
+            self.errors += 1
+            result = None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    async def put(self, key: str, result: Dict):
+        """Cache a completed response"""
+
+    @abstractmethod
+    async def size(self) -> int:
+        """Number of cached responses"""
+
+    async def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        try:
+            entries = await self.size()
+        except Exception as e:
+            print(f"Error reading response cache size: {type(e).__name__}: {str(e)}")
+            entries = None
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": entries
+        }
+
+    async def close(self):
+        pass
+
+
+class InMemoryResponseCache(ResponseCache):
+    """Process-local LRU cache bounded by the serialized size of its responses"""
+    def __init__(self, model_id: str, ttl: float = 3600, mode: str = "deterministic",
+                 max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(model_id, ttl, mode)
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()  # key -> (result, size, expires_at); oldest use first
+        self.total_bytes = 0
+
+    def _evict(self, key: str):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    async def _get(self, key: str) -> Optional[Dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.time():
+            self._evict(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    async def put(self, key: str, result: Dict):
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._evict(key)
+        self.entries[key] = (result, size, time.time() + self.ttl)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._evict(next(iter(self.entries)))
+
+    async def size(self) -> int:
+        return len(self.entries)
+
+
+class RedisResponseCache(ResponseCache):
+    """
+    Cache shared by every gateway process. Responses are plain keys with a
+    TTL; a sorted set of last-use times evicts the least recently used
+    entries beyond max_entries, so the cache cannot crowd out the queue.
+    """
+    def __init__(self, model_id: str, redis_host='localhost', redis_port=6379, ttl: float = 3600,
+                 mode: str = "deterministic", max_entries: int = 100000, prefix: str = 'response'):
+        import redis.asyncio as redis
+        super().__init__(model_id, ttl, mode)
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port)
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index_name = f"{prefix}:lru"
+        self._put = self.redis_client.register_script(PUT_SCRIPT)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def _get(self, key: str) -> Optional[Dict]:
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(self._key(key))
+            # XX: only refresh recency of entries that are still indexed
+            pipe.zadd(self.index_name, {self._key(key): time.time()}, xx=True)
+            payload, _ = await pipe.execute()
+        return json.loads(payload) if payload else None
+
+    async def put(self, key: str, result: Dict):
+        await self._put(
+            keys=[self._key(key), self.index_name],
+            args=[json.dumps(result), int(self.ttl), time.time(), self.max_entries]
+        )
+
+    async def size(self) -> int:
+        return await self.redis_client.zcard(self.index_name)
+
+    async def close(self):
+        await self.redis_client.aclose()
@@ -0,0 +1,147 @@
+# result_store.py
+import json
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Optional
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+class ResultStore(ABC):
+    """
+    Status and results of queued requests, keyed by request id.
+
+    Entries look like {"request_id", "status", "result", "updated_at"} where
+    status moves through queued -> processing -> completed/failed.
+    """
+
+    @abstractmethod
+    async def put(self, request_id: str, status: str, result: Optional[Dict] = None):
+        """Record a status change (and the result, for terminal statuses)"""
+
+    @abstractmethod
+    async def get(self, request_id: str) -> Optional[Dict]:
+        """Return the current entry, or None if unknown or expired"""
+
+    @abstractmethod
+    def watch(self, request_id: str, timeout: float) -> AsyncIterator[Dict]:
+        """Yield the entry now and on every change until it is terminal or timeout elapses"""
+
+    async def set_status(self, request_id: str, status: str):
+        await self.put(request_id, status)
+
+    async def wait(self, request_id: str, timeout: float) -> Optional[Dict]:
+        """Long poll: return as soon as the request is terminal, else the latest entry at timeout"""
+        entry = None
+        async for entry in self.watch(request_id, timeout):
+            pass
+        return entry if entry is not None else await self.get(request_id)
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _entry(request_id: str, status: str, result: Optional[Dict]) -> Dict:
+        return {
+            "request_id": request_id,
+            "status": status,
+            "result": result,
+            "updated_at": time.time()
+        }
+
+
+class InMemoryResultStore(ResultStore):
+    """Process-local store for tests and single-node gateways"""
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.entries: Dict[str, Dict] = {}
+        self.changed = asyncio.Condition()
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        for request_id in [k for k, v in self.entries.items() if v["updated_at"] < cutoff]:
+            del self.entries[request_id]
+
+    async def put(self, request_id: str, status: str, result: Optional[Dict] = None):
+        async with self.changed:
+            self._evict_expired()
+            self.entries[request_id] = self._entry(request_id, status, result)
+            self.changed.notify_all()
+
+    async def get(self, request_id: str) -> Optional[Dict]:
+        entry = self.entries.get(request_id)
+        if entry and entry["updated_at"] < time.time() - self.ttl:
+            return None
+        return entry
+
+    async def watch(self, request_id: str, timeout: float) -> AsyncIterator[Dict]:
+        deadline = time.monotonic() + timeout
+        last = await self.get(request_id)
+        if last:
+            yield last
+        while not (last and last["status"] in TERMINAL_STATUSES):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            async with self.changed:
+                try:
+                    await asyncio.wait_for(
+                        self.changed.wait_for(lambda: self.entries.get(request_id) is not last),
+                        remaining
+                    )
+                except asyncio.TimeoutError:
+                    return
+                last = self.entries.get(request_id)
+            if last:
+                yield last
+
+
+class RedisResultStore(ResultStore):
+    """
+    Redis-backed store shared by every gateway process. Entries expire after
+    ttl seconds; every update is also published on a per-request channel so
+    long polls wake up immediately instead of polling.
+    """
+    def __init__(self, redis_host='localhost', redis_port=6379, ttl: int = 3600, prefix: str = 'result'):
+        import redis.asyncio as redis
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, request_id: str) -> str:
+        return f"{self.prefix}:{request_id}"
+
+    async def put(self, request_id: str, status: str, result: Optional[Dict] = None):
+        payload = json.dumps(self._entry(request_id, status, result))
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(request_id), payload, ex=self.ttl)
+            pipe.publish(self._key(request_id), payload)
+            await pipe.execute()
+
+    async def get(self, request_id: str) -> Optional[Dict]:
+        payload = await self.redis_client.get(self._key(request_id))
+        return json.loads(payload) if payload else None
+
+    async def watch(self, request_id: str, timeout: float) -> AsyncIterator[Dict]:
+        deadline = time.monotonic() + timeout
+        pubsub = self.redis_client.pubsub()
+        # Subscribe before reading so an update landing in between isn't missed
+        await pubsub.subscribe(self._key(request_id))
+        try:
+            last = await self.get(request_id)
+            if last:
+                yield last
+            while not (last and last["status"] in TERMINAL_STATUSES):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message and message["type"] == "message":
+                    last = json.loads(message["data"])
+                    yield last
+        finally:
+            await pubsub.unsubscribe(self._key(request_id))
+            await pubsub.aclose()
+
+    async def close(self):
+        await self.redis_client.aclose()
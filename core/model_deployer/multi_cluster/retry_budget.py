@@ -0,0 +1,47 @@
+# retry_budget.py
+import time
+import random
+from collections import deque
+
+def jittered_backoff(attempt: int, base: float = 0.1, cap: float = 5.0) -> float:
+    """
+    Delay before retry number `attempt` (0-based): uniform in [0, min(cap, base * 2^attempt)].
+    Full jitter keeps requests that failed together from retrying together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class RetryBudget:
+    """
+    Caps extra load (retries and hedges) at a fraction of recent traffic.
+
+    Over the last window_seconds, at most ratio * requests + min_per_second * window_seconds
+    extra sends are allowed. Per-request attempt limits alone let a fleet-wide outage
+    multiply its load by the attempt limit; the budget keeps it near 1 + ratio while
+    still allowing a trickle of retries when traffic is low.
+    """
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self.requests = deque()  # Timestamps of first attempts
+        self.withdrawals = deque()  # Timestamps of retries and hedges
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_seconds
+        for events in (self.requests, self.withdrawals):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def deposit(self):
+        """Count a request's first attempt"""
+        self.requests.append(time.monotonic())
+
+    def try_withdraw(self) -> bool:
+        """Take budget for one retry or hedge; False if the budget is spent"""
+        now = time.monotonic()
+        self._trim(now)
+        allowed = self.ratio * len(self.requests) + self.min_per_second * self.window_seconds
+        if len(self.withdrawals) + 1 > allowed:
+            return False
+        self.withdrawals.append(now)
+        return True
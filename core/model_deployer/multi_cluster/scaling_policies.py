@@ -0,0 +1,171 @@
+# scaling_policies.py
+import math
+from abc import ABC, abstractmethod
+from forecaster import HoltWinters
+
+class ScalingPolicy(ABC):
+    """Decides how many replicas the deployment should have"""
+
+    @abstractmethod
+    def desired_replicas(self, current_replicas: int, queue_length: int) -> int:
+        """Target replica count; the autoscaler clamps it to [min_replicas, max_replicas]"""
+
+
+class ThresholdPolicy(ScalingPolicy):
+    """
+    Reactive policy on queued requests per replica: scale up above
+    scale_up_threshold, scale down below scale_down_threshold.
+    """
+    def __init__(self, scale_up_threshold=5, scale_down_threshold=2):
+        self.scale_up_threshold = scale_up_threshold
+        self.scale_down_threshold = scale_down_threshold
+
+    def desired_replicas(self, current_replicas, queue_length):
+        requests_per_replica = queue_length / max(1, current_replicas)
+        if requests_per_replica > self.scale_up_threshold:
+            return current_replicas + max(1, int(queue_length / self.scale_up_threshold) - current_replicas)
+        if requests_per_replica < self.scale_down_threshold:
+            return min(current_replicas, int(queue_length / self.scale_down_threshold) + 1)
+        return current_replicas
+
+
+class PredictivePolicy(ScalingPolicy):
+    """
+    Sizes the deployment for the demand forecast one provisioning time ahead.
+
+    Arrival rate and requested-token rate are forecast with Holt-Winters over
+    the gateway's sliding window. Per-replica capacity is measured, not
+    assumed: completions (and generated tokens) per second a replica spent
+    with requests in flight, which reflects however many requests a replica
+    really serves at once. The target covers the peak forecast
+    plus draining the current backlog within drain_seconds, with headroom.
+    Until enough traffic has been observed it defers to `fallback`.
+    """
+    def __init__(self,
+                 metrics,
+                 provisioning_seconds: float = 300.0,
+                 drain_seconds: float = 60.0,
+                 headroom: float = 0.2,
+                 min_completions: int = 20,
+                 forecaster: HoltWinters = None,
+                 fallback: ScalingPolicy = None):
+        self.metrics = metrics
+        self.provisioning_seconds = provisioning_seconds
+        self.drain_seconds = drain_seconds
+        self.headroom = headroom
+        self.min_completions = min_completions
+        self.forecaster = forecaster or HoltWinters()
+        self.fallback = fallback or ThresholdPolicy()
+        self.last_forecast = {}
+
+    def _peak_forecast(self, series):
+        steps = max(1, math.ceil(self.provisioning_seconds / self.metrics.bucket_seconds))
+        return max(self.forecaster.forecast(series, steps))
+
+    def desired_replicas(self, current_replicas, queue_length):
+        totals = self.metrics.totals()
+        if totals["completions"] < self.min_completions or totals["busy_seconds"] <= 0:
+            return self.fallback.desired_replicas(current_replicas, queue_length)
+
+        # Measured capacity of one busy replica
+        replica_rps = totals["completions"] / totals["busy_seconds"]
+        replica_tps = totals["generated_tokens"] / totals["busy_seconds"]
+
+        # Forecast demand, plus the backlog to clear
+        rate = self._peak_forecast(self.metrics.arrival_rates()) + queue_length / self.drain_seconds
+        needed = rate / replica_rps
+
+        if replica_tps > 0 and totals["requested_tokens"] > 0:
+            # max_length is an upper bound; scale it by how much of it requests actually generate
+            fill_ratio = min(1.0, totals["generated_tokens"] / totals["requested_tokens"])
+            token_rate = self._peak_forecast(self.metrics.token_demand_rates()) * fill_ratio
+            backlog_tokens = queue_length * totals["generated_tokens"] / totals["completions"]
+            needed = max(needed, (token_rate + backlog_tokens / self.drain_seconds) / replica_tps)
+
+        self.last_forecast = {
+            "request_rate": rate,
+            "replica_rps": replica_rps,
+            "replica_tps": replica_tps,
+            "replicas_needed": needed
+        }
+        return math.ceil(needed * (1 + self.headroom))
+
+
+class SLOPolicy(ScalingPolicy):
+    """
+    Scales to hold latency SLOs using metrics scraped from the replicas.
+
+    Each signal is turned into a pressure ratio, observed / target (inverted
+    for decode speed, where lower is worse): fleet p95 time-to-first-token,
+    mean decode tokens/sec, mean KV-cache occupancy and mean CPU utilization.
+    The worst ratio drives the decision. Above 1 the fleet grows in
+    proportion to it. Scaling down needs every ratio below scale_down_ratio
+    for down_stable_checks consecutive evaluations, and removes one replica at
+    a time; the gap between 1 and scale_down_ratio is the hysteresis band.
+    """
+    def __init__(self,
+                 collector,
+                 ttft_p95_slo: float = 1.0,
+                 min_decode_tps: float = None,
+                 max_kv_occupancy: float = 0.85,
+                 max_cpu_utilization: float = 0.85,
+                 scale_down_ratio: float = 0.5,
+                 down_stable_checks: int = 3,
+                 fallback: ScalingPolicy = None):
+        self.collector = collector
+        self.ttft_p95_slo = ttft_p95_slo
+        self.min_decode_tps = min_decode_tps
+        self.max_kv_occupancy = max_kv_occupancy
+        self.max_cpu_utilization = max_cpu_utilization
+        self.scale_down_ratio = scale_down_ratio
+        self.down_stable_checks = down_stable_checks
+        self.fallback = fallback or ThresholdPolicy()
+        self.below_count = 0
+        self.last_pressure = {}
+
+    @staticmethod
+    def _mean(values, weights=None):
+        pairs = [(v, w) for v, w in zip(values, weights or [1] * len(values)) if v is not None and w]
+        total = sum(w for _, w in pairs)
+        return sum(v * w for v, w in pairs) / total if total else None
+
+    def pressure(self, replica_metrics) -> dict:
+        """observed / target for each signal the replicas reported"""
+        metrics = list(replica_metrics.values())
+        weights = [m.get("requests") or 0 for m in metrics]
+        ttft = self._mean([m.get("ttft_p95") for m in metrics], weights)
+        decode_tps = self._mean([m.get("decode_tps") for m in metrics], weights)
+        kv = self._mean([m.get("kv_occupancy") for m in metrics])
+        cpu = self._mean([m.get("cpu_utilization") for m in metrics])
+
+        pressure = {}
+        if ttft is not None and self.ttft_p95_slo:
+            pressure["ttft_p95"] = ttft / self.ttft_p95_slo
+        if decode_tps and self.min_decode_tps:
+            pressure["decode_tps"] = self.min_decode_tps / decode_tps
+        if kv is not None and self.max_kv_occupancy:
+            pressure["kv_occupancy"] = kv / self.max_kv_occupancy
+        if cpu is not None and self.max_cpu_utilization:
+            pressure["cpu_utilization"] = cpu / self.max_cpu_utilization
+        return pressure
+
+    def desired_replicas(self, current_replicas, queue_length):
+        pressure = self.pressure(self.collector.collect())
+        self.last_pressure = pressure
+        if not pressure:
+            # No replica reported yet, e.g. scaling up from zero
+            self.below_count = 0
+            return self.fallback.desired_replicas(current_replicas, queue_length)
+
+        worst = max(pressure.values())
+        if worst > 1.0:
+            self.below_count = 0
+            return max(current_replicas + 1, math.ceil(current_replicas * worst))
+        if worst < self.scale_down_ratio and queue_length == 0:
+            self.below_count += 1
+            if self.below_count >= self.down_stable_checks:
+                self.below_count = 0
+                return current_replicas - 1
+        else:
+            self.below_count = 0
+        return current_replicas
@@ -0,0 +1,131 @@
+# scheduler.py
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Highest priority first
+PRIORITY_CLASSES = ("interactive", "default", "batch")
+DEFAULT_PRIORITY = "default"
+DEFAULT_TENANT = "default"
+
+SubqueueKey = Tuple[str, str]  # (priority, tenant)
+
+class FairScheduler:
+    """
+    Decides which sub-queue a worker dequeues from next.
+
+    Requests are split into sub-queues by (priority class, tenant). Classes are
+    served in strict priority order, except that a class whose oldest request
+    has waited promote_after seconds is promoted one level: it is served ahead
+    of the class directly above it, so batch work is not starved by a steady
+    stream of default traffic. Promotion goes no further than that and never
+    past the top class, so interactive requests are always served first.
+    Within a class, tenants share service by deficit round-robin: each visit
+    credits a tenant quantum * weight, and a request is served once the tenant's
+    deficit covers its cost.
+    """
+    def __init__(self,
+                 priorities=PRIORITY_CLASSES,
+                 tenant_weights: Optional[Dict[str, float]] = None,
+                 quantum: float = 1.0,
+                 promote_after: float = 30.0,
+                 cost_fn: Optional[Callable[[Dict], float]] = None):
+        self.priorities = list(priorities)
+        self.tenant_weights = tenant_weights or {}
+        for tenant, weight in self.tenant_weights.items():
+            # A zero or negative weight never earns credit, so deficit round-robin would spin forever
+            if not weight > 0:
+                raise ValueError(f"Tenant weight for '{tenant}' must be > 0, got {weight}")
+        if not quantum > 0:
+            raise ValueError(f"quantum must be > 0, got {quantum}")
+        self.quantum = quantum
+        self.promote_after = promote_after
+        self.cost_fn = cost_fn or (lambda request_item: 1.0)
+
+        self.rings: Dict[str, List[str]] = {p: [] for p in self.priorities}  # Active tenants per class
+        self.positions: Dict[str, int] = {p: 0 for p in self.priorities}
+        self.deficits: Dict[SubqueueKey, float] = {}
+
+    def normalize_priority(self, priority: Optional[str]) -> str:
+        return priority if priority in self.priorities else DEFAULT_PRIORITY
+
+    def weight(self, tenant: str) -> float:
+        return self.tenant_weights.get(tenant, 1.0)
+
+    def _effective_level(self, priority: str, oldest_timestamp: float, now: float) -> Tuple[int, int]:
+        native = self.priorities.index(priority)
+        # Levels are spaced by 2 so a promoted class slots in between its neighbours above
+        level = 2 * native
+        aged = self.promote_after > 0 and now - oldest_timestamp >= self.promote_after
+        if aged and native >= 2:
+            # Ahead of the class directly above, behind the one above that; the top class is never passed
+            level -= 3
+        return level, native
+
+    def _sync_ring(self, priority: str, tenants: List[str]):
+        ring = self.rings[priority]
+        active = set(tenants)
+        for tenant in [t for t in ring if t not in active]:
+            index = ring.index(tenant)
+            ring.remove(tenant)
+            # An idle tenant forfeits its credit, as in standard DRR
+            self.deficits.pop((priority, tenant), None)
+            if index < self.positions[priority]:
+                self.positions[priority] -= 1
+        for tenant in tenants:
+            if tenant not in ring:
+                ring.append(tenant)
+        if ring:
+            self.positions[priority] %= len(ring)
+
+    def _drr_pick(self, priority: str, heads: Dict[str, Dict]) -> str:
+        self._sync_ring(priority, list(heads))
+        ring = self.rings[priority]
+        while True:
+            tenant = ring[self.positions[priority]]
+            key = (priority, tenant)
+            cost = self.cost_fn(heads[tenant])
+            if self.deficits.get(key, 0.0) >= cost:
+                self.deficits[key] -= cost
+                return tenant
+            self.positions[priority] = (self.positions[priority] + 1) % len(ring)
+            next_key = (priority, ring[self.positions[priority]])
+            self.deficits[next_key] = self.deficits.get(next_key, 0.0) + self.quantum * self.weight(next_key[1])
+
+    def pick(self, heads: Dict[SubqueueKey, Dict], now: Optional[float] = None) -> Optional[SubqueueKey]:
+        """
+        Choose the sub-queue to serve next.
+
+        Args:
+            heads: Head request of every non-empty sub-queue, keyed by (priority, tenant).
+        """
+        if not heads:
+            return None
+        now = now or time.time()
+
+        by_class: Dict[str, Dict[str, Dict]] = {}
+        for (priority, tenant), head in heads.items():
+            by_class.setdefault(priority, {})[tenant] = head
+        for priority in self.priorities:
+            if priority not in by_class:
+                self._sync_ring(priority, [])
+
+        priority = min(
+            by_class,
+            key=lambda p: self._effective_level(p, min(h['timestamp'] for h in by_class[p].values()), now)
+        )
+        return priority, self._drr_pick(priority, by_class[priority])
+
+    def plan(self, windows: Dict[SubqueueKey, List[Dict]], max_items: int) -> List[SubqueueKey]:
+        """
+        Pick up to max_items sub-queues in service order, given a head-first window
+        of pending requests per sub-queue. The windows are consumed.
+        """
+        picks = []
+        while len(picks) < max_items:
+            heads = {key: window[0] for key, window in windows.items() if window}
+            key = self.pick(heads)
+            if key is None:
+                break
+            windows[key].pop(0)
+            picks.append(key)
+        return picks
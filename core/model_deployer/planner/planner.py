@@ -0,0 +1,253 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from core.common.logger import Logger
+from core.model_deployer.deployer.hf_utils import extract_repo_id
+from core.model_deployer.profiler.benchmarks import measured_gflops
+
+logger = Logger(__name__, log_level="INFO", console_output=True)
+
+GiB = 1024 ** 3
+
+PRECISION_BYTES = {"fp32": 4, "bf16": 2, "fp16": 2, "int8": 1}
+
+# Precision -> (torch dtype the server loads with, quantization applied after load)
+PRECISION_SERVER_DTYPE = {
+    "fp32": ("float32", None),
+    "bf16": ("bfloat16", None),
+    "fp16": ("float16", None),
+    "int8": ("float32", "int8"),
+}
+
+
+@dataclass
+class ModelSpec:
+    """Architecture numbers needed for memory planning, read from a HF config.json."""
+    num_layers: int
+    hidden_size: int
+    num_heads: int
+    num_kv_heads: int
+    intermediate_size: int
+    vocab_size: int
+    max_position_embeddings: int
+    tie_word_embeddings: bool = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ModelSpec":
+        hidden_size = config["hidden_size"]
+        num_heads = config["num_attention_heads"]
+        return cls(
+            num_layers=config["num_hidden_layers"],
+            hidden_size=hidden_size,
+            num_heads=num_heads,
+            num_kv_heads=config.get("num_key_value_heads") or num_heads,
+            intermediate_size=config.get("intermediate_size") or 4 * hidden_size,
+            vocab_size=config["vocab_size"],
+            max_position_embeddings=config.get("max_position_embeddings", 2048),
+            tie_word_embeddings=config.get("tie_word_embeddings", False),
+        )
+
+    @property
+    def head_dim(self) -> int:
+        return self.hidden_size // self.num_heads
+
+    @property
+    def num_parameters(self) -> int:
+        kv_dim = self.num_kv_heads * self.head_dim
+        attention = 2 * self.hidden_size * self.hidden_size + 2 * self.hidden_size * kv_dim
+        mlp = 3 * self.hidden_size * self.intermediate_size
+        embeddings = self.vocab_size * self.hidden_size
+        lm_head = 0 if self.tie_word_embeddings else embeddings
+        return self.num_layers * (attention + mlp) + embeddings + lm_head
+
+    @property
+    def embedding_parameters(self) -> int:
+        return self.vocab_size * self.hidden_size
+
+    def weight_bytes(self, precision: str) -> int:
+        if precision == "int8":
+            # Dynamic quantization only converts nn.Linear; the input embeddings stay fp32
+            linear = self.num_parameters - self.embedding_parameters
+            return int(linear * PRECISION_BYTES["int8"] + self.embedding_parameters * PRECISION_BYTES["fp32"])
+        return int(self.num_parameters * PRECISION_BYTES[precision])
+
+    def load_peak_bytes(self, precision: str) -> int:
+        """Peak weight memory while loading: int8 is loaded in fp32 and quantized afterwards."""
+        return self.weight_bytes("fp32" if precision == "int8" else precision)
+
+    def kv_bytes_per_token(self, precision: str) -> int:
+        # One K and one V vector per layer per KV head.
+        return 2 * self.num_layers * self.num_kv_heads * self.head_dim * PRECISION_BYTES[precision]
+
+
+@dataclass
+class ServerConfig:
+    """Recommended inference server settings for one model on one host."""
+    precision: str
+    dtype: str
+    quantization: Optional[str]
+    max_batch_size: int
+    max_model_len: int
+    weight_bytes: int
+    kv_bytes_per_token: int
+
+    def to_env(self) -> dict[str, str]:
+        return {
+            "DTYPE": self.dtype,
+            "QUANTIZATION": self.quantization or "",
+            "MAX_BATCH_SIZE": str(self.max_batch_size),
+            "MAX_MODEL_LEN": str(self.max_model_len),
+        }
+
+
+def host_memory_bytes(profile: dict) -> tuple[int, str]:
+    """Memory available for weights + KV cache and the device it lives on."""
+    gpu_memory = [line for line in str(profile.get("gpu_memory_total") or "").splitlines() if line.strip().isdigit()]
+    if int(profile.get("gpu_count") or 0) > 0 and gpu_memory:
+        # nvidia-smi reports MiB per GPU; device_map="auto" shards across all of them.
+        return sum(int(mib) for mib in gpu_memory) * 1024 ** 2, "cuda"
+    memory_total = float(profile.get("memory_total") or 0)
+    # `free -g` reports GiB on linux; macOS sysctl reports bytes.
+    return int(memory_total if profile.get("os") == "mac_os" else memory_total * GiB), "cpu"
+
+
+class CapacityPlanner:
+    """
+    Picks precision, batch size and context length for a model on a host.
+
+    Candidate precisions are those whose load-time peak, and whose weights plus
+    a minimum context of KV cache, fit in usable memory. GPUs always serve half
+    precision. On CPU, with benchmark data the fastest candidate wins, but a
+    lower precision only replaces a higher one if it is measurably faster
+    (min_speedup); without data the highest fitting precision is used.
+    """
+
+    def __init__(
+        self,
+        model: ModelSpec,
+        profile: dict,
+        memory_utilization: float = 0.9,
+        runtime_overhead_bytes: int = GiB,
+        min_context: int = 512,
+        target_context: int = 4096,
+        max_batch_cap: int = 64,
+        min_speedup: float = 1.2,
+        memory_limit_bytes: Optional[int] = None,
+        gpu_memory_limit_bytes: Optional[int] = None,
+    ):
+        self.model = model
+        self.profile = profile
+        self.memory_utilization = memory_utilization
+        self.runtime_overhead_bytes = runtime_overhead_bytes
+        self.min_context = min_context
+        self.target_context = target_context
+        self.max_batch_cap = max_batch_cap
+        self.min_speedup = min_speedup
+        total_bytes, self.device = host_memory_bytes(profile)
+        usable_bytes = int(total_bytes * memory_utilization)
+        # A replica sharing the host may only use the share placement reserved for it
+        limit = gpu_memory_limit_bytes if self.device == "cuda" else memory_limit_bytes
+        if limit:
+            usable_bytes = min(usable_bytes, limit)
+        self.usable_bytes = usable_bytes - runtime_overhead_bytes
+
+    def _kv_precision(self, precision: str) -> str:
+        # Dynamically quantized CPU models keep fp32 activations, hence an fp32 KV cache.
+        if precision == "int8":
+            return "fp32" if self.device == "cpu" else "bf16"
+        return precision
+
+    def _fits(self, precision: str) -> bool:
+        kv = self.model.kv_bytes_per_token(self._kv_precision(precision)) * self.min_context
+        steady = self.model.weight_bytes(precision) + kv
+        return max(self.model.load_peak_bytes(precision), steady) <= self.usable_bytes
+
+    def _precisions(self) -> list[str]:
+        if self.device == "cuda":
+            # Half precision on GPU: bf16 where the benchmark shows the GPU runs it,
+            # else fp16, which every CUDA GPU supports (and the server's default)
+            return ["bf16" if measured_gflops(self.profile, "bf16") is not None else "fp16"]
+        # Highest quality first. int8 is only served through CPU dynamic quantization.
+        return ["fp32", "bf16", "int8"]
+
+    def _candidates(self) -> list[str]:
+        return [p for p in self._precisions() if self._fits(p)]
+
+    def choose_precision(self) -> str:
+        candidates = self._candidates()
+        if not candidates:
+            needed = min(
+                max(self.model.load_peak_bytes(p), self.model.weight_bytes(p)) for p in self._precisions()
+            )
+            raise ValueError(
+                f"Model needs at least {needed / GiB:.1f} GiB to load "
+                f"but the host only has {self.usable_bytes / GiB:.1f} GiB usable."
+            )
+
+        choice = candidates[0]
+        choice_gflops = measured_gflops(self.profile, choice)
+        for precision in candidates[1:]:
+            gflops = measured_gflops(self.profile, precision)
+            if gflops is None:
+                continue
+            if choice_gflops is None or gflops >= choice_gflops * self.min_speedup:
+                choice, choice_gflops = precision, gflops
+        return choice
+
+    def plan(self) -> ServerConfig:
+        precision = self.choose_precision()
+        weight_bytes = self.model.weight_bytes(precision)
+        kv_per_token = self.model.kv_bytes_per_token(self._kv_precision(precision))
+        kv_tokens = (self.usable_bytes - weight_bytes) // kv_per_token
+
+        max_model_len = int(min(self.model.max_position_embeddings, self.target_context, kv_tokens))
+        max_batch_size = int(max(1, min(self.max_batch_cap, kv_tokens // max_model_len)))
+        dtype, quantization = PRECISION_SERVER_DTYPE[precision]
+
+        config = ServerConfig(
+            precision=precision,
+            dtype=dtype,
+            quantization=quantization,
+            max_batch_size=max_batch_size,
+            max_model_len=max_model_len,
+            weight_bytes=weight_bytes,
+            kv_bytes_per_token=kv_per_token,
+        )
+        logger.info(
+            f"Planned {precision} on {self.device}: weights {weight_bytes / GiB:.2f} GiB, "
+            f"KV {kv_per_token} B/token, max_model_len={max_model_len}, max_batch_size={max_batch_size}"
+        )
+        return config
+
+
+def load_model_spec(model_path: Path | str, is_hf: bool = False, hf_token: str | None = None) -> Optional[ModelSpec]:
+    """Read config.json from a local model directory or the Hugging Face Hub."""
+    try:
+        if is_hf:
+            from huggingface_hub import hf_hub_download
+            config_path = hf_hub_download(extract_repo_id(str(model_path)), "config.json", token=hf_token)
+        else:
+            config_path = Path(model_path) / "config.json"
+        with open(config_path) as f:
+            return ModelSpec.from_config(json.load(f))
+    except Exception as e:
+        logger.warning(f"Could not read model config for {model_path}: {e}")
+        return None
+
+
+def plan_server_config(
+    model_path: Path | str,
+    profile: dict,
+    is_hf: bool = False,
+    hf_token: str | None = None,
+    **planner_kwargs,
+) -> Optional[ServerConfig]:
+    """Plan a server config, or None if the model's architecture is unknown."""
+    spec = load_model_spec(model_path, is_hf=is_hf, hf_token=hf_token)
+    if spec is None:
+        return None
+    if host_memory_bytes(profile)[0] <= 0:
+        logger.warning("Host profile has no memory information; skipping capacity planning.")
+        return None
+    return CapacityPlanner(spec, profile, **planner_kwargs).plan()
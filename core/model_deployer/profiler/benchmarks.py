@@ -0,0 +1,130 @@
+"""
+Hardware micro-benchmarks run on the profiled host.
+
+Each benchmark is a small python3 program fed to the interpreter on the target
+through a heredoc; it prints a single JSON object. Matmul uses torch when it is
+installed (GPU if available) and falls back to numpy; memory bandwidth and disk
+throughput only need the standard library.
+"""
+
+MATMUL_BENCHMARK = """
+import json, time
+
+def bench(fn, flops, min_time=0.5):
+    fn()
+    runs, start = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return round(flops * runs / elapsed / 1e9, 2)
+
+n = 1024
+flops = 2 * n ** 3
+results = {"fp32": None, "bf16": None, "int8": None, "device": "cpu", "backend": None}
+try:
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    sync = torch.cuda.synchronize if device == "cuda" else (lambda: None)
+    results.update(device=device, backend="torch")
+    for name, dtype in (("fp32", torch.float32), ("bf16", torch.bfloat16)):
+        try:
+            a = torch.randn(n, n, dtype=dtype, device=device)
+            b = torch.randn(n, n, dtype=dtype, device=device)
+            results[name] = bench(lambda: (a @ b, sync()), flops)
+        except Exception:
+            pass
+    try:
+        a = torch.randint(-128, 127, (n, n), dtype=torch.int8, device=device)
+        b = torch.randint(-128, 127, (n, n), dtype=torch.int8, device=device)
+        results["int8"] = bench(lambda: (torch._int_mm(a, b), sync()), flops)
+    except Exception:
+        pass
+except ImportError:
+    pass
+
+try:
+    import numpy as np
+    results["backend"] = results["backend"] or "numpy"
+    if results["fp32"] is None:
+        a = np.random.rand(n, n).astype(np.float32)
+        b = np.random.rand(n, n).astype(np.float32)
+        results["fp32"] = bench(lambda: a @ b, flops)
+    if results["int8"] is None:
+        m = 256
+        a = np.random.randint(-128, 127, (m, m), dtype=np.int8)
+        b = np.random.randint(-128, 127, (m, m), dtype=np.int8)
+        results["int8"] = bench(lambda: np.matmul(a, b, dtype=np.int32), 2 * m ** 3)
+except ImportError:
+    pass
+
+print(json.dumps(results))
+"""
+
+MEMORY_BENCHMARK = """
+import json, time
+
+size = 256 * 1024 * 1024
+src, dst = bytearray(size), bytearray(size)
+dst[:] = src
+runs, start = 0, time.perf_counter()
+while time.perf_counter() - start < 0.5:
+    dst[:] = src
+    runs += 1
+elapsed = time.perf_counter() - start
+# A copy reads and writes every byte.
+print(json.dumps({"copy_gbps": round(2 * size * runs / elapsed / 1e9, 2)}))
+"""
+
+DISK_BENCHMARK = """
+import json, os, time, tempfile
+
+size, chunk = 256 * 1024 * 1024, 8 * 1024 * 1024
+fd, path = tempfile.mkstemp(dir=os.path.expanduser("~"), prefix=".qa_disk_bench_")
+try:
+    block = os.urandom(chunk)
+    for _ in range(size // chunk):
+        os.write(fd, block)
+    os.fsync(fd)
+    os.close(fd)
+    fd = os.open(path, os.O_RDONLY)
+    # Evict the file from the page cache so we time the device, not RAM.
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    else:
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_NOCACHE, 1)
+    start = time.perf_counter()
+    while os.read(fd, chunk):
+        pass
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seq_read_mbps": round(size / elapsed / 1e6, 2)}))
+finally:
+    os.close(fd)
+    os.remove(path)
+"""
+
+
+def _python_heredoc(source: str) -> str:
+    return f"python3 - <<'QA_BENCH'\n{source.strip()}\nQA_BENCH"
+
+
+BENCHMARK_COMMANDS = {
+    "matmul_gflops": _python_heredoc(MATMUL_BENCHMARK),
+    "memory_bandwidth": _python_heredoc(MEMORY_BENCHMARK),
+    "disk_throughput": _python_heredoc(DISK_BENCHMARK),
+}
+
+
+def measured_gflops(profile: dict, precision: str) -> float | None:
+    """Measured matmul throughput for 'fp32', 'bf16' or 'int8', if the host was benchmarked."""
+    return (profile.get("benchmarks") or {}).get("matmul_gflops", {}).get(precision)
+
+
+def memory_bandwidth_gbps(profile: dict) -> float | None:
+    return (profile.get("benchmarks") or {}).get("memory_bandwidth", {}).get("copy_gbps")
+
+
+def disk_read_mbps(profile: dict) -> float | None:
+    return (profile.get("benchmarks") or {}).get("disk_throughput", {}).get("seq_read_mbps")
@@ -0,0 +1,95 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from core.common.ssh import SSHConfig
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".quantize_ai" / "profiles"
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def host_key(ssh_config: SSHConfig | None) -> str:
+    """Cache key for a host: its hostname (plus port if non-default), or 'localhost'."""
+    if ssh_config is None:
+        return "localhost"
+    if ssh_config.port and ssh_config.port != 22:
+        return f"{ssh_config.hostname}:{ssh_config.port}"
+    return ssh_config.hostname
+
+
+class ProfileCache:
+    """
+    Per-host hardware profile cache, one JSON file per host under cache_dir.
+
+    Entries older than ttl seconds are treated as missing. Writes go through a
+    temp file and os.replace, so concurrent profilers (threads or processes)
+    never observe a partially written profile.
+    """
+
+    def __init__(self, cache_dir: Path | str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{re.sub(r'[^A-Za-z0-9._-]', '_', key)}.json"
+
+    def lock(self, key: str) -> threading.Lock:
+        """Per-host lock, used to avoid profiling the same host twice at once."""
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                profile = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - profile.get("profiled_at", 0) > self.ttl:
+            return None
+        return profile
+
+    def put(self, key: str, profile: dict) -> dict:
+        profile = dict(profile, host=key, profiled_at=profile.get("profiled_at", time.time()))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(profile, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return profile
+
+    def invalidate(self, key: str | None = None):
+        """Drop one host's profile, or every cached profile if key is None."""
+        paths = [self._path(key)] if key else self.cache_dir.glob("*.json")
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def all(self) -> dict[str, dict]:
+        """All unexpired profiles, keyed by host."""
+        profiles = {}
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                with open(path) as f:
+                    profile = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if time.time() - profile.get("profiled_at", 0) <= self.ttl and "host" in profile:
+                profiles[profile["host"]] = profile
+        return profiles
+
+
+PROFILE_CACHE = ProfileCache()
@@ -17,16 +17,21 @@ COMMAND_PIPELINES = {
     "linux": {
         "kernel_name": "uname -s", 
         "machine": "uname -m",
+        "machine_id": "cat /etc/machine-id 2>/dev/null || hostname",
         "cpu_count": "nproc",  
+        "numa_cpulists": "cat /sys/devices/system/node/node*/cpulist 2>/dev/null",
+        "online_cpus": "cat /sys/devices/system/cpu/online 2>/dev/null",
         "memory_total": "free -g | grep \"Mem\" | awk \'{print $2}\'",
         "has_gpus": "nvidia-smi -L | wc -l",
         "gpu_count": "nvidia-smi --query-gpu=gpu_name --format=csv,noheader | wc -l",
         "gpu_info": "nvidia-smi --query-gpu=gpu_name --format=csv",
+        "gpu_memory_total": "nvidia-smi --query-gpu=memory.total --format=csv,noheader,nounits",
         "free_disk_space": "df -h | grep \"/$\" | awk \'{print substr($4, 1, length($4)-1)}\'"
     }, 
     "mac_os": {
         "kernel_name": "uname -s", 
         "machine": "uname -m",
+        "machine_id": "ioreg -rd1 -c IOPlatformExpertDevice | awk -F\'\"\' \'/IOPlatformUUID/{print $4}\'",
         "cpu_count": "sysctl -n hw.ncpu",
         "memory_total": "sysctl -n hw.memsize",
         "gpu_info": "system_profiler SPDisplaysDataType",
@@ -1,20 +1,24 @@
-import os
-import subprocess
 import json
+import subprocess
 from core.model_deployer.profiler.commands import (
     OS_COMMANDS, 
     SUPPORTED_LINUX_DISTROS
 )
+from core.model_deployer.profiler.benchmarks import BENCHMARK_COMMANDS
 from core.common.ssh import SSHConfig, SSH 
+from core.common.batch_exec import run_batch, CommandResult
 from core.common.logger import Logger 
+from core.model_deployer.profiler.cache import ProfileCache, PROFILE_CACHE, host_key
 
 
 logger = Logger(__name__, log_level="INFO", console_output=True)
 
 class Profiler: 
-    def __init__(self, ssh_config: SSHConfig = None):
+    def __init__(self, ssh_config: SSHConfig = None, cache: ProfileCache = PROFILE_CACHE):
         self.is_remote = ssh_config is not None
-        self.conn = SSH.connect(ssh_config) if ssh_config else None 
+        self.host_key = host_key(ssh_config)
+        self.cache = cache
+        self.conn = SSH.acquire(ssh_config) if ssh_config else None 
 
     def _run_command(self, command: str) -> tuple[str, str]: 
         if self.is_remote: 
@@ -29,6 +33,11 @@ class Profiler:
             print(f"Remote command error: {e}")
             return None, None
     
+    def _run_commands(self, commands: dict[str, str], remote: bool | None = None) -> dict[str, CommandResult]:
+        """Run a named set of commands in a single round trip."""
+        remote = self.is_remote if remote is None else remote
+        return run_batch(self.conn if remote else None, commands)
+
     def _run_local_command(self, command: str) -> tuple[str, str]: 
         try:
             result = subprocess.run(
@@ -44,12 +53,16 @@ class Profiler:
             return None, None
     
     def _infer_os(self) -> str: 
-        out, _ = self._run_command("uname -s")
+        results = self._run_commands({
+            "kernel": "uname -s",
+            "distro": "cat /etc/os-release | grep ^ID=",
+        })
+        out = results["kernel"].stdout
         if out:
             if out == "Darwin":
                 return "mac_os"
             elif out == "Linux":
-                out, _ = self._run_command("cat /etc/os-release | grep ^ID=")
+                out = results["distro"].stdout
                 if out:
                     distro = out.split('=')[1].strip('"')
                     if distro in SUPPORTED_LINUX_DISTROS:
@@ -66,19 +79,17 @@ class Profiler:
     def _verify_environment(self):
         def verify_local_env(): 
             logger.info("Verifying local environment.")
-            for tool in ["docker", "rsync"]:
-                cmd = f"command -v {tool}"
-                out, error = self._run_local_command(cmd)
-                if error: 
+            results = self._run_commands({tool: f"command -v {tool}" for tool in ["docker", "rsync"]}, remote=False)
+            for tool, result in results.items():
+                if not result.ok: 
                     logger.error(f"{tool} is not installed. Please install {tool} and try again.")
                     raise EnvironmentError(f"{tool} is not installed. Please install {tool} and try again.")
 
         def verify_remote_env(): 
             logger.info("Verifying remote environment.")
-            for tool in ["docker", "sudo"]:
-                cmd = f"command -v {tool}"
-                out, error = self._run_remote_command(cmd)
-                if error: 
+            results = self._run_commands({tool: f"command -v {tool}" for tool in ["docker", "sudo"]}, remote=True)
+            for tool, result in results.items():
+                if not result.ok: 
                     logger.error(f"{tool} is not installed. Please install {tool} and try again.")
                     raise EnvironmentError(f"{tool} is not installed. Please install {tool} and try again.")
         
@@ -87,20 +98,53 @@ class Profiler:
             verify_remote_env() 
         logger.info("Remote environment verification complete.")
         
-    def profile(self) -> dict[str, str]: 
-        self._verify_environment()
+    def benchmark(self) -> dict[str, dict]:
+        """Run the hardware micro-benchmarks on the target in one round trip."""
+        logger.info("Running hardware benchmarks.")
+        benchmarks = {}
+        for name, result in self._run_commands(BENCHMARK_COMMANDS).items():
+            try:
+                benchmarks[name] = json.loads(result.stdout) if result.ok else {}
+            except json.JSONDecodeError:
+                benchmarks[name] = {}
+            if not result.ok:
+                logger.warning(f"Benchmark {name} failed: {result.stderr}")
+        return benchmarks
+
+    def profile(self, run_benchmarks: bool = True) -> dict[str, str]: 
+        try:
+            self._verify_environment()
 
-        os_id = self._infer_os()
-        if os_id not in OS_COMMANDS.keys(): 
-            raise NotImplemented(f"We currently do not support {os_id}.")
+            os_id = self._infer_os()
+            if os_id not in OS_COMMANDS.keys(): 
+                raise NotImplemented(f"We currently do not support {os_id}.")
 
-        info = {'os': os_id}
-        info.update({desc: self._run_command(command)[0] for desc, command in OS_COMMANDS[os_id].items()})
+            info = {'os': os_id}
+            results = self._run_commands(OS_COMMANDS[os_id])
+            info.update({desc: result.stdout for desc, result in results.items()})
+            if run_benchmarks and os_id != "windows":
+                info["benchmarks"] = self.benchmark()
 
-        # Write info to internal .json file
-        profile_path = os.path.expanduser("~/prof.json")
-        with open(profile_path, "w") as f:
-            json.dump(info, f)
-        
-        self.conn.close()
-        return info
+            # Write info to this host's entry in the profile cache
+            return self.cache.put(self.host_key, info)
+        finally:
+            # Return the pooled connection even when profiling fails
+            if self.conn:
+                self.conn.close()
+
+
+def get_host_profile(
+    ssh_config: SSHConfig | None = None, 
+    cache: ProfileCache = PROFILE_CACHE, 
+    refresh: bool = False,
+) -> dict:
+    """Return the cached profile for a host, profiling it first if missing, expired or refresh is set."""
+    key = host_key(ssh_config)
+    with cache.lock(key):
+        if not refresh:
+            cached = cache.get(key)
+            if cached:
+                logger.info(f"Using cached profile for {key}.")
+                return cached
+        logger.info(f"Profiling {key}.")
+        return Profiler(ssh_config, cache=cache).profile()